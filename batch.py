@@ -0,0 +1,201 @@
+import os
+import json
+import time
+import asyncio
+import argparse
+
+import startup
+from metrics import dump_metrics
+from graph import compile_graph, initialize_state
+from warm_start import remember_approved
+
+
+startup.load_config()
+
+DEFAULT_WORKERS = 4
+
+# Поля входного JSONL, из которых берется описание проекта и идентификатор
+TEXT_FIELDS = ("project_description", "description", "body", "text")
+ID_FIELDS = ("id", "request_id")
+
+
+def read_items(path: str, text_field: str | None = None, id_field: str | None = None) -> list:
+    """
+    Задания из JSONL: список (item_id, project_description).
+
+    Без явных полей описание берется из первого найденного поля TEXT_FIELDS
+    (title добавляется к body, если есть), id - из ID_FIELDS или номера строки.
+    """
+
+    items = []
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+
+            if text_field:
+                text = record.get(text_field)
+            else:
+                text = next((record[k] for k in TEXT_FIELDS if record.get(k)), None)
+                if text and record.get("title") and "body" in record:
+                    text = f"{record['title']}\n\n{text}"
+            if not text:
+                print(f"[BATCH] Line {line_no}: no project description, skipped")
+                continue
+
+            keys = (id_field,) if id_field else ID_FIELDS
+            item_id = next((str(record[k]) for k in keys if record.get(k) is not None), f"line-{line_no}")
+            items.append((item_id, text))
+
+    return items
+
+
+def finished_ids(path: str) -> set:
+    """ id заданий, уже записанных в выходной файл без ошибки (для продолжения после сбоя) """
+
+    done = set()
+    if not os.path.exists(path):
+        return done
+
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Строка, оборванная при падении процесса
+                continue
+            if record.get("status") != "error":
+                done.add(record.get("id"))
+            else:
+                done.discard(record.get("id"))
+    return done
+
+
+async def run_item(app, item_id: str, text: str, thread_prefix: str) -> dict:
+    """
+    Прогон одного описания через цикл аналитик/критик с автоматическим утверждением.
+
+    Поток (thread_id) детерминирован по id задания: после сбоя незавершенный
+    прогон продолжается с последнего чекпоинта, а не начинается заново. Прогон,
+    закончившийся ошибкой (нет артефакта или llm_error), начинается с нуля.
+    """
+
+    thread_id = f"{thread_prefix}:{item_id}"
+    config = {"configurable": {"thread_id": thread_id}}
+    started = time.perf_counter()
+
+    snapshot = await app.aget_state(config)
+    failed = not snapshot.values.get("draft_artifact") or snapshot.values.get("llm_error")
+    if snapshot.values and failed and (not snapshot.next or "human" in snapshot.next):
+        # Повтор задания с ошибкой: старый поток дошел до человека и сам не перезапустится
+        print(f"[BATCH] {item_id}: retrying failed run from scratch")
+        await app.checkpointer.adelete_thread(thread_id)
+        snapshot = await app.aget_state(config)
+
+    if not snapshot.values:
+        await app.ainvoke(initialize_state(text), config=config)
+    elif snapshot.next and "human" not in snapshot.next:
+        await app.ainvoke(None, config=config)
+    # Иначе прогон уже дошел до утверждения (или завершен) до сбоя
+
+    snapshot = await app.aget_state(config)
+    values = snapshot.values
+    artifact = values.get("draft_artifact")
+
+    if artifact and "human" in snapshot.next:
+        # Автоутверждение: фиксируем решение "человека", поток завершается
+        await app.aupdate_state(config, {
+            "user_feedback": "APPROVED",
+            "user_has_provided_feedback": False,
+        }, as_node="human")
+
+    if not artifact:
+        status = "error"
+    elif values.get("critic_verdict") == "OK":
+        status = "approved"
+        # В индекс теплого старта - только принятые критиком артефакты
+        remember_approved(values)
+    else:
+        status = "needs_review"
+
+    return {
+        "id": item_id,
+        "thread_id": thread_id,
+        "status": status,
+        "critic_verdict": values.get("critic_verdict"),
+        "critic_feedback": values.get("critic_feedback", ""),
+        "revision_count": values.get("revision_count", 0),
+        "elapsed": round(time.perf_counter() - started, 3),
+        "project_description": text,
+        "artifact": artifact,
+        "error": values.get("llm_error") or (None if artifact else "Аналитик не сформировал артефакт"),
+    }
+
+
+async def run_batch(input_path: str, output_path: str, workers: int = DEFAULT_WORKERS,
+                    text_field: str | None = None, id_field: str | None = None,
+                    thread_prefix: str = "batch") -> dict:
+    """
+    Пакетная обработка JSONL с описаниями проектов.
+
+    Одновременно выполняется не более workers сессий; результаты дописываются
+    в output_path по мере готовности. Повторный запуск пропускает задания,
+    уже записанные в output_path без ошибки.
+    """
+
+    items = read_items(input_path, text_field, id_field)
+    done = finished_ids(output_path)
+    todo = [(item_id, text) for item_id, text in items if item_id not in done]
+
+    print(f"[BATCH] {len(items)} items, {len(items) - len(todo)} already done, {len(todo)} to run ({workers} workers)")
+
+    app = compile_graph()
+    semaphore = asyncio.Semaphore(workers)
+    counts = {"approved": 0, "needs_review": 0, "error": 0}
+    started = time.perf_counter()
+
+    with open(output_path, "a", encoding="utf-8") as out:
+
+        async def worker(item_id: str, text: str):
+            async with semaphore:
+                try:
+                    result = await run_item(app, item_id, text, thread_prefix)
+                except Exception as e:
+                    result = {"id": item_id, "status": "error", "project_description": text, "error": str(e)}
+
+            # Запись целой строкой + flush: при сбое теряется максимум незаконченная строка
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+
+            counts[result["status"]] += 1
+            print(f"[BATCH] {item_id}: {result['status']} ({sum(counts.values())}/{len(todo)})")
+
+        await asyncio.gather(*(worker(item_id, text) for item_id, text in todo))
+
+    elapsed = time.perf_counter() - started
+    print(f"[BATCH] Finished in {elapsed:.1f}s: {counts}")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетная генерация ТЗ по описаниям проектов из JSONL")
+    parser.add_argument("input", help="JSONL с описаниями проектов")
+    parser.add_argument("-o", "--output", default="batch_results.jsonl", help="JSONL с результатами")
+    parser.add_argument("-w", "--workers", type=int, default=int(os.getenv("BATCH_WORKERS", DEFAULT_WORKERS)),
+                        help="Число одновременно обрабатываемых описаний")
+    parser.add_argument("--text-field", help="Поле с описанием проекта")
+    parser.add_argument("--id-field", help="Поле с идентификатором задания")
+    parser.add_argument("--thread-prefix", default="batch", help="Префикс thread_id в чекпоинтере")
+    parser.add_argument("--metrics", help="Файл для метрик узлов (*.json или текст Prometheus)")
+    args = parser.parse_args()
+
+    asyncio.run(run_batch(args.input, args.output, args.workers,
+                          args.text_field, args.id_field, args.thread_prefix))
+
+    if args.metrics:
+        dump_metrics(args.metrics)
+
+
+if __name__ == "__main__":
+    main()
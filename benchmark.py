@@ -0,0 +1,192 @@
+import json
+import time
+import asyncio
+import argparse
+from functools import partial
+
+from metrics import registry
+from fake_llm import FakeChatModel
+from llm_clients import set_model_factory
+from resilience import reset_resilience
+from checkpointer import create_checkpointer
+from graph import compile_graph, initialize_state
+
+
+TECHNICAL_ERROR_PREFIX = "Произошла техническая ошибка"
+
+
+def fake_model_factory(latency: float, critic_script: list, analyst_script: list, requirements: int,
+                       model: str, temperature: float, cache: bool, fail_rate: float = 0.0, slow_rate: float = 0.0):
+    # Кэш ответов выключен: сценарий должен отыгрываться на каждом вызове
+    return FakeChatModel(model=model, latency=latency, critic_script=critic_script,
+                         analyst_script=analyst_script, requirements=requirements, cache=False,
+                         fail_rate=fail_rate, slow_rate=slow_rate)
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def run_session(app, thread_id: str, node_times: dict) -> dict:
+    """ Одна сессия до остановки перед человеком; время узла - интервал между его обновлениями """
+
+    config = {"configurable": {"thread_id": thread_id}}
+    parse_failures = llm_errors = 0
+    values = {}
+
+    last = time.perf_counter()
+    async for update in app.astream(initialize_state("Сервис подбора кандидатов"), config=config,
+                                    stream_mode="updates"):
+        now = time.perf_counter()
+        for node, values in update.items():
+            if not isinstance(values, dict):
+                continue
+            node_times.setdefault(node, []).append(now - last)
+
+            if values.get("llm_error"):
+                llm_errors += 1
+            elif node == "analyst" and values.get("draft_artifact") is None:
+                parse_failures += 1
+            elif node == "critic" and (values.get("critic_feedback") or "").startswith(TECHNICAL_ERROR_PREFIX):
+                parse_failures += 1
+        last = now
+
+    state = (await app.aget_state(config)).values
+    return {
+        "iterations": state.get("revision_count", 0) + 1,
+        "parse_failures": parse_failures,
+        "llm_errors": llm_errors,
+        "verdict": state.get("critic_verdict"),
+    }
+
+
+async def run_level(app, sessions: int, concurrency: int) -> dict:
+    """ sessions сессий, не более concurrency одновременно """
+
+    registry.reset()
+    semaphore = asyncio.Semaphore(concurrency)
+    node_times = {}
+    session_times = []
+
+    async def one(i: int):
+        async with semaphore:
+            started = time.perf_counter()
+            result = await run_session(app, f"bench-c{concurrency}-{i}", node_times)
+            session_times.append(time.perf_counter() - started)
+            return result
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(one(i) for i in range(sessions)))
+    wall = time.perf_counter() - started
+
+    return {
+        "concurrency": concurrency,
+        "sessions": sessions,
+        "wall_seconds": round(wall, 4),
+        "sessions_per_second": round(sessions / wall, 2) if wall else 0.0,
+        "session_p50": round(percentile(session_times, 0.5), 4),
+        "session_p95": round(percentile(session_times, 0.95), 4),
+        "iterations_mean": round(sum(r["iterations"] for r in results) / sessions, 2),
+        "parse_failures": sum(r["parse_failures"] for r in results),
+        "llm_errors": sum(r["llm_errors"] for r in results),
+        "approved": sum(r["verdict"] == "OK" for r in results),
+        "nodes": {
+            node: {
+                "calls": len(times),
+                "mean": round(sum(times) / len(times), 4),
+                "p50": round(percentile(times, 0.5), 4),
+                "p95": round(percentile(times, 0.95), 4),
+            }
+            for node, times in sorted(node_times.items())
+        },
+        # Токены и ошибки парсинга по узлам из metrics.registry
+        "metrics": registry.to_json()["nodes"],
+    }
+
+
+async def run_benchmark(sessions: int = 20, concurrency_levels: tuple = (1, 4, 16), latency: float = 0.05,
+                        critic_script: tuple = ("REVISE", "OK"), analyst_script: tuple = ("OK",),
+                        requirements: int = 8, checkpointer: str = "memory",
+                        fail_rate: float = 0.0, slow_rate: float = 0.0, **graph_options) -> list:
+    """
+    Прогон compile_graph() на локальной модели-заглушке при разных уровнях параллельности.
+
+    Возвращает отчет по каждому уровню: sessions/sec, задержки узлов, число итераций
+    на сессию, ошибок парсинга и недоступности LLM (fail_rate / slow_rate - сбои заглушки).
+    Теплый старт выключен, если не передан warm_start=True: бенчмарк не должен
+    создавать и читать индекс warm_start.sqlite.
+    """
+
+    graph_options.setdefault("warm_start", False)
+    reset_resilience()
+    set_model_factory(partial(fake_model_factory, latency, list(critic_script), list(analyst_script), requirements,
+                              fail_rate=fail_rate, slow_rate=slow_rate))
+    try:
+        app = compile_graph(create_checkpointer(checkpointer), **graph_options)
+        return [await run_level(app, sessions, concurrency) for concurrency in concurrency_levels]
+    finally:
+        set_model_factory(None)
+
+
+def format_report(levels: list) -> str:
+    lines = []
+    for level in levels:
+        lines.append(
+            f"concurrency={level['concurrency']:<3} sessions={level['sessions']:<4} "
+            f"{level['sessions_per_second']:>8} sess/s  wall={level['wall_seconds']}s  "
+            f"session p50={level['session_p50']}s p95={level['session_p95']}s  "
+            f"iterations={level['iterations_mean']}  parse_failures={level['parse_failures']}  "
+            f"llm_errors={level['llm_errors']}"
+        )
+        for node, stats in level["nodes"].items():
+            lines.append(
+                f"    {node:<10} calls={stats['calls']:<5} mean={stats['mean']}s "
+                f"p50={stats['p50']}s p95={stats['p95']}s"
+            )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк графа на локальной модели-заглушке")
+    parser.add_argument("--sessions", type=int, default=20, help="Сессий на каждый уровень параллельности")
+    parser.add_argument("--concurrency", default="1,4,16", help="Уровни параллельности через запятую")
+    parser.add_argument("--latency", type=float, default=0.05, help="Задержка ответа модели (секунды)")
+    parser.add_argument("--critic-script", default="REVISE,OK", help="Сценарий критика: OK / REVISE / BAD")
+    parser.add_argument("--analyst-script", default="OK", help="Сценарий аналитика: OK / BAD")
+    parser.add_argument("--requirements", type=int, default=8, help="Число требований в артефакте")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Доля вызовов модели с ошибкой соединения")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Доля вызовов модели с длинной задержкой")
+    parser.add_argument("--checkpointer", default="memory", choices=["memory", "sqlite"])
+    parser.add_argument("--critic-chunk-size", type=int, default=None)
+    parser.add_argument("--speculative-drafts", type=int, default=None, help="Кандидатов аналитика параллельно")
+    parser.add_argument("--speculative-cancel", default=None, choices=["cancel", "wait"])
+    parser.add_argument("--json", help="Сохранить отчет в JSON-файл")
+    args = parser.parse_args()
+
+    levels = asyncio.run(run_benchmark(
+        sessions=args.sessions,
+        concurrency_levels=tuple(int(c) for c in args.concurrency.split(",")),
+        latency=args.latency,
+        critic_script=tuple(args.critic_script.split(",")),
+        analyst_script=tuple(args.analyst_script.split(",")),
+        requirements=args.requirements,
+        checkpointer=args.checkpointer,
+        fail_rate=args.fail_rate,
+        slow_rate=args.slow_rate,
+        critic_chunk_size=args.critic_chunk_size,
+        speculative_drafts=args.speculative_drafts,
+        speculative_cancel=args.speculative_cancel,
+    ))
+
+    print(format_report(levels))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(levels, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,166 +1,381 @@
 import os
-import telebot
-from dotenv import load_dotenv
-from graph import compile_graph
+import html
+import time
+import asyncio
+import startup
 
-load_dotenv()
+with startup.phase("import telebot"):
+    from telebot import asyncio_helper
+    from telebot.async_telebot import AsyncTeleBot
+
+from budget import STOP_REASONS
+from chat_queue import ChatQueue
+from warm_start import remember_approved
+from renderer import render, document, document_name, split_message, plain_text
+
+startup.load_config()
 
 TG_TOKEN = os.getenv("TG_BOT_TOKEN")
 if not TG_TOKEN:
     print("Не задан TG_BOT_TOKEN в .env или коде")
     exit()
 
-bot = telebot.TeleBot(TG_TOKEN)
-app = compile_graph()
+# Минимальный интервал между правками сообщения о ходе работы (лимиты Telegram)
+PROGRESS_EDIT_INTERVAL = float(os.getenv("PROGRESS_EDIT_INTERVAL", 1.5))
+
+# Сессии, неактивные дольше SESSION_TTL секунд, удаляются вместе с чекпоинтами
+SESSION_TTL = float(os.getenv("SESSION_TTL", 24 * 60 * 60))
+EVICTION_INTERVAL = float(os.getenv("SESSION_EVICTION_INTERVAL", 10 * 60))
+
+APPROVAL_WORDS = ('ок', 'ok', 'хорошо', 'спасибо')
+
+# Прогонов графа одновременно на процесс (0 - без ограничения)
+MAX_ACTIVE_CHATS = int(os.getenv("BOT_MAX_ACTIVE_CHATS", 0))
+
+# Адрес Bot API: для локального сервера Bot API или тестового стенда
+TG_API_URL = os.getenv("TG_API_URL")
+if TG_API_URL:
+    asyncio_helper.API_URL = TG_API_URL.rstrip("/") + "/bot{0}/{1}"
+
+bot = AsyncTeleBot(TG_TOKEN)
+
+# Граф (langgraph, langchain, LLM-клиент) загружается в фоне после старта: бот сразу
+# принимает сообщения, а первый прогон ждет окончания загрузки
+_graph_task: asyncio.Task | None = None
 
 user_sessions = {}
 
 
-def render_markdown(artifact: dict) -> str:
-    """Генерация текста для сохранения в файл (полный Markdown)"""
-    if not artifact: return "Нет данных"
+def load_graph():
+    """ Импорт стека графа и LLM и компиляция графа процесса (в потоке) """
 
-    title = artifact.get('title', artifact.get('project_name', 'Проект'))
-    text = f"# {title}\n\n"
-    text += f"## Описание\n{artifact.get('description', '')}\n\n"
-    text += "## Цели\n" + "\n".join([f"- {g}" for g in artifact.get('goals', [])]) + "\n\n"
-    text += "## Функциональные требования\n"
+    with startup.phase("import graph"):
+        import graph
+    with startup.phase("compile graph"):
+        app = graph.get_app()
+    with startup.phase("import LLM client"):
+        # ChatOpenAI грузится лениво; загружаем заранее, чтобы не платить за это в первом запросе
+        import langchain_openai  # noqa: F401
+    return app
 
-    reqs = artifact.get('functional_requirements') or artifact.get('requirements') or []
-    for r in reqs:
-        r_id = r.get('id') if isinstance(r, dict) else getattr(r, 'id', 'N/A')
-        r_desc = r.get('description') if isinstance(r, dict) else getattr(r, 'description', '')
-        text += f"- **{r_id}**: {r_desc}\n"
 
-    return text
+async def get_app():
+    """ Скомпилированный граф процесса: первый вызов запускает загрузку, остальные ждут ее """
 
+    global _graph_task
 
-def render_message_text(artifact: dict) -> str:
-    """Генерация текста для сообщения в Telegram (упрощенное форматирование)"""
-    if not artifact: return "⚠️ Данные отсутствуют."
+    if _graph_task is None:
+        _graph_task = asyncio.create_task(asyncio.to_thread(load_graph))
+    return await asyncio.shield(_graph_task)
 
-    title = artifact.get('title', artifact.get('project_name', 'Проект'))
 
-    msg = f"📋 **{title}**\n\n"
-    msg += f"ℹ️ *Описание:*\n{artifact.get('description', 'Не указано')}\n\n"
+async def warm_up():
+    await get_app()
+    print(startup.startup_report("graph ready"))
 
-    msg += "🎯 *Цели:*\n"
-    for g in artifact.get('goals', []):
-        msg += f"— {g}\n"
 
-    msg += "\n⚙️ *Требования:*\n"
-    reqs = artifact.get('functional_requirements') or artifact.get('requirements') or []
+def new_session(chat_id) -> dict:
+    return {"thread_id": str(chat_id), "last_seen": time.time()}
 
-    for r in reqs:
-        r_id = r.get('id') if isinstance(r, dict) else getattr(r, 'id', 'N/A')
-        r_desc = r.get('description') if isinstance(r, dict) else getattr(r, 'description', '')
-        msg += f"• *{r_id}*: {r_desc}\n"
 
-    return msg
+async def session_active(config: dict) -> bool:
+    """
+    Идет ли в чате работа над проектом (граф ждет отзыва человека).
 
+    Признак берется из чекпоинтера, а не из памяти процесса: в режиме webhook
+    чат может продолжить любой рабочий процесс.
+    """
 
-@bot.message_handler(commands=['start'])
-def send_welcome(message):
+    app = await get_app()
+    snapshot = await app.aget_state(config)
+    return bool(snapshot.values.get("draft_artifact")) and "human" in snapshot.next
+
+
+async def evict_idle_sessions():
+    """ Периодически вычищает простаивающие потоки из чекпоинтера и user_sessions """
+
+    while True:
+        await asyncio.sleep(EVICTION_INTERVAL)
+
+        try:
+            checkpointer = (await get_app()).checkpointer
+            evicted = set()
+            if hasattr(checkpointer, "evict_idle_threads"):
+                evicted.update(await asyncio.to_thread(checkpointer.evict_idle_threads, SESSION_TTL))
+
+            deadline = time.time() - SESSION_TTL
+            for chat_id, session in list(user_sessions.items()):
+                if session["thread_id"] in evicted:
+                    user_sessions.pop(chat_id, None)
+                elif session["last_seen"] < deadline:
+                    await checkpointer.adelete_thread(session["thread_id"])
+                    user_sessions.pop(chat_id, None)
+
+        except Exception as e:
+            print(f"Error during session eviction: {e}")
+
+
+class ProgressMessage:
+    """ Одно сообщение о ходе работы графа, обновляемое на месте не чаще PROGRESS_EDIT_INTERVAL """
+
+    def __init__(self, message):
+        self.message = message
+        self.sent = None
+        self.steps = []
+        self.requirements = []
+        self.last_edit = 0.0
+        self.dirty = False
+        self.scheduled = False
+
+    def render(self) -> str:
+        text = "\n".join(self.steps)
+        if self.requirements:
+            text += "\n\n⚙️ Требования:\n" + "\n".join(
+                f"• {r.get('id', '')}: {r.get('description', '')}" for r in self.requirements
+            )
+        if len(text) > 4000:
+            text = text[:3990] + "\n..."
+        return text
+
+    async def step(self, text: str, requirements: list | None = None):
+        self.steps.append(text)
+        if requirements is not None:
+            self.requirements = requirements
+        self.dirty = True
+        await self.flush(force=self.sent is None)
+
+    async def requirement(self, requirement: dict):
+        """ Требование, готовое в потоке аналитика до конца генерации """
+
+        self.requirements.append(requirement)
+        self.dirty = True
+        await self.flush(force=False)
+
+    async def flush(self, force: bool = True):
+        if not self.dirty:
+            return
+
+        wait = PROGRESS_EDIT_INTERVAL - (time.monotonic() - self.last_edit)
+        if not force and wait > 0:
+            # Отложенная правка, чтобы последний шаг не ждал следующего события
+            if not self.scheduled:
+                self.scheduled = True
+                asyncio.get_running_loop().call_later(wait, lambda: asyncio.ensure_future(self._deferred_flush()))
+            return
+
+        text = self.render()
+        try:
+            if self.sent is None:
+                self.sent = await bot.reply_to(self.message, text)
+            else:
+                await bot.edit_message_text(text, self.sent.chat.id, self.sent.message_id)
+        except Exception as e:
+            print(f"Progress update failed: {e}")
+
+        self.last_edit = time.monotonic()
+        self.dirty = False
+
+    async def _deferred_flush(self):
+        self.scheduled = False
+        await self.flush()
+
+
+async def run_with_progress(message, graph_input: dict, config: dict, first_step: str):
+    """ Прогон графа через app.astream с показом шагов и требований по мере готовности """
+
+    app = await get_app()
+    progress = ProgressMessage(message)
+    await progress.step(first_step)
+
+    revision = 0
+    async for mode, update in app.astream(graph_input, config=config, stream_mode=["updates", "custom"]):
+        if mode == "custom":
+            if isinstance(update, dict) and update.get("requirement"):
+                await progress.requirement(update["requirement"])
+            continue
+
+        for node, values in update.items():
+            if not isinstance(values, dict):
+                continue
+
+            if values.get("llm_error"):
+                await progress.step("⚠️ Модель сейчас недоступна, попробуйте позже")
+
+            elif node == "warm_start" and values.get("warm_start"):
+                await progress.step("♻️ Нашелся похожий утвержденный проект: беру его за основу")
+
+            elif node == "analyst":
+                artifact = values.get("draft_artifact")
+                if artifact:
+                    reqs = artifact.get("functional_requirements", [])
+                    await progress.step(f"📝 Аналитик подготовил версию {revision + 1} (требований: {len(reqs)})", reqs)
+                else:
+                    await progress.step("⚠️ Аналитик не смог сформировать черновик")
+
+            elif node == "critic" and values.get("critic_verdict"):
+                if values.get("critic_verdict") == "OK":
+                    await progress.step("✅ Критик: замечаний нет")
+                else:
+                    await progress.step("🔍 Критик: нужна доработка")
+
+            elif node == "budget":
+                await progress.step(f"⏱ Доработки остановлены: {STOP_REASONS[values['budget_stop']]}")
+
+            elif node == "increment":
+                revision = values.get("revision_count", revision)
+                await progress.step(f"🔄 Доработка №{revision}...", [])
+
+    await progress.flush()
+
+
+async def send_welcome(message):
     chat_id = message.chat.id
-    user_sessions[chat_id] = {"is_active": False, "thread_id": str(chat_id)}
+    user_sessions[chat_id] = new_session(chat_id)
+    app = await get_app()
+    await app.checkpointer.adelete_thread(user_sessions[chat_id]["thread_id"])
 
-    bot.reply_to(message,
-                 "👋 Привет! Я AI-Бизнес-аналитик.\n\n"
-                 "Напиши мне идею своего проекта (например: 'Хочу сервис доставки еды дронами'), "
-                 "и я подготовлю ТЗ с функциональными требованиями.")
+    await bot.reply_to(message,
+                       "👋 Привет! Я AI-Бизнес-аналитик.\n\n"
+                       "Напиши мне идею своего проекта (например: 'Хочу сервис доставки еды дронами'), "
+                       "и я подготовлю ТЗ с функциональными требованиями.")
 
 
-@bot.message_handler(func=lambda message: True)
-def handle_message(message):
+async def process_message(message, user_text: str):
     chat_id = message.chat.id
-    user_text = message.text.strip()
 
     if chat_id not in user_sessions:
-        user_sessions[chat_id] = {"is_active": False, "thread_id": str(chat_id)}
+        user_sessions[chat_id] = new_session(chat_id)
 
     session = user_sessions[chat_id]
+    session["last_seen"] = time.time()
     thread_id = session["thread_id"]
     config = {"configurable": {"thread_id": thread_id}}
 
-    if session["is_active"] and user_text.lower() in ['ок', 'ok', 'хорошо', 'спасибо']:
-        bot.send_chat_action(chat_id, 'upload_document')
+    app = await get_app()
+    is_active = await session_active(config)
+
+    if is_active and user_text.lower() in APPROVAL_WORDS:
+        await bot.send_chat_action(chat_id, 'upload_document')
 
         try:
-            current_state = app.get_state(config)
+            current_state = await app.aget_state(config)
             artifact = current_state.values.get('draft_artifact')
 
             if artifact:
-                md_content = render_markdown(artifact)
-                filename = f"Project_{chat_id}.md"
-
-                with open(filename, "w", encoding="utf-8") as f:
-                    f.write(md_content)
-
-                with open(filename, "rb") as f:
-                    bot.send_document(chat_id, f, caption="✅ Проект утвержден! Вот ваш итоговый файл.")
-
-                os.remove(filename)
+                # Файлы собираются в памяти; Markdown этой версии уже отрисован для предпросмотра
+                await bot.send_document(chat_id, document(artifact, "markdown"),
+                                        visible_file_name=document_name(f"Project_{chat_id}", "markdown"),
+                                        caption="✅ Проект утвержден! Вот ваш итоговый файл.")
+                await bot.send_document(chat_id, document(artifact, "json"),
+                                        visible_file_name=document_name(f"Project_{chat_id}", "json"),
+                                        caption="То же описание в JSON")
             else:
-                bot.send_message(chat_id, "⚠️ Ошибка: Артефакт потерян. Начните заново с /start")
+                await bot.send_message(chat_id, "⚠️ Ошибка: Артефакт потерян. Начните заново с /start")
+
+            # Решение человека фиксируется в чекпоинте: поток графа завершается
+            await app.aupdate_state(config, {
+                "user_feedback": "APPROVED",
+                "user_has_provided_feedback": False,
+            }, as_node="human")
+            remember_approved(current_state.values)
 
         except Exception as e:
-            bot.send_message(chat_id, f"Ошибка при сохранении: {e}")
+            await bot.send_message(chat_id, f"Ошибка при сохранении: {e}")
 
-        session["is_active"] = False
         return
 
-    bot.send_chat_action(chat_id, 'typing')
+    await bot.send_chat_action(chat_id, 'typing')
 
     try:
-        if not session["is_active"]:
-            bot.reply_to(message, "🚀 Принято! Анализирую идею, консультируюсь с Критиком... Это займет секунд 10-20.")
-
-            initial_state = {
-                "project_description": user_text,
-                "draft_artifact": None,
-                "critic_feedback": "",
-                "critic_verdict": None,
-                "revision_count": 0,
-                "user_feedback": "",
-                "user_has_provided_feedback": False,
-            }
-            app.invoke(initial_state, config=config)
-            session["is_active"] = True
+        if not is_active:
+            from graph import initialize_state
+            await run_with_progress(message, initialize_state(user_text), config,
+                                    "🚀 Принято! Аналитик готовит черновик, затем его проверит Критик...")
 
         else:
-            bot.reply_to(message, f"🔄 Принято: '{user_text}'. Отправляю на доработку Аналитику...")
-
-            app.invoke({
+            await run_with_progress(message, {
                 "user_feedback": user_text,
                 "user_has_provided_feedback": True,
                 "critic_verdict": None
-            }, config=config)
+            }, config, f"🔄 Принято: '{user_text}'. Отправляю на доработку Аналитику...")
 
-        current_state = app.get_state(config)
+        current_state = await app.aget_state(config)
         artifact = current_state.values.get('draft_artifact')
 
         if artifact:
-            msg_text = render_message_text(artifact)
-
-            if len(msg_text) > 4000:
-                msg_text = msg_text[:3500] + "\n\n... (Текст сокращен, полная версия будет в файле) ..."
-
-            try:
-                bot.send_message(chat_id, msg_text, parse_mode="Markdown")
-            except Exception as e:
-                bot.send_message(chat_id, msg_text)
-
-            bot.send_message(chat_id,
-                             "Выше текущая версия проекта ⬆️\n\n"
-                             "Если все нравится — напишите **'ОК'**, и я пришлю файл.\n"
-                             "Если нужны правки — напишите, что изменить.", parse_mode="Markdown")
+            msg_text = render(artifact, "telegram")
+            if current_state.values.get("llm_error"):
+                msg_text += "\n\n⚠️ Модель недоступна: эта версия не проверена Критиком."
+            elif current_state.values.get("critic_verdict") == "REVISE" and current_state.values.get("critic_feedback"):
+                msg_text += f"\n\n⚠️ Критик не принял эту версию. Замечания:\n{html.escape(current_state.values['critic_feedback'])}"
+
+            # Длинная спецификация уходит несколькими сообщениями, а не обрезается
+            for chunk in split_message(msg_text):
+                try:
+                    await bot.send_message(chat_id, chunk, parse_mode="HTML")
+                except Exception as e:
+                    await bot.send_message(chat_id, plain_text(chunk))
+
+            await bot.send_message(chat_id,
+                                   "Выше текущая версия проекта ⬆️\n\n"
+                                   "Если все нравится — напишите <b>'ОК'</b>, и я пришлю файл.\n"
+                                   "Если нужны правки — напишите, что изменить.", parse_mode="HTML")
         else:
-            bot.reply_to(message, "⚠️ Что-то пошло не так, артефакт пустой. Попробуйте еще раз /start")
+            await bot.reply_to(message, "⚠️ Что-то пошло не так, артефакт пустой. Попробуйте еще раз /start")
 
     except Exception as e:
         print(f"Error: {e}")
-        bot.reply_to(message, f"Произошла ошибка: {e}")
+        await bot.reply_to(message, f"Произошла ошибка: {e}")
+
+
+async def process_request(chat_id, request: dict):
+    if request["start"]:
+        await send_welcome(request["message"])
+    else:
+        await process_message(request["message"], request["text"])
+
+
+def merge_requests(pending: dict, request: dict) -> dict | None:
+    """ Сообщения, пришедшие подряд во время прогона, - одна доработка (ответ - на последнее) """
+
+    if pending["start"] or request["start"]:
+        return None
+    if pending["text"].lower() in APPROVAL_WORDS or request["text"].lower() in APPROVAL_WORDS:
+        return None
+    return {**request, "text": f"{pending['text']}\n{request['text']}"}
+
+
+# Прогоны одного чата идут по очереди: иначе они гоняются за один чекпоинт thread_id
+chat_queue = ChatQueue(process_request, merge_requests, MAX_ACTIVE_CHATS)
+
+
+@bot.message_handler(commands=['start'])
+async def handle_start(message):
+    # /start отменяет еще не начатые доработки прежнего проекта
+    chat_queue.submit(message.chat.id, {"message": message, "text": "/start", "start": True}, supersede=True)
+
+
+@bot.message_handler(func=lambda message: True)
+async def handle_message(message):
+    chat_id = message.chat.id
+    if chat_id in user_sessions:
+        user_sessions[chat_id]["last_seen"] = time.time()
+
+    status = chat_queue.submit(chat_id, {"message": message, "text": message.text.strip(), "start": False})
+    if status == "queued":
+        await bot.reply_to(message, "⏳ Дождусь окончания текущей доработки и учту это сообщение.")
+    elif status == "merged":
+        await bot.reply_to(message, "⏳ Объединю с предыдущими сообщениями в одну доработку.")
+
+
+async def main():
+    print(startup.startup_report("bot ready"))
+    asyncio.create_task(warm_up())
+    asyncio.create_task(evict_idle_sessions())
+    await bot.infinity_polling()
 
 
-print("Бот запущен!")
-bot.infinity_polling()
\ No newline at end of file
+if __name__ == "__main__":
+    # Режим с несколькими процессами и webhook - python webhook.py
+    print("Бот запущен!")
+    asyncio.run(main())
\ No newline at end of file
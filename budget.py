@@ -0,0 +1,123 @@
+import os
+import math
+
+
+DEFAULT_MAX_REVISIONS = 3
+
+# Поля результата критика, по которым выбирается лучший черновик сессии
+CANDIDATE_KEYS = ("draft_artifact", "critic_verdict", "critic_feedback", "critic_cache")
+
+STOP_REASONS = {
+    "revisions": "исчерпан лимит доработок",
+    "time": "исчерпан лимит времени",
+    "tokens": "исчерпан лимит токенов",
+}
+
+
+def session_budget(max_revisions: int | None = None, time_budget: float | None = None,
+                   token_budget: int | None = None) -> dict:
+    """
+    Лимиты сессии для ProjectState (0 - без ограничения по времени / токенам).
+
+    По умолчанию берутся из MAX_REVISIONS / SESSION_TIME_BUDGET / SESSION_TOKEN_BUDGET.
+    """
+
+    if max_revisions is None:
+        max_revisions = int(os.getenv("MAX_REVISIONS", DEFAULT_MAX_REVISIONS))
+    if time_budget is None:
+        time_budget = float(os.getenv("SESSION_TIME_BUDGET", 0))
+    if token_budget is None:
+        token_budget = int(os.getenv("SESSION_TOKEN_BUDGET", 0))
+
+    return {
+        "max_revisions": max_revisions,
+        "time_budget": time_budget,
+        "token_budget": token_budget,
+        "elapsed_seconds": 0.0,
+        "tokens_used": 0,
+        "best_candidate": None,
+        "budget_stop": None,
+    }
+
+
+def charge(state: dict, update, tokens: int, seconds: float):
+    """ Добавляет расход узла (токены, секунды работы) к счетчикам сессии в обновлении состояния """
+
+    if not isinstance(update, dict) or not isinstance(state, dict):
+        return update
+    return {
+        **update,
+        "tokens_used": (state.get("tokens_used") or 0) + tokens,
+        "elapsed_seconds": (state.get("elapsed_seconds") or 0.0) + seconds,
+    }
+
+
+def exhausted(state: dict) -> str | None:
+    """
+    Причина остановить цикл доработок (ключ STOP_REASONS) или None.
+
+    Время и токены проверяются с запасом на еще одну итерацию: если средняя
+    итерация сессии не укладывается в остаток бюджета, новая не начинается.
+    """
+
+    revisions = state.get("revision_count", 0)
+    if revisions >= state.get("max_revisions", DEFAULT_MAX_REVISIONS):
+        return "revisions"
+
+    rounds = revisions + 1
+    elapsed, time_budget = state.get("elapsed_seconds") or 0.0, state.get("time_budget") or 0
+    if time_budget and elapsed + elapsed / rounds > time_budget:
+        return "time"
+
+    tokens, token_budget = state.get("tokens_used") or 0, state.get("token_budget") or 0
+    if token_budget and tokens + tokens / rounds > token_budget:
+        return "tokens"
+
+    return None
+
+
+def problem_count(candidate: dict) -> float:
+    """ Сколько замечаний у кандидата: 0 - принят критиком, inf - артефакт не сгенерирован """
+
+    if not candidate or not candidate.get("draft_artifact"):
+        return math.inf
+    if candidate.get("critic_verdict") == "OK":
+        return 0
+    return len([line for line in (candidate.get("critic_feedback") or "").splitlines() if line.strip()]) or 1
+
+
+def _current_best(state: dict) -> dict | None:
+    # Черновик до последнего отзыва пользователя его замечаний не учитывает
+    best = state.get("best_candidate")
+    if best and best.get("user_feedback") == state.get("user_feedback"):
+        return best
+    return None
+
+
+def remember_best(state: dict, update: dict) -> dict:
+    """ best_candidate: черновик с наименьшим числом замечаний критика после последнего отзыва пользователя """
+
+    candidate = {k: v for k, v in {**state, **update}.items() if k in CANDIDATE_KEYS}
+    if problem_count(candidate) > problem_count(_current_best(state)):
+        return {}
+    return {"best_candidate": {**candidate, "user_feedback": state.get("user_feedback")}}
+
+
+def budget_node(state: dict) -> dict:
+    """
+    Бюджет сессии исчерпан: человеку уходит лучший черновик с его замечаниями критика.
+
+    budget_stop - причина остановки (ключ STOP_REASONS).
+    """
+
+    reason = exhausted(state) or "revisions"
+    print(f"\n[BUDGET] Stopping revisions: {STOP_REASONS[reason]} "
+          f"(revisions {state.get('revision_count', 0)}, {state.get('elapsed_seconds', 0.0):.1f}s, "
+          f"{state.get('tokens_used', 0)} tokens)")
+
+    update = {"budget_stop": reason}
+    best = _current_best(state)
+    if best and problem_count(best) < problem_count(state):
+        print(f"[BUDGET] Returning best draft so far ({problem_count(best):g} remarks)")
+        update.update({k: best[k] for k in CANDIDATE_KEYS if k in best})
+    return update
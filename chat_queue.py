@@ -0,0 +1,75 @@
+import asyncio
+
+
+class ChatQueue:
+    """
+    Очередь работы по чатам: прогоны графа одного чата (один thread_id) идут строго
+    по очереди, разные чаты обрабатываются параллельно.
+
+    Сообщения, пришедшие во время прогона, ждут его окончания; соседние ожидающие
+    сообщения, которые merge умеет объединить, сливаются в одно - вместо нескольких
+    прогонов будет один. max_active ограничивает число чатов, обрабатываемых
+    одновременно (0 - без ограничения).
+    """
+
+    def __init__(self, handler, merge, max_active: int = 0):
+        # handler(chat_id, item) - корутина обработки; merge(a, b) - объединенный элемент или None
+        self.handler = handler
+        self.merge = merge
+        self.slots = asyncio.Semaphore(max_active) if max_active else None
+        self.pending = {}
+        self.workers = {}
+
+    def busy(self, chat_id) -> bool:
+        return chat_id in self.workers
+
+    async def join(self):
+        """ Ожидание всех поставленных в очередь прогонов (при остановке процесса) """
+
+        while self.workers:
+            await asyncio.gather(*self.workers.values(), return_exceptions=True)
+
+    async def _handle(self, chat_id, item):
+        if self.slots is None:
+            return await self.handler(chat_id, item)
+        async with self.slots:
+            return await self.handler(chat_id, item)
+
+    def submit(self, chat_id, item, supersede: bool = False) -> str:
+        """
+        Ставит элемент в очередь чата.
+
+        supersede: ожидающие элементы отбрасываются (например, /start отменяет
+        недоработанные правки). Возвращает started, queued или merged.
+        """
+
+        queue = self.pending.setdefault(chat_id, [])
+        if supersede and queue:
+            print(f"[QUEUE] Chat {chat_id}: dropped {len(queue)} superseded requests")
+            queue.clear()
+
+        status = "queued" if self.busy(chat_id) else "started"
+        merged = self.merge(queue[-1], item) if queue else None
+        if merged is not None:
+            queue[-1] = merged
+            status = "merged"
+            print(f"[QUEUE] Chat {chat_id}: merged request into pending one")
+        else:
+            queue.append(item)
+
+        if not self.busy(chat_id):
+            self.workers[chat_id] = asyncio.create_task(self._drain(chat_id))
+        return status
+
+    async def _drain(self, chat_id):
+        try:
+            while queue := self.pending.get(chat_id):
+                item = queue.pop(0)
+                try:
+                    await self._handle(chat_id, item)
+                except Exception as e:
+                    print(f"[QUEUE] Chat {chat_id}: request failed: {e}")
+        finally:
+            # Между проверкой очереди и этим местом нет await: submit не может вклиниться
+            self.workers.pop(chat_id, None)
+            self.pending.pop(chat_id, None)
@@ -0,0 +1,110 @@
+import zlib
+
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+
+# Сжимаются только значения не короче стольких байт: на мелких zlib проигрывает
+DEFAULT_COMPRESS_MIN_SIZE = 256
+DEFAULT_COMPRESS_LEVEL = 6
+
+COMPRESSED_SUFFIX = "+zlib"
+
+# Операции дельты: значение целиком, дельта словаря, дельта списка объектов с id
+REPLACE = "="
+DICT_DELTA = "d"
+LIST_DELTA = "l"
+
+
+class CompactSerializer:
+    """
+    Сериализатор чекпоинтов: msgpack базового serde, сжатый zlib, если это дает выигрыш.
+
+    Сжатые данные помечаются суффиксом типа (msgpack+zlib), поэтому несжатые
+    записи, сохраненные раньше, читаются как есть.
+    """
+
+    def __init__(self, serde=None, compress: bool = True, min_size: int = DEFAULT_COMPRESS_MIN_SIZE,
+                 level: int = DEFAULT_COMPRESS_LEVEL):
+        self.serde = serde or JsonPlusSerializer()
+        self.compress = compress
+        self.min_size = min_size
+        self.level = level
+
+    def dumps_typed(self, obj) -> tuple[str, bytes]:
+        type_, data = self.serde.dumps_typed(obj)
+        if self.compress and len(data) >= self.min_size:
+            compressed = zlib.compress(data, self.level)
+            if len(compressed) < len(data):
+                return type_ + COMPRESSED_SUFFIX, compressed
+        return type_, data
+
+    def loads_typed(self, data: tuple[str, bytes]):
+        type_, payload = data
+        if type_.endswith(COMPRESSED_SUFFIX):
+            type_, payload = type_[:-len(COMPRESSED_SUFFIX)], zlib.decompress(payload)
+        return self.serde.loads_typed((type_, payload))
+
+
+def _keyed(items) -> dict | None:
+    """ Список объектов с уникальными id (требования артефакта) -> {id: объект}; иначе None """
+
+    if not isinstance(items, list) or not all(isinstance(item, dict) and "id" in item for item in items):
+        return None
+    keyed = {item["id"]: item for item in items}
+    return keyed if len(keyed) == len(items) else None
+
+
+def _entry(old, new) -> list:
+    """ Изменение одного значения: вложенная дельта, если возможна, иначе значение целиком """
+
+    if isinstance(old, dict) and isinstance(new, dict):
+        return [DICT_DELTA, diff(old, new)]
+
+    old_items, new_items = _keyed(old), _keyed(new)
+    if old_items is not None and new_items is not None:
+        changed = {
+            item_id: _entry(old_items[item_id], item) if item_id in old_items else [REPLACE, item]
+            for item_id, item in new_items.items()
+            if old_items.get(item_id) != item
+        }
+        return [LIST_DELTA, {"ids": list(new_items), "changed": changed}]
+
+    return [REPLACE, new]
+
+
+def diff(old: dict, new: dict) -> dict:
+    """
+    Дельта словаря new относительно old: измененные ключи и удаленные ключи.
+
+    Вложенные словари и списки объектов с id (требования) сравниваются поэлементно,
+    поэтому правка одного требования не тянет за собой весь артефакт.
+    """
+
+    return {
+        "set": {key: _entry(old[key], value) if key in old else [REPLACE, value]
+                for key, value in new.items() if key not in old or old[key] != value},
+        "del": [key for key in old if key not in new],
+    }
+
+
+def _apply_entry(old, entry: list):
+    op, value = entry
+    if op == DICT_DELTA:
+        return apply_diff(old, value)
+    if op == LIST_DELTA:
+        old_items = _keyed(old) or {}
+        changed = value["changed"]
+        return [
+            _apply_entry(old_items.get(item_id), changed[item_id]) if item_id in changed else old_items[item_id]
+            for item_id in value["ids"]
+        ]
+    return value
+
+
+def apply_diff(old: dict, delta: dict) -> dict:
+    """ Восстановление словаря по базовой версии и дельте diff(old, new) """
+
+    result = {key: value for key, value in old.items() if key not in delta["del"]}
+    for key, entry in delta["set"].items():
+        result[key] = _apply_entry(old.get(key), entry)
+    return result
@@ -0,0 +1,541 @@
+import os
+import time
+import random
+import asyncio
+import sqlite3
+import threading
+from collections.abc import AsyncIterator, Iterator, Sequence
+from typing import Any, List
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+    writes_sort_key,
+)
+from langgraph.checkpoint.memory import MemorySaver
+
+from checkpoint_codec import CompactSerializer, diff, apply_diff
+
+
+DEFAULT_DB_PATH = "checkpoints.sqlite"
+
+# Сколько последних чекпоинтов хранить на один поток (thread_id)
+DEFAULT_MAX_HISTORY = 20
+
+# Сколько дельт подряд может опираться друг на друга, прежде чем значение канала
+# будет снова сохранено целиком (0 - не хранить дельты)
+DEFAULT_DELTA_CHAIN = 8
+
+# Канал без значения в этой версии чекпоинта (в отличие от значения None)
+EMPTY = "empty"
+MISSING = object()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    parent_checkpoint_id TEXT,
+    type TEXT,
+    checkpoint BLOB,
+    metadata_type TEXT,
+    metadata BLOB,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+CREATE INDEX IF NOT EXISTS checkpoints_updated_at ON checkpoints (thread_id, updated_at);
+CREATE TABLE IF NOT EXISTS writes (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    type TEXT,
+    value BLOB,
+    task_path TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    channel TEXT NOT NULL,
+    version TEXT NOT NULL,
+    type TEXT NOT NULL,
+    blob BLOB,
+    base_version TEXT,
+    depth INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (thread_id, checkpoint_ns, channel, version)
+);
+"""
+
+
+class SQLiteCheckpointer(BaseCheckpointSaver[str]):
+    """
+    Чекпоинтер LangGraph поверх локального SQLite-файла.
+
+    - WAL-режим: чтения не блокируют запись, файл можно делить между процессами;
+    - на поток хранится не более max_history последних чекпоинтов;
+    - evict_idle_threads() удаляет потоки, неактивные дольше заданного времени;
+    - значения каналов лежат в таблице blobs по одному разу на версию канала: шаг,
+      изменивший только revision_count, не пересохраняет артефакт;
+    - словари (draft_artifact, critic_cache, ...) хранятся дельтой к предыдущей версии
+      канала в потоке, не более delta_chain дельт подряд; все записи сжимаются zlib
+      (CompactSerializer, compress=False - без сжатия).
+    """
+
+    def __init__(self, path: str = DEFAULT_DB_PATH, max_history: int = DEFAULT_MAX_HISTORY, *, serde=None,
+                 delta_chain: int = DEFAULT_DELTA_CHAIN, compress: bool = True):
+        super().__init__(serde=CompactSerializer(serde, compress=compress))
+        self.path = path
+        self.max_history = max(2, max_history)
+        self.delta_chain = max(0, delta_chain)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    # --- Чтение ---
+
+    def _config(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> RunnableConfig:
+        return {
+            "configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint_id,
+            }
+        }
+
+    def _pending_writes(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> List:
+        rows = self.conn.execute(
+            "SELECT task_id, idx, channel, type, value, task_path FROM writes "
+            "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+            (thread_id, checkpoint_ns, checkpoint_id),
+        ).fetchall()
+        rows.sort(key=lambda r: writes_sort_key(r[5], r[0], r[1]))
+        return [(task_id, channel, self.serde.loads_typed((type_, value))) for task_id, _, channel, type_, value, _ in rows]
+
+    def _load_blob(self, thread_id: str, checkpoint_ns: str, channel: str, version: str):
+        """ Значение канала в версии version (MISSING - нет записи или канал пуст) с разворотом дельт """
+
+        row = self.conn.execute(
+            "SELECT type, blob, base_version FROM blobs "
+            "WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?",
+            (thread_id, checkpoint_ns, channel, version),
+        ).fetchone()
+        if row is None or row[0] == EMPTY:
+            return MISSING
+
+        type_, blob, base_version = row
+        value = self.serde.loads_typed((type_, blob))
+        if base_version is None:
+            return value
+        return apply_diff(self._load_blob(thread_id, checkpoint_ns, channel, base_version), value)
+
+    def _load_checkpoint(self, thread_id: str, checkpoint_ns: str, type_: str, serialized: bytes) -> Checkpoint:
+        checkpoint = self.serde.loads_typed((type_, serialized))
+        # В записях до появления blobs значения каналов лежат прямо в чекпоинте
+        values = checkpoint.get("channel_values") or {}
+        for channel, version in checkpoint["channel_versions"].items():
+            value = self._load_blob(thread_id, checkpoint_ns, channel, str(version))
+            if value is not MISSING:
+                values[channel] = value
+        return {**checkpoint, "channel_values": values}
+
+    def _row_to_tuple(self, thread_id: str, checkpoint_ns: str, row) -> CheckpointTuple:
+        checkpoint_id, parent_checkpoint_id, type_, checkpoint, metadata_type, metadata = row
+        return CheckpointTuple(
+            config=self._config(thread_id, checkpoint_ns, checkpoint_id),
+            checkpoint=self._load_checkpoint(thread_id, checkpoint_ns, type_, checkpoint),
+            metadata=self.serde.loads_typed((metadata_type, metadata)),
+            parent_config=(
+                self._config(thread_id, checkpoint_ns, parent_checkpoint_id)
+                if parent_checkpoint_id
+                else None
+            ),
+            pending_writes=self._pending_writes(thread_id, checkpoint_ns, checkpoint_id),
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        columns = "checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata"
+
+        with self.lock:
+            if checkpoint_id := get_checkpoint_id(config):
+                row = self.conn.execute(
+                    f"SELECT {columns} FROM checkpoints "
+                    "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                    (thread_id, checkpoint_ns, checkpoint_id),
+                ).fetchone()
+            else:
+                row = self.conn.execute(
+                    f"SELECT {columns} FROM checkpoints "
+                    "WHERE thread_id = ? AND checkpoint_ns = ? ORDER BY checkpoint_id DESC LIMIT 1",
+                    (thread_id, checkpoint_ns),
+                ).fetchone()
+
+            if row is None:
+                return None
+            return self._row_to_tuple(thread_id, checkpoint_ns, row)
+
+    def list(
+        self,
+        config: RunnableConfig | None,
+        *,
+        filter: dict[str, Any] | None = None,
+        before: RunnableConfig | None = None,
+        limit: int | None = None,
+    ) -> Iterator[CheckpointTuple]:
+        query = (
+            "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, "
+            "type, checkpoint, metadata_type, metadata FROM checkpoints"
+        )
+        where, params = [], []
+        if config:
+            where.append("thread_id = ?")
+            params.append(config["configurable"]["thread_id"])
+            if (checkpoint_ns := config["configurable"].get("checkpoint_ns")) is not None:
+                where.append("checkpoint_ns = ?")
+                params.append(checkpoint_ns)
+            if checkpoint_id := get_checkpoint_id(config):
+                where.append("checkpoint_id = ?")
+                params.append(checkpoint_id)
+        if before and (before_id := get_checkpoint_id(before)):
+            where.append("checkpoint_id < ?")
+            params.append(before_id)
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY checkpoint_id DESC"
+
+        with self.lock:
+            rows = self.conn.execute(query, params).fetchall()
+            result = []
+            for thread_id, checkpoint_ns, *row in rows:
+                if limit is not None and len(result) >= limit:
+                    break
+                item = self._row_to_tuple(thread_id, checkpoint_ns, row)
+                if filter and not all(item.metadata.get(k) == v for k, v in filter.items()):
+                    continue
+                result.append(item)
+
+        yield from result
+
+    # --- Запись ---
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint = checkpoint.copy()
+        values = checkpoint.pop("channel_values")
+        type_, serialized = self.serde.dumps_typed(checkpoint)
+        metadata_type, serialized_metadata = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Значения сохраняются только для каналов, изменившихся на этом шаге, и для версий,
+                # которых еще нет в blobs (потоки, начатые до появления blobs)
+                stored = set(self.conn.execute(
+                    "SELECT channel, version FROM blobs WHERE thread_id = ? AND checkpoint_ns = ?",
+                    (thread_id, checkpoint_ns),
+                ).fetchall())
+                for channel, version in {**checkpoint["channel_versions"], **new_versions}.items():
+                    if channel in new_versions or (channel, str(version)) not in stored:
+                        self._put_blob(thread_id, checkpoint_ns, channel, str(version), values.get(channel, MISSING))
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        thread_id,
+                        checkpoint_ns,
+                        checkpoint["id"],
+                        config["configurable"].get("checkpoint_id"),
+                        type_,
+                        serialized,
+                        metadata_type,
+                        serialized_metadata,
+                        time.time(),
+                    ),
+                )
+                self._trim_history(thread_id, checkpoint_ns)
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+
+        return self._config(thread_id, checkpoint_ns, checkpoint["id"])
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+
+        # Служебные каналы (ошибки, прерывания) перезаписываются, обычные - нет
+        verb = "INSERT OR REPLACE" if all(c in WRITES_IDX_MAP for c, _ in writes) else "INSERT OR IGNORE"
+        rows = []
+        for idx, (channel, value) in enumerate(writes):
+            type_, serialized = self.serde.dumps_typed(value)
+            rows.append((
+                thread_id,
+                checkpoint_ns,
+                checkpoint_id,
+                task_id,
+                WRITES_IDX_MAP.get(channel, idx),
+                channel,
+                type_,
+                serialized,
+                task_path,
+            ))
+
+        with self.lock:
+            self.conn.executemany(f"{verb} INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def _put_blob(self, thread_id: str, checkpoint_ns: str, channel: str, version: str, value):
+        """ Значение канала целиком или дельтой к последней сохраненной версии канала - что короче """
+
+        if value is MISSING:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?, ?, ?, NULL, 0)",
+                (thread_id, checkpoint_ns, channel, version, EMPTY, b""),
+            )
+            return
+
+        type_, blob = self.serde.dumps_typed(value)
+        base_version, depth = None, 0
+
+        if self.delta_chain and isinstance(value, dict):
+            base = self.conn.execute(
+                "SELECT version, depth FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? "
+                "AND version != ? AND type != ? ORDER BY version DESC LIMIT 1",
+                (thread_id, checkpoint_ns, channel, version, EMPTY),
+            ).fetchone()
+            if base is not None and base[1] < self.delta_chain:
+                base_value = self._load_blob(thread_id, checkpoint_ns, channel, base[0])
+                if isinstance(base_value, dict):
+                    delta_type, delta = self.serde.dumps_typed(diff(base_value, value))
+                    if len(delta) < len(blob):
+                        type_, blob = delta_type, delta
+                        base_version, depth = base[0], base[1] + 1
+
+        self.conn.execute(
+            "INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (thread_id, checkpoint_ns, channel, version, type_, blob, base_version, depth),
+        )
+
+    def _collect_blobs(self, thread_id: str, checkpoint_ns: str):
+        """
+        Удаляет версии каналов, на которые не ссылается ни один оставшийся чекпоинт.
+
+        Дельта, чья базовая версия удаляется, сначала пересохраняется целиком (rebase),
+        иначе ее нельзя было бы развернуть.
+        """
+
+        referenced = set()
+        for type_, serialized in self.conn.execute(
+            "SELECT type, checkpoint FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?",
+            (thread_id, checkpoint_ns),
+        ).fetchall():
+            versions = self.serde.loads_typed((type_, serialized))["channel_versions"]
+            referenced.update((channel, str(version)) for channel, version in versions.items())
+
+        rows = self.conn.execute(
+            "SELECT channel, version, base_version FROM blobs WHERE thread_id = ? AND checkpoint_ns = ?",
+            (thread_id, checkpoint_ns),
+        ).fetchall()
+        stale = {(channel, version) for channel, version, _ in rows if (channel, version) not in referenced}
+        if not stale:
+            return
+
+        for channel, version, base_version in rows:
+            if (channel, version) not in stale and (channel, base_version) in stale:
+                value = self._load_blob(thread_id, checkpoint_ns, channel, version)
+                type_, blob = self.serde.dumps_typed(value)
+                self.conn.execute(
+                    "UPDATE blobs SET type = ?, blob = ?, base_version = NULL, depth = 0 "
+                    "WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?",
+                    (type_, blob, thread_id, checkpoint_ns, channel, version),
+                )
+
+        self.conn.executemany(
+            "DELETE FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?",
+            [(thread_id, checkpoint_ns, channel, version) for channel, version in stale],
+        )
+
+    def _trim_history(self, thread_id: str, checkpoint_ns: str):
+        """ Оставляет только max_history последних чекпоинтов потока """
+
+        stale = self.conn.execute(
+            "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+            "ORDER BY checkpoint_id DESC LIMIT -1 OFFSET ?",
+            (thread_id, checkpoint_ns, self.max_history),
+        ).fetchall()
+        if not stale:
+            return
+
+        params = [(thread_id, checkpoint_ns, checkpoint_id) for (checkpoint_id,) in stale]
+        self.conn.executemany(
+            "DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?", params
+        )
+        self.conn.executemany(
+            "DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?", params
+        )
+        self._collect_blobs(thread_id, checkpoint_ns)
+
+    # --- Обслуживание ---
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self.lock:
+            self.conn.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+            self.conn.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
+            self.conn.execute("DELETE FROM blobs WHERE thread_id = ?", (thread_id,))
+
+    def prune(self, thread_ids: Sequence[str], *, strategy: str = "keep_latest") -> None:
+        if strategy == "delete":
+            for thread_id in thread_ids:
+                self.delete_thread(thread_id)
+            return
+
+        with self.lock:
+            for thread_id in thread_ids:
+                namespaces = self.conn.execute(
+                    "SELECT DISTINCT checkpoint_ns FROM checkpoints WHERE thread_id = ?", (thread_id,)
+                ).fetchall()
+                for (checkpoint_ns,) in namespaces:
+                    latest = self.conn.execute(
+                        "SELECT MAX(checkpoint_id) FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?",
+                        (thread_id, checkpoint_ns),
+                    ).fetchone()[0]
+                    for table in ("checkpoints", "writes"):
+                        self.conn.execute(
+                            f"DELETE FROM {table} WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id != ?",
+                            (thread_id, checkpoint_ns, latest),
+                        )
+                    self._collect_blobs(thread_id, checkpoint_ns)
+
+    def evict_idle_threads(self, max_idle_seconds: float) -> List[str]:
+        """ Удаляет потоки без активности дольше max_idle_seconds, возвращает их thread_id """
+
+        deadline = time.time() - max_idle_seconds
+
+        with self.lock:
+            idle = [
+                thread_id
+                for (thread_id,) in self.conn.execute(
+                    "SELECT thread_id FROM checkpoints GROUP BY thread_id HAVING MAX(updated_at) < ?",
+                    (deadline,),
+                ).fetchall()
+            ]
+            if idle:
+                params = [(thread_id,) for thread_id in idle]
+                self.conn.execute("BEGIN IMMEDIATE")
+                self.conn.executemany("DELETE FROM checkpoints WHERE thread_id = ?", params)
+                self.conn.executemany("DELETE FROM writes WHERE thread_id = ?", params)
+                self.conn.executemany("DELETE FROM blobs WHERE thread_id = ?", params)
+                self.conn.execute("COMMIT")
+
+        if idle:
+            print(f"[CHECKPOINT] Evicted {len(idle)} idle threads")
+        return idle
+
+    # --- Асинхронные версии (SQLite-операции уходят в пул потоков) ---
+
+    async def aget_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: RunnableConfig | None,
+        *,
+        filter: dict[str, Any] | None = None,
+        before: RunnableConfig | None = None,
+        limit: int | None = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        items = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+        )
+        for item in items:
+            yield item
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+    async def aprune(self, thread_ids: Sequence[str], *, strategy: str = "keep_latest") -> None:
+        await asyncio.to_thread(self.prune, thread_ids, strategy=strategy)
+
+    def get_next_version(self, current: str | None, channel: None) -> str:
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
+
+
+def create_checkpointer(backend: str | None = None):
+    """
+    Фабрика чекпоинтеров.
+
+    backend (или переменная CHECKPOINTER): "sqlite" (по умолчанию) или "memory".
+    Сжатие - CHECKPOINT_COMPRESS (0 - выключить), длина цепочки дельт для sqlite -
+    CHECKPOINT_DELTA_CHAIN (0 - хранить значения целиком).
+    """
+
+    backend = (backend or os.getenv("CHECKPOINTER", "sqlite")).lower()
+    compress = os.getenv("CHECKPOINT_COMPRESS", "1") != "0"
+
+    if backend == "memory":
+        # MemorySaver и так хранит значения по версиям каналов; дельт у него нет, только сжатие
+        return MemorySaver(serde=CompactSerializer(compress=compress))
+    if backend == "sqlite":
+        return SQLiteCheckpointer(
+            path=os.getenv("CHECKPOINT_DB", DEFAULT_DB_PATH),
+            max_history=int(os.getenv("CHECKPOINT_MAX_HISTORY", DEFAULT_MAX_HISTORY)),
+            delta_chain=int(os.getenv("CHECKPOINT_DELTA_CHAIN", DEFAULT_DELTA_CHAIN)),
+            compress=compress,
+        )
+
+    raise ValueError(f"Неизвестный тип чекпоинтера: {backend}")
@@ -0,0 +1,196 @@
+import json
+import time
+import random
+import asyncio
+import threading
+from typing import List
+
+import httpx
+from pydantic import PrivateAttr
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables.config import ensure_config
+
+from structured import REASK_SYSTEM
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Детерминированная локальная замена ChatOpenAI для бенчмарков и офлайн-прогонов.
+
+    Роль вызова (аналитик, патч аналитика, критик) определяется по схеме в системном
+    промпте. Ответы критика идут по сценарию critic_script (OK / REVISE / BAD) отдельно
+    для каждого thread_id; ответы аналитика - по analyst_script (OK / BAD).
+    BAD - невалидный JSON (ошибка парсинга). Последний элемент сценария повторяется.
+    Повторные запросы парсера (structured.REASK_SYSTEM) получают валидный ответ вне сценария.
+
+    Кэш префикса провайдера имитируется блоками по cache_block символов: совпавшее
+    с прежними запросами начало промпта попадает в cache_read.
+
+    Сбои провайдера: с вероятностью fail_rate вызов падает с ошибкой соединения,
+    с вероятностью slow_rate отвечает в slow_factor раз медленнее (хвост задержек).
+    """
+
+
+    model: str = "fake"
+    latency: float = 0.0
+    stream_chunk: int = 64
+    requirements: int = 5
+    cache_block: int = 256
+    critic_script: List[str] = ["OK"]
+    analyst_script: List[str] = ["OK"]
+    fail_rate: float = 0.0
+    slow_rate: float = 0.0
+    slow_factor: float = 20.0
+
+    _calls: dict = PrivateAttr(default_factory=dict)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _prefixes: set = PrivateAttr(default_factory=set)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {"model": self.model, "latency": self.latency}
+
+    @staticmethod
+    def _role(messages) -> str:
+        system = next((m.content for m in messages if m.type == "system"), "")
+        if system == REASK_SYSTEM:
+            return "reask"
+        if "header_verdict" in system:
+            return "critic"
+        if '"edits"' in system:
+            return "patch"
+        return "analyst"
+
+    def _next(self, thread_id: str, role: str, script: List[str]) -> tuple[int, str]:
+        """ Номер вызова роли в потоке и очередной шаг сценария """
+
+        with self._lock:
+            n = self._calls.get((thread_id, role), 0)
+            self._calls[(thread_id, role)] = n + 1
+        return n, script[min(n, len(script) - 1)].upper()
+
+    def _artifact(self) -> dict:
+        return {
+            "title": "Сервис подбора кандидатов",
+            "description": "Система помогает HR-специалисту находить и ранжировать кандидатов по вакансии.",
+            "goals": ["Сократить время первичного отбора кандидатов на 30%"],
+            "functional_requirements": [
+                {"id": f"ФТ-{i}", "description": f"Пользователь может выполнить сценарий {i} и получить подтверждение."}
+                for i in range(1, self.requirements + 1)
+            ],
+        }
+
+    def respond(self, messages, metadata: dict | None = None) -> str:
+        """ Текст ответа для вызова с данными сообщениями """
+
+        metadata = metadata or {}
+        thread_id = str(metadata.get("thread_id", ""))
+        role = self._role(messages)
+
+        if role == "reask":
+            request = messages[-1].content
+            if '"verdict"' in request:
+                return json.dumps({"verdict": "OK", "critique": ""})
+            return json.dumps(self._artifact(), ensure_ascii=False)
+
+        if role == "critic":
+            # Пачки требований без шапки, проверяемые на лету из узла аналитика, в сценарий не входят
+            if metadata.get("langgraph_node") == "analyst" and '"title"' not in messages[-1].content:
+                step = "OK"
+            else:
+                _, step = self._next(thread_id, role, self.critic_script)
+            if step == "BAD":
+                return "Вердикт: все хорошо, но без JSON {"
+            if step == "REVISE":
+                return json.dumps({
+                    "verdict": "REVISE",
+                    "critique": "Цели проекта нужно сделать измеримыми.",
+                    "header_verdict": "REVISE",
+                    "requirements": [],
+                }, ensure_ascii=False)
+            return json.dumps({"verdict": "OK", "critique": "", "header_verdict": "OK", "requirements": []})
+
+        n, step = self._next(thread_id, "analyst", self.analyst_script)
+        if step == "BAD":
+            return "Вот описание проекта: {title: ..."
+        if role == "patch":
+            return json.dumps({
+                "goals": [f"Сократить время первичного отбора кандидатов на {31 + n}%"],
+                "edits": [{"op": "modify", "id": "ФТ-1",
+                           "description": f"Пользователь может выполнить сценарий 1 (версия {n + 1})."}],
+            }, ensure_ascii=False)
+        return json.dumps(self._artifact(), ensure_ascii=False)
+
+    def _cached_chars(self, prompt: str) -> int:
+        """ Длина начала промпта, уже встречавшегося в прежних запросах (целыми блоками) """
+
+        cached = 0
+        with self._lock:
+            for end in range(self.cache_block, len(prompt) + 1, self.cache_block):
+                prefix = hash(prompt[:end])
+                if prefix in self._prefixes and cached == end - self.cache_block:
+                    cached = end
+                self._prefixes.add(prefix)
+        return cached
+
+    def _usage(self, messages, text: str) -> dict:
+        # Грубая оценка токенов: ~4 символа на токен
+        prompt = "".join(f"{m.type}:{m.content}" for m in messages)
+        prompt_tokens = len(prompt) // 4
+        completion_tokens = len(text) // 4
+        return {
+            "input_tokens": prompt_tokens,
+            "output_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "input_token_details": {"cache_read": self._cached_chars(prompt) // 4},
+        }
+
+    @staticmethod
+    def _metadata(run_manager) -> dict:
+        # stream/astream не передают run_manager в _stream: метаданные берутся из контекста узла
+        if run_manager is not None:
+            return run_manager.metadata
+        return ensure_config().get("metadata") or {}
+
+    def _result(self, messages, run_manager) -> ChatResult:
+        text = self.respond(messages, self._metadata(run_manager))
+        message = AIMessage(content=text, usage_metadata=self._usage(messages, text))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _pieces(self, messages, run_manager):
+        text = self.respond(messages, self._metadata(run_manager))
+        for i in range(0, len(text), self.stream_chunk):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=text[i:i + self.stream_chunk]))
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self._usage(messages, text)))
+
+    def _delay(self) -> float:
+        """ Задержка вызова; при имитации сбоя - ошибка соединения """
+
+        if random.random() < self.fail_rate:
+            raise httpx.ConnectError("fake provider is unavailable")
+        if random.random() < self.slow_rate:
+            return self.latency * self.slow_factor
+        return self.latency
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self._delay())
+        return self._result(messages, run_manager)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self._delay())
+        return self._result(messages, run_manager)
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self._delay())
+        yield from self._pieces(messages, run_manager)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self._delay())
+        for chunk in self._pieces(messages, run_manager):
+            yield chunk
@@ -1,21 +1,33 @@
+import os
+import threading
+from functools import partial
+
 from langgraph.graph import StateGraph, START, END
-from langgraph.checkpoint.memory import MemorySaver
 
 from state import ProjectState
-from nodes_analyst import analyst_node
-from nodes_critic import critic_node
+from nodes_analyst import analyst_node, aanalyst_node, DEFAULT_PIPELINE_CHUNK_SIZE
+from nodes_critic import critic_node, acritic_node, DEFAULT_CRITIC_CONCURRENCY
 from human_nodes import human_node
+from speculative import speculative_analyst_node, aspeculative_analyst_node, check_speculative_options
+from checkpointer import create_checkpointer
+from routing import check_tier_mode
+from budget import budget_node, exhausted, session_budget
+from warm_start import warm_start_node
+from metrics import instrument_node
 
 
 def critic_router(state: ProjectState) -> str:
-    """ ROUTER: Решить, что делать после критика """
+    """ ROUTER: Решить, что делать после критика (с учетом бюджета сессии) """
 
-    if state["critic_verdict"] == "OK":
+    if state.get("llm_error"):
+        # LLM недоступна: доработка по "технической ошибке" ничего не даст
+        return "human"
+    elif state["critic_verdict"] == "OK":
         return "human"
-    elif state["revision_count"] < 3:
+    elif exhausted(state) is None:
         return "increment"
     else:
-        return "human"
+        return "budget"
 
 
 def human_router(state: ProjectState) -> str:
@@ -35,19 +47,95 @@ def increment_revision_count(state: ProjectState) -> dict:
 
     return {
         "revision_count": new_count,
+        "budget_stop": None,
+    }
+
+def build_graph(critic_chunk_size: int | None = None, critic_concurrency: int | None = None,
+                analyst_patch_mode: bool | None = None,
+                analyst_pipeline_chunk_size: int | None = None,
+                analyst_tier: str | None = None, critic_tier: str | None = None,
+                speculative_drafts: int | None = None, speculative_cancel: str | None = None,
+                warm_start: bool | None = None) -> StateGraph:
+    """
+    Сборка графа состояний.
+
+    critic_chunk_size: если задан, критик проверяет требования чанками такого размера
+    параллельно (не более critic_concurrency одновременных запросов).
+    analyst_patch_mode: доработка артефакта списком правок вместо полной перегенерации.
+    analyst_pipeline_chunk_size: по сколько готовых требований из потока аналитика
+    отдавать критику до окончания генерации (0 - не отдавать).
+    analyst_tier / critic_tier: уровень модели узлов - auto (routing), fast или reasoner.
+    speculative_drafts: больше 1 - аналитик пишет столько кандидатов параллельно и сам
+    проверяет их критиком; speculative_cancel - cancel (первый OK побеждает) или wait.
+    warm_start: перед первым черновиком искать похожий утвержденный проект (warm_start.py).
+    По умолчанию берутся из CRITIC_CHUNK_SIZE / CRITIC_CONCURRENCY / ANALYST_PATCH_MODE /
+    ANALYST_PIPELINE_CHUNK_SIZE / ANALYST_TIER / CRITIC_TIER / ANALYST_SPECULATIVE_DRAFTS /
+    SPECULATIVE_CANCEL / WARM_START.
+    """
+
+    if critic_chunk_size is None:
+        critic_chunk_size = int(os.getenv("CRITIC_CHUNK_SIZE", 0)) or None
+    if critic_concurrency is None:
+        critic_concurrency = int(os.getenv("CRITIC_CONCURRENCY", DEFAULT_CRITIC_CONCURRENCY))
+
+    if analyst_patch_mode is None:
+        analyst_patch_mode = os.getenv("ANALYST_PATCH_MODE", "1") != "0"
+
+    if analyst_pipeline_chunk_size is None:
+        analyst_pipeline_chunk_size = int(os.getenv("ANALYST_PIPELINE_CHUNK_SIZE", DEFAULT_PIPELINE_CHUNK_SIZE))
+
+    analyst_tier = check_tier_mode(analyst_tier or os.getenv("ANALYST_TIER", "auto"))
+    critic_tier = check_tier_mode(critic_tier or os.getenv("CRITIC_TIER", "auto"))
+
+    critic_options = {"chunk_size": critic_chunk_size, "max_concurrency": critic_concurrency, "tier": critic_tier}
+    analyst_options = {
+        "patch_mode": analyst_patch_mode,
+        "pipeline_chunk_size": analyst_pipeline_chunk_size,
+        "tier": analyst_tier,
+        "critic_tier_mode": critic_tier,
     }
 
-def build_graph() -> StateGraph:
-    """ Сборка графа состояний """
+    if speculative_drafts is None:
+        speculative_drafts = int(os.getenv("ANALYST_SPECULATIVE_DRAFTS", 1))
+    speculative_cancel = speculative_cancel or os.getenv("SPECULATIVE_CANCEL", "cancel")
+    check_speculative_options(speculative_drafts, speculative_cancel)
+
+    if warm_start is None:
+        warm_start = os.getenv("WARM_START", "1") != "0"
+
+    analyst_funcs = (partial(analyst_node, **analyst_options), partial(aanalyst_node, **analyst_options))
+    if speculative_drafts > 1:
+        speculative_options = {
+            "drafts": speculative_drafts,
+            "cancel_policy": speculative_cancel,
+            "analyst_options": analyst_options,
+            "critic_options": critic_options,
+        }
+        analyst_funcs = (
+            partial(speculative_analyst_node, **speculative_options),
+            partial(aspeculative_analyst_node, **speculative_options),
+        )
 
     graph = StateGraph(ProjectState)
 
-    graph.add_node("analyst", analyst_node)
-    graph.add_node("critic", critic_node)
-    graph.add_node("human", human_node)
-    graph.add_node("increment", increment_revision_count)
-
-    graph.add_edge(START, "analyst")
+    # Синхронная и асинхронная реализации: app.invoke / app.ainvoke выбирают нужную.
+    # Каждый узел обернут замером (metrics.registry)
+    graph.add_node("analyst", instrument_node("analyst", *analyst_funcs))
+    graph.add_node("critic", instrument_node(
+        "critic",
+        partial(critic_node, **critic_options),
+        partial(acritic_node, **critic_options),
+    ))
+    graph.add_node("budget", instrument_node("budget", budget_node))
+    graph.add_node("human", instrument_node("human", human_node, budget=False))
+    graph.add_node("increment", instrument_node("increment", increment_revision_count))
+
+    if warm_start:
+        graph.add_node("warm_start", instrument_node("warm_start", warm_start_node))
+        graph.add_edge(START, "warm_start")
+        graph.add_edge("warm_start", "analyst")
+    else:
+        graph.add_edge(START, "analyst")
     graph.add_edge("analyst", "critic")
 
     graph.add_conditional_edges(
@@ -56,9 +144,11 @@ def build_graph() -> StateGraph:
         {
             "human": "human",
             "increment": "increment",
+            "budget": "budget",
         }
     )
 
+    graph.add_edge("budget", "human")
     graph.add_edge("increment", "analyst")
 
     graph.add_conditional_edges(
@@ -73,12 +163,19 @@ def build_graph() -> StateGraph:
     return graph
 
 
-def compile_graph():
-    """ Компиляция графа с поддержкой Human-in-the-loop """
+def compile_graph(checkpointer=None, **graph_options):
+    """
+    Компиляция графа с поддержкой Human-in-the-loop.
+
+    checkpointer: любой BaseCheckpointSaver; по умолчанию - create_checkpointer()
+    (SQLite-файл или MemorySaver в зависимости от переменной CHECKPOINTER).
+    graph_options передаются в build_graph().
+    """
 
-    graph = build_graph()
+    graph = build_graph(**graph_options)
 
-    checkpointer = MemorySaver()
+    if checkpointer is None:
+        checkpointer = create_checkpointer()
 
     compiled_graph = graph.compile(
         checkpointer=checkpointer,
@@ -89,28 +186,50 @@ def compile_graph():
     return compiled_graph
 
 
-def initialize_state(project_description: str) -> ProjectState:
-    """ Инициализация начального состояние графа """
+_app = None
+_app_lock = threading.Lock()
+
+
+def get_app():
+    """ Граф процесса (чекпоинтер и параметры - из окружения): компилируется один раз и переиспользуется """
+
+    global _app
+
+    with _app_lock:
+        if _app is None:
+            _app = compile_graph()
+        return _app
+
+
+def initialize_state(project_description: str, **budget) -> ProjectState:
+    """
+    Инициализация начального состояние графа.
+
+    budget: лимиты сессии (max_revisions, time_budget, token_budget) - см. budget.session_budget.
+    """
 
     return {
         "project_description": project_description,
         "draft_artifact": None,
         "critic_feedback": "",
         "critic_verdict": None,
+        "critic_cache": {},
+        "model_tiers": {},
+        "llm_error": None,
+        "warm_start": None,
         "revision_count": 0,
         "user_feedback": "",
         "user_has_provided_feedback": False,
+        **session_budget(**budget),
     }
 
 
-def run_system(project_description: str):
+def run_system(project_description: str, thread_id: str = "session_1"):
     """ Главная функция для запуска всей системы """
 
     app = compile_graph()
     initial_state = initialize_state(project_description)
 
-    thread_id = "session_1"
-
     config = {"configurable": {"thread_id": thread_id}}
 
     print("\n[SYSTEM] Starting graph execution...")
@@ -121,6 +240,24 @@ def run_system(project_description: str):
 
     return app, config, output
 
+
+async def arun_system(project_description: str, thread_id: str = "session_1"):
+    """ Асинхронный запуск системы (app.astream), не блокирует event loop """
+
+    app = compile_graph()
+    initial_state = initialize_state(project_description)
+
+    config = {"configurable": {"thread_id": thread_id}}
+
+    print(f"\n[SYSTEM] Starting async graph execution ({thread_id})...")
+    output = None
+    async for output in app.astream(initial_state, config=config, stream_mode="values"):
+        pass
+
+    print(f"\n[SYSTEM] Graph stopped at human node ({thread_id})")
+
+    return app, config, output
+
 if __name__ == "__main__":
     print("\n[TEST] Building graph...")
     app = compile_graph()
@@ -0,0 +1,184 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+import warnings
+
+from langchain_core._api import LangChainBetaWarning
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+
+# langchain_core.load.loads помечен как beta, но формат стабилен для сообщений
+warnings.filterwarnings("ignore", category=LangChainBetaWarning, module=__name__)
+
+
+DEFAULT_CACHE_PATH = "llm_cache.sqlite"
+DEFAULT_MAX_ENTRIES = 5000
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at);
+"""
+
+
+def cache_key(prompt: str, llm_string: str) -> str:
+    """
+    Ключ кэша: sha256 от параметров модели (модель, температура, ...) и отрендеренных сообщений.
+
+    Сообщения нормализуются через канонический JSON, чтобы порядок ключей
+    и пробелы сериализации не влияли на попадание в кэш.
+    """
+
+    try:
+        prompt = json.dumps(json.loads(prompt), ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    except ValueError:
+        pass
+
+    return hashlib.sha256(f"{llm_string}\n{prompt}".encode("utf-8")).hexdigest()
+
+
+class SQLiteResponseCache(BaseCache):
+    """
+    Дисковый кэш ответов LLM с вытеснением по LRU.
+
+    Подключается к ChatOpenAI через параметр cache=...; размер ограничен
+    числом записей (max_entries) и суммарным объемом (max_bytes).
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        self.conn.executescript(SCHEMA)
+        self.entries, self.total_bytes = self.conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+
+    def lookup(self, prompt: str, llm_string: str):
+        key = cache_key(prompt, llm_string)
+
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+
+        generations = [loads(item) for item in json.loads(row[0])]
+        for gen in generations:
+            # Ответ из кэша не тратит токены: расход исходного вызова не должен учитываться повторно
+            if getattr(gen.message, "usage_metadata", None):
+                gen.message.usage_metadata = None
+        return generations
+
+    def update(self, prompt: str, llm_string: str, return_val) -> None:
+        key = cache_key(prompt, llm_string)
+        value = json.dumps([dumps(gen) for gen in return_val], ensure_ascii=False)
+        size = len(value.encode("utf-8"))
+
+        with self.lock:
+            old = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)", (key, value, size, time.time())
+            )
+            if old:
+                self.total_bytes += size - old[0]
+            else:
+                self.entries += 1
+                self.total_bytes += size
+            self._evict()
+
+    def delete(self, prompt: str, llm_string: str) -> None:
+        """ Удаление ответа (например, не принятого парсером) """
+
+        key = cache_key(prompt, llm_string)
+
+        with self.lock:
+            row = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return
+            self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.entries -= 1
+            self.total_bytes -= row[0]
+
+    def _evict(self):
+        """ Удаляет давно не использованные записи, пока кэш не уложится в лимиты """
+
+        while self.entries > self.max_entries or self.total_bytes > self.max_bytes:
+            batch = max(1, self.entries - self.max_entries, self.entries // 20)
+            rows = self.conn.execute(
+                "SELECT key, size FROM responses ORDER BY accessed_at LIMIT ?", (batch,)
+            ).fetchall()
+            if not rows:
+                break
+            self.conn.executemany("DELETE FROM responses WHERE key = ?", [(k,) for k, _ in rows])
+            self.entries -= len(rows)
+            self.total_bytes -= sum(size for _, size in rows)
+
+    def clear(self, **kwargs) -> None:
+        with self.lock:
+            self.conn.execute("DELETE FROM responses")
+            self.entries = 0
+            self.total_bytes = 0
+
+    def stats(self) -> dict:
+        """ Счетчики попаданий/промахов и текущий размер кэша """
+
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": self.entries,
+            "bytes": self.total_bytes,
+        }
+
+
+_cache: SQLiteResponseCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> SQLiteResponseCache | None:
+    """ Общий кэш ответов процесса; None, если кэш выключен (LLM_CACHE=0) """
+
+    global _cache
+
+    if os.getenv("LLM_CACHE", "1") == "0":
+        return None
+
+    with _cache_lock:
+        if _cache is None:
+            _cache = SQLiteResponseCache(
+                path=os.getenv("LLM_CACHE_PATH", DEFAULT_CACHE_PATH),
+                max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+                max_bytes=int(os.getenv("LLM_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)),
+            )
+        return _cache
+
+
+def forget_response(llm, messages: list):
+    """
+    Удаляет из кэша ответ llm на messages: ключ тот же, что у llm.invoke.
+
+    Ответ, который не принял парсер, иначе возвращался бы из кэша при каждом повторе.
+    """
+
+    if isinstance(getattr(llm, "cache", None), SQLiteResponseCache):
+        llm.cache.delete(dumps(messages), llm._get_llm_string())
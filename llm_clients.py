@@ -0,0 +1,409 @@
+import os
+import asyncio
+import threading
+import weakref
+from contextlib import asynccontextmanager, contextmanager
+
+import httpx
+from langchain_core.caches import BaseCache
+from langchain_core.exceptions import OutputParserException
+from langchain_core.load import dumps
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnableLambda
+from langchain_core.output_parsers import PydanticOutputParser
+from langchain_core.language_models import BaseChatModel
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+from llm_cache import get_response_cache, forget_response
+from structured import STRUCTURED_MODES, StructuredOutputParser, compact_instructions, message_text, chunk_text
+
+
+# Лимиты пула соединений (общие для всех моделей, графов и чатов)
+DEFAULT_MAX_CONNECTIONS = 20
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = 10
+DEFAULT_KEEPALIVE_EXPIRY = 60.0
+DEFAULT_TIMEOUT = 120.0
+
+# Максимум одновременных запросов к LLM в процессе
+DEFAULT_MAX_CONCURRENCY = 32
+
+DEFAULT_STRUCTURED_MODE = "json"
+
+_lock = threading.RLock()
+
+_http_client: httpx.Client | None = None
+_http_async_client: httpx.AsyncClient | None = None
+
+# (model, temperature, cache, режим вывода, схема) -> ChatOpenAI
+_models: dict = {}
+
+# (pydantic-схема, режим вывода) -> инструкции по формату
+_instructions: dict = {}
+
+# (name, режим вывода) -> промпт с подставленными инструкциями по формату
+_prompts: dict = {}
+
+# (name, model, temperature, cache) -> prompt | llm | parser
+_chains: dict = {}
+
+_sync_slots: threading.BoundedSemaphore | None = None
+
+# Подмена ChatOpenAI (бенчмарки, офлайн-прогоны): factory(model=..., temperature=..., cache=...)
+_model_factory = None
+
+# event loop -> asyncio.Semaphore (семафор привязан к своему циклу)
+_async_slots: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def _pool_limits() -> httpx.Limits:
+    """ Лимиты пула соединений из переменных окружения """
+
+    return httpx.Limits(
+        max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", DEFAULT_MAX_CONNECTIONS)),
+        max_keepalive_connections=int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", DEFAULT_MAX_KEEPALIVE_CONNECTIONS)),
+        keepalive_expiry=float(os.getenv("LLM_KEEPALIVE_EXPIRY", DEFAULT_KEEPALIVE_EXPIRY)),
+    )
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(float(os.getenv("LLM_TIMEOUT", DEFAULT_TIMEOUT)))
+
+
+def get_http_client() -> httpx.Client:
+    """ Общий синхронный HTTP-клиент с keep-alive пулом """
+
+    global _http_client
+
+    with _lock:
+        if _http_client is None:
+            _http_client = httpx.Client(limits=_pool_limits(), timeout=_timeout())
+        return _http_client
+
+
+def get_http_async_client() -> httpx.AsyncClient:
+    """ Общий асинхронный HTTP-клиент с keep-alive пулом """
+
+    global _http_async_client
+
+    with _lock:
+        if _http_async_client is None:
+            _http_async_client = httpx.AsyncClient(limits=_pool_limits(), timeout=_timeout())
+        return _http_async_client
+
+
+def node_cache_enabled(name: str) -> bool:
+    """ Кэш ответов для узла (отключается переменной <NAME>_LLM_CACHE=0) """
+
+    return os.getenv(f"{name.upper()}_LLM_CACHE", "1") != "0"
+
+
+def structured_mode() -> str:
+    """
+    Режим структурированного вывода (LLM_STRUCTURED_OUTPUT):
+    json - JSON-режим провайдера (response_format), tools - вызов функции со схемой,
+    prompt - только JSON-схема в промпте.
+    """
+
+    mode = os.getenv("LLM_STRUCTURED_OUTPUT", DEFAULT_STRUCTURED_MODE)
+    if mode not in STRUCTURED_MODES:
+        raise ValueError(f"LLM_STRUCTURED_OUTPUT должен быть одним из {STRUCTURED_MODES}, получено {mode!r}")
+    return mode
+
+
+def _structured_kwargs(mode: str, schema) -> dict:
+    """ Параметры запроса для нативного структурированного вывода """
+
+    if schema is None or mode == "prompt":
+        return {}
+    if mode == "json":
+        return {"response_format": {"type": "json_object"}}
+
+    tool = convert_to_openai_tool(schema)
+    return {
+        "tools": [tool],
+        "tool_choice": {"type": "function", "function": {"name": tool["function"]["name"]}},
+    }
+
+
+def get_chat_model(model: str, temperature: float, cache: bool = True, schema=None) -> BaseChatModel:
+    """
+    ChatOpenAI для пары (модель, температура), создается один раз.
+
+    schema - pydantic-схема ответа: включает нативный структурированный вывод
+    провайдера (см. structured_mode).
+    """
+
+    mode = structured_mode() if schema is not None else "prompt"
+    key = (model, temperature, cache, mode, schema if mode == "tools" else None)
+
+    with _lock:
+        llm = _models.get(key)
+        if llm is None and _model_factory is not None:
+            llm = _model_factory(model=model, temperature=temperature, cache=cache)
+            _models[key] = llm
+        elif llm is None:
+            # SDK openai импортируется ~0.7 с: только при первой настоящей модели
+            from langchain_openai import ChatOpenAI
+            llm = ChatOpenAI(
+                model=model,
+                base_url=os.getenv("DEEPSEEK_BASE_URL"),
+                api_key=os.getenv("DEEPSEEK_API_KEY"),
+                temperature=temperature,
+                http_client=get_http_client(),
+                http_async_client=get_http_async_client(),
+                cache=(cache and get_response_cache()) or False,
+                # Расход токенов приходит и в потоковых ответах (для metrics)
+                stream_usage=True,
+                # Повторы, сроки и размыкатель - в resilience.py
+                max_retries=0,
+                model_kwargs=_structured_kwargs(mode, schema),
+            )
+            _models[key] = llm
+        return llm
+
+
+def set_model_factory(factory=None):
+    """
+    Подменяет бэкенд моделей для всех узлов (None - снова ChatOpenAI).
+
+    factory(model=..., temperature=..., cache=...) возвращает BaseChatModel;
+    собранные ранее модели и цепочки сбрасываются.
+    """
+
+    global _model_factory
+
+    with _lock:
+        _model_factory = factory
+        _models.clear()
+        _chains.clear()
+
+
+def get_format_instructions(schema) -> str:
+    """
+    Инструкции по формату ответа для промпта (генерируются один раз).
+
+    В режиме prompt - полная JSON-схема; при нативном выводе достаточно
+    короткого примера объекта.
+    """
+
+    mode = structured_mode()
+
+    with _lock:
+        instructions = _instructions.get((schema, mode))
+        if instructions is None:
+            if mode == "prompt":
+                instructions = PydanticOutputParser(pydantic_object=schema).get_format_instructions()
+            else:
+                instructions = compact_instructions(schema)
+            _instructions[(schema, mode)] = instructions
+        return instructions
+
+
+def get_parser(schema, llm=None) -> StructuredOutputParser:
+    """ Парсер ответа с локальным ремонтом JSON; llm - для точечного повторного запроса """
+
+    if os.getenv("LLM_STRUCTURED_REASK", "1") == "0":
+        llm = None
+    return StructuredOutputParser(pydantic_object=schema, llm=llm)
+
+
+def get_prompt(name: str, messages: list, schema) -> ChatPromptTemplate:
+    """ Промпт узла; инструкции по формату подставляются заранее через partial """
+
+    key = (name, structured_mode())
+
+    with _lock:
+        prompt = _prompts.get(key)
+        if prompt is None:
+            prompt = ChatPromptTemplate.from_messages(messages)
+            if "format_instructions" in prompt.input_variables:
+                prompt = prompt.partial(format_instructions=get_format_instructions(schema))
+            _prompts[key] = prompt
+        return prompt
+
+
+def get_chain_parts(name: str, messages: list, schema, model: str, temperature: float) -> tuple:
+    """ (prompt, llm, parser) той же конфигурации, что и get_chain, - для потокового вызова """
+
+    llm = get_chat_model(model, temperature, node_cache_enabled(name), schema)
+    return get_prompt(name, messages, schema), llm, get_parser(schema, llm)
+
+
+def _forget_rejected(name: str, prompt, llm, chain):
+    """
+    chain, после которого ответ, не принятый парсером, удаляется из кэша ответов.
+
+    ChatOpenAI(cache=...) пишет ответ в кэш до разбора; без удаления негодный
+    ответ возвращался бы из кэша при каждом повторе.
+    """
+
+    def invoke(inputs: dict, config):
+        try:
+            return chain.invoke(inputs, config)
+        except OutputParserException:
+            forget_response(llm, prompt.invoke(inputs).to_messages())
+            raise
+
+    async def ainvoke(inputs: dict, config):
+        try:
+            return await chain.ainvoke(inputs, config)
+        except OutputParserException:
+            forget_response(llm, (await prompt.ainvoke(inputs)).to_messages())
+            raise
+
+    return RunnableLambda(invoke, afunc=ainvoke, name=name)
+
+
+def get_chain(name: str, messages: list, schema, model: str, temperature: float):
+    """
+    Цепочка prompt | llm | parser для узла графа.
+
+    Собирается один раз на (name, model, temperature, режим вывода).
+    """
+
+    cache = node_cache_enabled(name)
+    key = (name, model, temperature, cache, structured_mode())
+
+    with _lock:
+        chain = _chains.get(key)
+        if chain is None:
+            prompt, llm, parser = get_chain_parts(name, messages, schema, model, temperature)
+            chain = prompt | llm | parser
+            if isinstance(llm.cache, BaseCache):
+                chain = _forget_rejected(name, prompt, llm, chain)
+            _chains[key] = chain
+        return chain
+
+
+def _cache_lookup(llm, messages: list) -> str | None:
+    """ Поиск в кэше ответов по тому же ключу, что использует llm.invoke """
+
+    if not isinstance(llm.cache, BaseCache):
+        return None
+    cached = llm.cache.lookup(dumps(messages), llm._get_llm_string())
+    return message_text(cached[0]) if cached else None
+
+
+async def _acache_lookup(llm, messages: list) -> str | None:
+    if not isinstance(llm.cache, BaseCache):
+        return None
+    cached = await llm.cache.alookup(dumps(messages), llm._get_llm_string())
+    return message_text(cached[0]) if cached else None
+
+
+def parse_streamed(prompt, llm, parser, inputs: dict, text: str):
+    """
+    Разбор ответа stream_text. В кэш ответов попадает только текст, принятый
+    парсером; не принятый (в том числе взятый из кэша) оттуда удаляется.
+    """
+
+    messages = prompt.invoke(inputs).to_messages()
+    try:
+        result = parser.parse(text)
+    except OutputParserException:
+        forget_response(llm, messages)
+        raise
+
+    if isinstance(llm.cache, BaseCache) and text:
+        llm.cache.update(dumps(messages), llm._get_llm_string(), [ChatGeneration(message=AIMessage(content=text))])
+    return result
+
+
+async def aparse_streamed(prompt, llm, parser, inputs: dict, text: str):
+    """ Асинхронная версия parse_streamed """
+
+    messages = (await prompt.ainvoke(inputs)).to_messages()
+    try:
+        result = await parser.aparse(text)
+    except OutputParserException:
+        forget_response(llm, messages)
+        raise
+
+    if isinstance(llm.cache, BaseCache) and text:
+        await llm.cache.aupdate(dumps(messages), llm._get_llm_string(),
+                                [ChatGeneration(message=AIMessage(content=text))])
+    return result
+
+
+def stream_text(prompt, llm, inputs: dict):
+    """
+    Потоковый вызов модели: отдает текст ответа кусками.
+
+    llm.stream обходит кэш ответов, поэтому кэш проверяется здесь; пополняется
+    он в parse_streamed, когда ответ разобран.
+    """
+
+    messages = prompt.invoke(inputs).to_messages()
+    cached = _cache_lookup(llm, messages)
+    if cached is not None:
+        yield cached
+        return
+
+    for chunk in llm.stream(messages):
+        yield chunk_text(chunk)
+
+
+async def astream_text(prompt, llm, inputs: dict):
+    """ Асинхронная версия stream_text """
+
+    messages = (await prompt.ainvoke(inputs)).to_messages()
+    cached = await _acache_lookup(llm, messages)
+    if cached is not None:
+        yield cached
+        return
+
+    async for chunk in llm.astream(messages):
+        yield chunk_text(chunk)
+
+
+def _max_concurrency() -> int:
+    return int(os.getenv("LLM_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY))
+
+
+@contextmanager
+def llm_slot():
+    """ Ограничение числа одновременных синхронных вызовов LLM """
+
+    global _sync_slots
+
+    with _lock:
+        if _sync_slots is None:
+            _sync_slots = threading.BoundedSemaphore(_max_concurrency())
+        slots = _sync_slots
+
+    with slots:
+        yield
+
+
+@asynccontextmanager
+async def allm_slot():
+    """ Ограничение числа одновременных асинхронных вызовов LLM в event loop """
+
+    loop = asyncio.get_running_loop()
+
+    with _lock:
+        slots = _async_slots.get(loop)
+        if slots is None:
+            slots = asyncio.Semaphore(_max_concurrency())
+            _async_slots[loop] = slots
+
+    async with slots:
+        yield
+
+
+def reset_clients():
+    """ Сброс реестра (например, между запусками в разных event loop) """
+
+    global _http_client, _http_async_client
+
+    with _lock:
+        _chains.clear()
+        _prompts.clear()
+        _instructions.clear()
+        _models.clear()
+        if _http_client is not None:
+            _http_client.close()
+        _http_client = None
+        _http_async_client = None
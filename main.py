@@ -1,23 +1,23 @@
-from graph import compile_graph
-from dotenv import load_dotenv
+import startup
 
+with startup.phase("import graph"):
+    from graph import compile_graph, initialize_state
+from warm_start import remember_approved
+from renderer import render
 
-load_dotenv()
+
+startup.load_config()
 
 
 def main():
-    app = compile_graph()
+    with startup.phase("compile graph"):
+        app = compile_graph()
+    print(startup.startup_report())
     config = {"configurable": {"thread_id": "session_1"}}
 
-    initial_state = {
-        "project_description": "Хочу сервис, который помогает HR-специалисту быстро находить кандидатов по описанию вакансии и ранжировать их по релевантности",
-        "draft_artifact": None,
-        "critic_feedback": "",
-        "critic_verdict": None,
-        "revision_count": 0,
-        "user_feedback": "",
-        "user_has_provided_feedback": False,
-    }
+    initial_state = initialize_state(
+        "Хочу сервис, который помогает HR-специалисту быстро находить кандидатов по описанию вакансии и ранжировать их по релевантности"
+    )
 
     print("=== ЗАПУСК АГЕНТНОЙ СИСТЕМЫ ===")
 
@@ -31,16 +31,7 @@ def main():
 
         artifact = state.values.get('draft_artifact')
         if artifact:
-            md_text = f"# {artifact.get('title', 'Без названия')}\n\n"
-            md_text += f"## Описание\n{artifact.get('description', '')}\n\n"
-            md_text += "## Цели\n" + "\n".join([f"- {g}" for g in artifact.get('goals', [])]) + "\n\n"
-            md_text += "## Функциональные требования\n"
-
-            reqs = artifact.get('functional_requirements') or artifact.get('requirements') or []
-            for r in reqs:
-                r_id = r.get('id') if isinstance(r, dict) else getattr(r, 'id', 'N/A')
-                r_desc = r.get('description') if isinstance(r, dict) else getattr(r, 'description', '')
-                md_text += f"- **{r_id}**: {r_desc}\n"
+            md_text = render(artifact, "markdown")
 
             print("\n" + "=" * 40)
             print(md_text)
@@ -54,6 +45,7 @@ def main():
 
             if feedback.lower() == 'ok':
                 app.invoke({"user_has_provided_feedback": False}, config=config)
+                remember_approved(state.values)
             else:
                 app.invoke({"user_has_provided_feedback": True, "user_feedback": feedback}, config=config)
 
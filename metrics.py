@@ -0,0 +1,286 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from contextvars import ContextVar
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.exceptions import OutputParserException
+from langchain_core.runnables import RunnableLambda
+from langchain_core.tracers.context import register_configure_hook
+
+from patches import PatchError
+from budget import charge
+
+
+# Границы корзин гистограммы длительности узлов (секунды)
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Сколько последних сессий хранить в разбивке по thread_id
+DEFAULT_MAX_THREADS = 1000
+
+COUNTERS = ("calls", "errors", "llm_calls", "prompt_tokens", "completion_tokens", "cached_tokens", "parse_failures")
+
+
+class NodeRun:
+    """ Замер одного выполнения узла графа """
+
+    def __init__(self, node: str, thread_id: str, revision: int):
+        self.node = node
+        self.thread_id = thread_id
+        self.revision = revision
+        self.started = time.time()
+        self.duration = 0.0
+        self.error = None
+        self.llm_calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.parse_failures = 0
+        self.lock = threading.Lock()
+
+    def add_usage(self, prompt_tokens: int, completion_tokens: int, cached_tokens: int):
+        # Критик может вызывать LLM из нескольких потоков одного узла
+        with self.lock:
+            self.llm_calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.cached_tokens += cached_tokens
+
+    def add_parse_failure(self):
+        with self.lock:
+            self.parse_failures += 1
+
+    def to_dict(self) -> dict:
+        return {
+            "node": self.node,
+            "thread_id": self.thread_id,
+            "revision": self.revision,
+            "started_at": self.started,
+            "duration": round(self.duration, 6),
+            "error": self.error,
+            "llm_calls": self.llm_calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cached_tokens": self.cached_tokens,
+            "parse_failures": self.parse_failures,
+        }
+
+
+_current_run: ContextVar[NodeRun | None] = ContextVar("current_node_run", default=None)
+
+
+def current_run() -> NodeRun | None:
+    """ Замер узла, внутри которого выполняется код (None вне графа) """
+
+    return _current_run.get()
+
+
+def note_parse_failure(error: Exception):
+    """ Учет ошибки разбора ответа LLM в текущем узле; прочие исключения игнорируются """
+
+    run = _current_run.get()
+    if run is not None and isinstance(error, (OutputParserException, PatchError)):
+        run.add_parse_failure()
+
+
+def _usage(response) -> tuple[int, int, int]:
+    """ (prompt, completion, cached) токены из ответа модели """
+
+    prompt = completion = cached = 0
+    for generations in response.generations:
+        for generation in generations:
+            message = getattr(generation, "message", None)
+            usage = getattr(message, "usage_metadata", None)
+            if usage:
+                prompt += usage.get("input_tokens", 0)
+                completion += usage.get("output_tokens", 0)
+                details_cached = (usage.get("input_token_details") or {}).get("cache_read", 0) or 0
+                # DeepSeek отдает попадания в кэш контекста отдельным полем usage
+                raw = (getattr(message, "response_metadata", None) or {}).get("token_usage") or {}
+                cached += details_cached or raw.get("prompt_cache_hit_tokens", 0) or 0
+
+    token_usage = (response.llm_output or {}).get("token_usage") or {}
+    if not prompt and token_usage:
+        prompt = token_usage.get("prompt_tokens", 0)
+        completion = token_usage.get("completion_tokens", 0)
+    if not cached and token_usage:
+        cached = token_usage.get("prompt_cache_hit_tokens", 0) or 0
+
+    return prompt, completion, cached
+
+
+class UsageCallbackHandler(BaseCallbackHandler):
+    """ Переносит расход токенов из ответов LLM в замер текущего узла """
+
+    def on_llm_end(self, response, **kwargs):
+        run = _current_run.get()
+        if run is not None:
+            run.add_usage(*_usage(response))
+
+
+# Обработчик подключается ко всем вызовам LangChain в процессе и пишет только внутри узлов
+_usage_handler: ContextVar[UsageCallbackHandler | None] = ContextVar(
+    "usage_callback_handler", default=UsageCallbackHandler()
+)
+register_configure_hook(_usage_handler, inheritable=True)
+
+
+class MetricsRegistry:
+    """
+    Метрики узлов графа в памяти процесса.
+
+    Агрегаты по узлам отдаются в формате Prometheus (to_prometheus) и JSON (to_json);
+    разбивка по thread_id хранится для последних max_threads сессий и есть только в JSON,
+    чтобы не раздувать число временных рядов Prometheus.
+    """
+
+    def __init__(self, max_threads: int = DEFAULT_MAX_THREADS):
+        self.max_threads = max_threads
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.nodes = {}
+            self.threads = OrderedDict()
+
+    @staticmethod
+    def _empty() -> dict:
+        return {**{c: 0 for c in COUNTERS}, "duration_sum": 0.0, "buckets": [0] * len(DURATION_BUCKETS)}
+
+    @staticmethod
+    def _add(stats: dict, run: NodeRun):
+        stats["calls"] += 1
+        stats["errors"] += run.error is not None
+        stats["duration_sum"] += run.duration
+        for c in COUNTERS[2:]:
+            stats[c] += getattr(run, c)
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if run.duration <= bound:
+                stats["buckets"][i] += 1
+
+    def record(self, run: NodeRun):
+        with self.lock:
+            self._add(self.nodes.setdefault(run.node, self._empty()), run)
+
+            thread = self.threads.pop(run.thread_id, None) or {}
+            self._add(thread.setdefault(run.node, self._empty()), run)
+            thread["last_revision"] = max(thread.get("last_revision", 0), run.revision)
+            self.threads[run.thread_id] = thread
+            while len(self.threads) > self.max_threads:
+                self.threads.popitem(last=False)
+
+    def to_json(self) -> dict:
+        with self.lock:
+            return json.loads(json.dumps({"nodes": self.nodes, "threads": self.threads}))
+
+    def to_prometheus(self) -> str:
+        """ Текстовый формат экспозиции Prometheus """
+
+        with self.lock:
+            nodes = json.loads(json.dumps(self.nodes))
+
+        lines = []
+        for counter in COUNTERS:
+            name = f"graph_node_{counter}_total"
+            lines.append(f"# TYPE {name} counter")
+            lines += [f'{name}{{node="{node}"}} {stats[counter]}' for node, stats in nodes.items()]
+
+        name = "graph_node_duration_seconds"
+        lines.append(f"# TYPE {name} histogram")
+        for node, stats in nodes.items():
+            for bound, count in zip(DURATION_BUCKETS, stats["buckets"]):
+                lines.append(f'{name}_bucket{{node="{node}",le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{node="{node}",le="+Inf"}} {stats["calls"]}')
+            lines.append(f'{name}_sum{{node="{node}"}} {stats["duration_sum"]:.6f}')
+            lines.append(f'{name}_count{{node="{node}"}} {stats["calls"]}')
+
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def dump_metrics(path: str):
+    """ Сохраняет registry в файл: *.json - JSON, иначе текстовый формат Prometheus """
+
+    with open(path, "w", encoding="utf-8") as f:
+        if path.endswith(".json"):
+            json.dump(registry.to_json(), f, ensure_ascii=False, indent=2)
+        else:
+            f.write(registry.to_prometheus())
+
+
+def write_trace(run: NodeRun, trace_dir: str | None = None):
+    """ Строка замера в файл трассировки сессии <METRICS_TRACE_DIR>/<thread_id>.jsonl """
+
+    trace_dir = trace_dir or os.getenv("METRICS_TRACE_DIR")
+    if not trace_dir:
+        return
+
+    os.makedirs(trace_dir, exist_ok=True)
+    filename = "".join(ch if ch.isalnum() or ch in "-_." else "_" for ch in run.thread_id) or "default"
+    with open(os.path.join(trace_dir, f"{filename}.jsonl"), "a", encoding="utf-8") as f:
+        f.write(json.dumps(run.to_dict(), ensure_ascii=False) + "\n")
+
+
+def _start(name: str, state, config) -> tuple:
+    thread_id = str(((config or {}).get("configurable") or {}).get("thread_id", ""))
+    revision = state.get("revision_count", 0) if isinstance(state, dict) else 0
+    run = NodeRun(name, thread_id, revision)
+    return run, _current_run.set(run), time.perf_counter()
+
+
+def _finish(run: NodeRun, token, started: float):
+    _current_run.reset(token)
+    run.duration = time.perf_counter() - started
+    registry.record(run)
+    if run.llm_calls:
+        print(f"\n[METRICS] {run.node}: {run.duration:.2f}s, {run.llm_calls} LLM calls, "
+              f"prompt {run.prompt_tokens} tokens (cached {run.cached_tokens}), completion {run.completion_tokens}")
+    try:
+        write_trace(run)
+    except OSError as e:
+        print(f"[METRICS] Trace write failed: {e}")
+
+
+def _charge(state, update, run: NodeRun, started: float):
+    return charge(state, update, run.prompt_tokens + run.completion_tokens, time.perf_counter() - started)
+
+
+def instrument_node(name: str, func, afunc=None, budget: bool = True) -> RunnableLambda:
+    """
+    Узел графа с замером: длительность, токены LLM, ошибки парсинга, номер ревизии.
+
+    Замер пишется в registry (и в файл трассировки, если задан METRICS_TRACE_DIR).
+    При budget расход узла добавляется к tokens_used / elapsed_seconds сессии (budget.charge);
+    узлы, ждущие человека, его не учитывают.
+    """
+
+    def run_sync(state, config):
+        run, token, started = _start(name, state, config)
+        try:
+            update = func(state)
+            return _charge(state, update, run, started) if budget else update
+        except BaseException as e:
+            run.error = type(e).__name__
+            raise
+        finally:
+            _finish(run, token, started)
+
+    async def run_async(state, config):
+        run, token, started = _start(name, state, config)
+        try:
+            update = await afunc(state)
+            return _charge(state, update, run, started) if budget else update
+        except BaseException as e:
+            run.error = type(e).__name__
+            raise
+        finally:
+            _finish(run, token, started)
+
+    if afunc is None:
+        return RunnableLambda(run_sync, name=name)
+    return RunnableLambda(run_sync, afunc=run_async, name=name)
@@ -1,98 +1,384 @@
-import os
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import PydanticOutputParser
-from dotenv import load_dotenv
+import json
+import asyncio
+from langchain_core.runnables.config import ContextThreadPoolExecutor
+from langgraph.config import get_stream_writer
+
 from state import ProjectArtifact
+from patches import ArtifactPatch, apply_patch
+from metrics import note_parse_failure
+from routing import analyst_tier, critic_tier, tier_model, record_tier
+from stream_parser import RequirementStreamParser
+from resilience import TransportError, resilient_call, aresilient_call, stream_deadline
+from nodes_critic import check_payload, acheck_payload, needs_check, remember_verdicts, DEFAULT_CRITIC_CONCURRENCY
+from llm_clients import (get_chain, get_chain_parts, stream_text, astream_text, parse_streamed, aparse_streamed,
+                         llm_slot, allm_slot)
 
-load_dotenv()
+ANALYST_TEMPERATURE = 0.7
 
-DEEPSEEK_API = os.getenv("DEEPSEEK_API_KEY")
-URL = os.getenv("DEEPSEEK_BASE_URL")
+# Сколько готовых требований из потока копится перед отправкой критику
+DEFAULT_PIPELINE_CHUNK_SIZE = 5
 
+ANALYST_GUIDELINES = """Требования к заполнению:
+1. Требования (requirements) должны быть списком объектов с id (ФТ-1, ФТ-2) и описанием.
+2. Описание требований должно быть конкретным и проверяемым (User Story), без технических деталей реализации (БД, язык программирования).
+3. Цели (goals) должны быть четкими и измеримыми.
 
-def analyst_node(state: dict):
-    """
-    Агент-аналитик.
-    Принимает:
-      - state['project_description']: Исходная идея пользователя.
-      - state['critic_feedback']: Замечания от критика.
-      - state['user_feedback']: Замечания от человека.
-    Возвращает:
-      - Обновленный state с ключом 'draft_artifact'.
-    """
-    llm = ChatOpenAI(
-        model="deepseek-reasoner",
-        base_url=URL,
-        api_key=DEEPSEEK_API,
-        temperature=0.7
-    )
+ПРИМЕРЫ ХОРОШИХ И ПЛОХИХ ТРЕБОВАНИЙ (FEW-SHOT):
 
-    parser = PydanticOutputParser(pydantic_object=ProjectArtifact)
+❌ ПЛОХО (Техническая реализация):
+"Использовать Python и библиотеку Pandas для анализа данных."
+"Данные сохраняются в таблицу users базы PostgreSQL."
+"Создать эндпоинт GET /api/v1/search."
 
-    system_prompt = """Ты - опытный Бизнес-аналитик. Твоя задача - превратить короткую идею проекта в структурированное описание.
+✅ ХОРОШО (Бизнес-логика / User Story):
+"Система автоматически анализирует загруженный файл и выделяет ключевые метрики."
+"Система сохраняет информацию о профиле пользователя."
+"Пользователь может искать товары по названию и категории."
 
-    Твой ответ ДОЛЖЕН быть валидным JSON, соответствующим схеме:
-    {format_instructions}
+❌ ПЛОХО (Вода):
+"Интерфейс должен быть удобным и красивым."
+"Система должна работать быстро."
 
-    Требования к заполнению:
-    1. Требования (requirements) должны быть списком объектов с id (ФТ-1, ФТ-2) и описанием.
-    2. Описание требований должно быть конкретным и проверяемым (User Story), без технических деталей реализации (БД, язык программирования).
-    3. Цели (goals) должны быть четкими и измеримыми.
+✅ ХОРОШО (Конкретика):
+"Интерфейс позволяет пользователю оформить заказ не более чем за 3 клика."
+"Время отклика системы на поисковый запрос не превышает 2 секунд."
 
-    ПРИМЕРЫ ХОРОШИХ И ПЛОХИХ ТРЕБОВАНИЙ (FEW-SHOT):
+Следуй этому стилю при генерации ответа.
+"""
 
-    ❌ ПЛОХО (Техническая реализация):
-    "Использовать Python и библиотеку Pandas для анализа данных."
-    "Данные сохраняются в таблицу users базы PostgreSQL."
-    "Создать эндпоинт GET /api/v1/search."
+# Общее начало системных промптов полной генерации и патча: один кэшируемый префикс у провайдера
+ANALYST_ROLE = "Ты - опытный Бизнес-аналитик.\n\n" + ANALYST_GUIDELINES
 
-    ✅ ХОРОШО (Бизнес-логика / User Story):
-    "Система автоматически анализирует загруженный файл и выделяет ключевые метрики."
-    "Система сохраняет информацию о профиле пользователя."
-    "Пользователь может искать товары по названию и категории."
+ANALYST_SYSTEM_PROMPT = ANALYST_ROLE + """
+Твоя задача - превратить короткую идею проекта в структурированное описание.
 
-    ❌ ПЛОХО (Вода):
-    "Интерфейс должен быть удобным и красивым."
-    "Система должна работать быстро."
+Твой ответ ДОЛЖЕН быть валидным JSON, соответствующим схеме:
+{format_instructions}
+"""
 
-    ✅ ХОРОШО (Конкретика):
-    "Интерфейс позволяет пользователю оформить заказ не более чем за 3 клика."
-    "Время отклика системы на поисковый запрос не превышает 2 секунд."
+ANALYST_PATCH_SYSTEM_PROMPT = ANALYST_ROLE + """
+Твоя задача - точечно доработать уже существующее структурированное описание проекта.
+
+Правила правок:
+- Не повторяй требования, которые не меняются.
+- add - новое требование со следующим свободным id, modify - новое описание существующего требования, remove - удаление требования.
+- title, description, goals указывай только если их нужно изменить.
+
+Верни ТОЛЬКО список правок в виде валидного JSON, соответствующего схеме:
+{format_instructions}
+"""
+
+ANALYST_MESSAGES = [
+    ("system", ANALYST_SYSTEM_PROMPT),
+    ("user", "{user_message}")
+]
+
+ANALYST_PATCH_MESSAGES = [
+    ("system", ANALYST_PATCH_SYSTEM_PROMPT),
+    ("user", "{user_message}")
+]
+
+
+PATCH_TASK = "\n\nЗАДАЧА: Верни только правки к текущей версии проекта с учетом замечаний ниже. Не повторяй неизменные требования."
+FULL_TASK = "\n\nЗАДАЧА: Обнови текущую версию проекта с учетом замечаний ниже. НЕ переписывай весь проект с нуля, если это не требуется. Сохрани существующие требования, если они не противоречат правкам."
+
+# Теплый старт (warm_start.py): черновик взят из утвержденного похожего проекта
+WARM_START_TASK = "\n\nЗАДАЧА: Это утвержденное описание похожего проекта. Приведи его в соответствие с идеей проекта выше: измени только то, что отличается. Требования, которые подходят и так, не трогай."
+
+
+def build_user_message(state: dict, patch: bool = False) -> str:
+    """ Сборка пользовательского сообщения для аналитика из состояния графа """
 
-    Следуй этому стилю при генерации ответа.
-    """
     current_artifact = state.get("draft_artifact")
     user_message = f"Идея проекта: {state.get('project_description', '')}"
-    if current_artifact:
-        import json
-        artifact_str = json.dumps(current_artifact, ensure_ascii=False, indent=2)
-        user_message += f"\n\nТЕКУЩАЯ ВЕРСИЯ ПРОЕКТА:\n{artifact_str}"
-        user_message += "\n\nЗАДАЧА: Обнови текущую версию проекта с учетом замечаний ниже. НЕ переписывай весь проект с нуля, если это не требуется. Сохрани существующие требования, если они не противоречат правкам."
     critic_feedback = state.get("critic_feedback")
     user_feedback = state.get("user_feedback")
 
+    if current_artifact:
+        artifact_str = json.dumps(current_artifact, ensure_ascii=False, indent=2)
+        if state.get("warm_start") and not state.get("revision_count") and not critic_feedback and not user_feedback:
+            user_message += f"\n\nУТВЕРЖДЕННОЕ ОПИСАНИЕ ПОХОЖЕГО ПРОЕКТА:\n{artifact_str}"
+            user_message += WARM_START_TASK
+        else:
+            user_message += f"\n\nТЕКУЩАЯ ВЕРСИЯ ПРОЕКТА:\n{artifact_str}"
+            user_message += PATCH_TASK if patch else FULL_TASK
+
     if critic_feedback:
         user_message += f"\n\nПРЕДЫДУЩАЯ ВЕРСИЯ БЫЛА ОТКЛОНЕНА КРИТИКОМ.\nЗамечания критика: {critic_feedback}\nИсправь артефакт с учетом этих замечаний."
 
     if user_feedback:
         user_message += f"\n\nКОММЕНТАРИЙ ПОЛЬЗОВАТЕЛЯ: {user_feedback}\nВнеси правки согласно пожеланиям пользователя."
 
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", system_prompt),
-        ("user", "{user_message}")
-    ])
+    return user_message
+
+
+def _patch_chain(model: str, temperature: float):
+    return get_chain("analyst_patch", ANALYST_PATCH_MESSAGES, ArtifactPatch, model, temperature)
 
-    chain = prompt | llm | parser
 
+def _full_chain_parts(model: str, temperature: float):
+    return get_chain_parts("analyst", ANALYST_MESSAGES, ProjectArtifact, model, temperature)
+
+
+def _requirement_writer(progress: bool = True):
+    """ Отправка готовых требований в stream_mode="custom"; вне графа или без progress - no-op """
+
+    if progress:
+        try:
+            return get_stream_writer()
+        except RuntimeError:
+            pass
+    return lambda _: None
+
+
+class CriticPipeline:
+    """
+    Копит требования, завершенные в потоке аналитика, и отдает их критику пачками.
+
+    Требования, не прошедшие правила precritic или уже проверенные (critic_cache),
+    не отправляются: первые отклонит precheck, вторые возьмутся из кэша.
+    Отправленные пачки и их проверки (future / task) - в payloads и checks.
+    """
+
+    def __init__(self, critic_cache: dict, chunk_size: int, tier_mode: str = "auto", progress: bool = True):
+        self.critic_cache = critic_cache
+        self.chunk_size = chunk_size
+        self.tier_mode = tier_mode
+        self.pending = []
+        self.payloads = []
+        self.checks = []
+        self.write = _requirement_writer(progress)
+
+    def add(self, requirement: dict) -> dict | None:
+        """ Принимает требование; возвращает пачку для критика, когда она набралась """
+
+        self.write({"requirement": requirement})
+        if not self.chunk_size or not needs_check(requirement, self.critic_cache):
+            return None
+
+        self.pending.append(requirement)
+        if len(self.pending) < self.chunk_size:
+            return None
+
+        batch, self.pending = self.pending, []
+        self.payloads.append({"functional_requirements": batch})
+        return self.payloads[-1]
+
+    def tier(self, payload: dict) -> str:
+        return critic_tier(payload, self.tier_mode)
+
+    def cancel(self):
+        for check in self.checks:
+            check.cancel()
+
+    def results(self) -> list:
+        """ Результаты проверок (future) по порядку; ошибка - вместо результата """
+
+        results = []
+        for future in self.checks:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+        return results
+
+    async def aresults(self) -> list:
+        return await asyncio.gather(*self.checks, return_exceptions=True)
+
+    def collect(self, artifact: dict, results: list) -> dict:
+        """ Вердикты по пачкам в critic_cache; неполные пачки и ошибки проверит critic_node """
+
+        critic_cache = self.critic_cache
+        for payload, result in zip(self.payloads, results):
+            if isinstance(result, Exception):
+                note_parse_failure(result)
+                print(f"\n[ANALYST] Pipelined critic check failed: {result}")
+                continue
+            critic_cache = remember_verdicts(artifact, payload, result, critic_cache)
+
+        if self.payloads:
+            print(f"\n[ANALYST] Pipelined critic checked {len(self.payloads)} batches during generation")
+        return critic_cache
+
+
+def _stream_full(state: dict, model: str, pool, pipeline_chunk_size: int, critic_tier_mode: str,
+                 temperature: float, progress: bool) -> tuple:
+    """
+    Полная генерация потоком: готовые требования уходят критику в pool, пока ответ еще пишется.
+
+    Возвращает (артефакт, CriticPipeline); проверки критика дожидается вызывающий,
+    вне срока генерации.
+    """
+
+    prompt, llm, parser = _full_chain_parts(model, temperature)
+    stream_parser = RequirementStreamParser()
+    pipeline = CriticPipeline(state.get("critic_cache") or {}, pipeline_chunk_size, critic_tier_mode, progress)
+    parts = []
+    inputs = {"user_message": build_user_message(state)}
+
+    try:
+        with llm_slot():
+            for text in stream_text(prompt, llm, inputs):
+                parts.append(text)
+                for requirement in stream_parser.feed(text):
+                    if payload := pipeline.add(requirement):
+                        pipeline.checks.append(pool.submit(check_payload, payload, pipeline.tier(payload)))
+
+        artifact = parse_streamed(prompt, llm, parser, inputs, "".join(parts)).model_dump()
+    except Exception:
+        pipeline.cancel()
+        raise
+
+    return artifact, pipeline
+
+
+async def _astream_full(state: dict, model: str, pipeline_chunk_size: int, critic_tier_mode: str,
+                        temperature: float, progress: bool) -> tuple:
+    """ Асинхронная версия _stream_full: проверки критика - задачи asyncio """
+
+    prompt, llm, parser = _full_chain_parts(model, temperature)
+    stream_parser = RequirementStreamParser()
+    pipeline = CriticPipeline(state.get("critic_cache") or {}, pipeline_chunk_size, critic_tier_mode, progress)
+    parts = []
+    inputs = {"user_message": build_user_message(state)}
+
+    try:
+        async with allm_slot():
+            async for text in astream_text(prompt, llm, inputs):
+                parts.append(text)
+                for requirement in stream_parser.feed(text):
+                    if payload := pipeline.add(requirement):
+                        pipeline.checks.append(asyncio.create_task(acheck_payload(payload, pipeline.tier(payload))))
+
+        artifact = (await aparse_streamed(prompt, llm, parser, inputs, "".join(parts))).model_dump()
+    except BaseException:
+        pipeline.cancel()
+        raise
+
+    return artifact, pipeline
+
+
+def _full_update(artifact: dict, pipeline: CriticPipeline, results: list) -> dict:
+    return {"draft_artifact": artifact, "critic_cache": pipeline.collect(artifact, results)}
+
+
+def _patched_update(current_artifact: dict, patch: ArtifactPatch) -> dict:
+    artifact = apply_patch(current_artifact, patch)
+    print(f"\n[ANALYST] Applied patch: {len(patch.edits)} requirement edits")
+    return {"draft_artifact": artifact}
+
+
+def _transport_update(e: TransportError, tiers: dict) -> dict:
+    # Прежний черновик остается; критик эту итерацию пропустит
+    print(f"\n[ANALYST] LLM unavailable: {e}")
+    return {"llm_error": str(e), **tiers}
+
+
+def _patch_fallback(e: Exception):
+    note_parse_failure(e)
+    print(f"\n[ANALYST] Patch rejected ({e}), falling back to full regeneration")
+
+
+def analyst_node(state: dict, patch_mode: bool = True, pipeline_chunk_size: int = DEFAULT_PIPELINE_CHUNK_SIZE,
+                 tier: str = "auto", critic_tier_mode: str = "auto",
+                 temperature: float = ANALYST_TEMPERATURE, progress: bool = True):
+    """
+    Агент-аналитик.
+    Принимает:
+      - state['project_description']: Исходная идея пользователя.
+      - state['critic_feedback']: Замечания от критика.
+      - state['user_feedback']: Замечания от человека.
+    Возвращает:
+      - Обновленный state с ключами 'draft_artifact' и 'model_tiers'.
+
+    В patch_mode доработка существующего артефакта идет через список правок
+    (ArtifactPatch), которые применяются локально; если патч не парсится или
+    не применяется, артефакт генерируется заново целиком.
+
+    Полная генерация идет потоком: каждые pipeline_chunk_size готовых требований
+    сразу уходят критику, его вердикты попадают в critic_cache (0 - без конвейера).
+
+    Модель выбирается по tier (routing.analyst_tier), для критика на лету - по critic_tier_mode.
+    Вызовы LLM идут через resilience; если провайдер недоступен, черновик не меняется,
+    а ошибка возвращается в 'llm_error'.
+    progress=False - не отдавать готовые требования в stream_mode="custom"
+    (кандидаты спекулятивной генерации, см. speculative.py).
+    """
+    current_artifact = state.get("draft_artifact")
+    tier = analyst_tier(state, tier)
+    model, tiers = tier_model(tier), {"model_tiers": record_tier(state, "analyst", tier)}
+
+    if patch_mode and current_artifact:
+        def call():
+            with llm_slot():
+                return _patch_chain(model, temperature).invoke({
+                    "user_message": build_user_message(state, patch=True)
+                })
+
+        try:
+            patch = resilient_call("analyst_patch", model, call)
+            return {**_patched_update(current_artifact, patch), **tiers, "llm_error": None}
+
+        except TransportError as e:
+            return _transport_update(e, tiers)
+        except Exception as e:
+            _patch_fallback(e)
+
+    pool = ContextThreadPoolExecutor(max_workers=DEFAULT_CRITIC_CONCURRENCY)
     try:
-        result_artifact = chain.invoke({
-            "format_instructions": parser.get_format_instructions(),
-            "user_message": user_message
-        })
+        # Повтор потоковой генерации начинается заново; дубль не отправляется.
+        # Срок - LLM_STREAM_DEADLINE, ожидание критика на лету в него не входит
+        artifact, pipeline = resilient_call("analyst", model, lambda: _stream_full(
+            state, model, pool, pipeline_chunk_size, critic_tier_mode, temperature, progress
+        ), hedge=False, deadline=stream_deadline())
+        return {**_full_update(artifact, pipeline, pipeline.results()), **tiers, "llm_error": None}
+
+    except TransportError as e:
+        return _transport_update(e, tiers)
+    except Exception as e:
+        note_parse_failure(e)
+        print(f"Ошибка в analyst_node: {e}")
+        return {"draft_artifact": None, **tiers, "llm_error": None}
+    finally:
+        # Поток генерации, оборванный по сроку, мог оставить проверки в очереди
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def aanalyst_node(state: dict, patch_mode: bool = True,
+                        pipeline_chunk_size: int = DEFAULT_PIPELINE_CHUNK_SIZE,
+                        tier: str = "auto", critic_tier_mode: str = "auto",
+                        temperature: float = ANALYST_TEMPERATURE, progress: bool = True):
+    """ Асинхронная версия analyst_node (для app.ainvoke / app.astream) """
 
-        return {"draft_artifact": result_artifact.model_dump()}
+    current_artifact = state.get("draft_artifact")
+    tier = analyst_tier(state, tier)
+    model, tiers = tier_model(tier), {"model_tiers": record_tier(state, "analyst", tier)}
+
+    if patch_mode and current_artifact:
+        async def call():
+            async with allm_slot():
+                return await _patch_chain(model, temperature).ainvoke({
+                    "user_message": build_user_message(state, patch=True)
+                })
+
+        try:
+            patch = await aresilient_call("analyst_patch", model, call)
+            return {**_patched_update(current_artifact, patch), **tiers, "llm_error": None}
+
+        except TransportError as e:
+            return _transport_update(e, tiers)
+        except Exception as e:
+            _patch_fallback(e)
+
+    try:
+        artifact, pipeline = await aresilient_call("analyst", model, lambda: _astream_full(
+            state, model, pipeline_chunk_size, critic_tier_mode, temperature, progress
+        ), hedge=False, deadline=stream_deadline())
+        return {**_full_update(artifact, pipeline, await pipeline.aresults()), **tiers, "llm_error": None}
 
+    except TransportError as e:
+        return _transport_update(e, tiers)
     except Exception as e:
+        note_parse_failure(e)
         print(f"Ошибка в analyst_node: {e}")
-        return {"draft_artifact": None}
\ No newline at end of file
+        return {"draft_artifact": None, **tiers, "llm_error": None}
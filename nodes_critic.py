@@ -1,121 +1,449 @@
-import os
 import json
-from typing import Literal, Optional
+import asyncio
+import hashlib
+from typing import List, Literal, Optional
 from pydantic import BaseModel, Field
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import PydanticOutputParser
-from dotenv import load_dotenv
+from langchain_core.runnables.config import ContextThreadPoolExecutor
+from llm_clients import get_chain, llm_slot, allm_slot
+from precritic import lint_artifact, lint_requirement, format_feedback
+from metrics import note_parse_failure
+from budget import remember_best
+from resilience import TransportError, resilient_call, aresilient_call
+from routing import FAST, critic_tier, tier_model, record_tier
 
-load_dotenv()
+CRITIC_TEMPERATURE = 0.0
 
-DEEPSEEK_API = os.getenv("DEEPSEEK_API_KEY")
-URL = os.getenv("DEEPSEEK_BASE_URL")
+# Параллельных запросов при проверке требований чанками
+DEFAULT_CRITIC_CONCURRENCY = 4
+
+
+class RequirementVerdict(BaseModel):
+    id: str = Field(description="Идентификатор проверенного требования (ФТ-1, ФТ-2, ...)")
+    verdict: Literal["OK", "REVISE"] = Field(description="Вердикт по этому требованию")
+    critique: Optional[str] = Field(description="Замечания к этому требованию (обязательно, если REVISE)", default="")
 
 
 class CriticDecision(BaseModel):
     verdict: Literal["OK", "REVISE"] = Field(description="Вердикт: OK (принять) или REVISE (отправить на доработку)")
     critique: Optional[str] = Field(description="Текст замечаний (обязательно, если REVISE)", default="")
+    header_verdict: Optional[Literal["OK", "REVISE"]] = Field(
+        description="Вердикт по названию, описанию и целям (OK, если их нет во входных данных)", default=None
+    )
+    requirements: List[RequirementVerdict] = Field(
+        description="Вердикт по каждому требованию из входных данных", default_factory=list
+    )
 
 
-def critic_node(state: dict):
-    """
-    Агент-критик.
+CRITIC_SYSTEM_PROMPT = """Ты - Старший Бизнес-аналитик. Твоя задача - валидировать Функциональные Требования (ФТ) проекта.
 
-    Принимает:
-        - state['draft_artifact']: Черновик для проверки.
+Твоя цель: Убедиться, что требования описывают ПОВЕДЕНИЕ системы (User Story), а не реализацию.
 
-    Возвращает:
-        - Обновленный state с ключами:
-         "critic_verdict": "OK" или "REVISE".
-         "critic_feedback": Замечания.
+КРИТЕРИИ ОЦЕНКИ:
+1. ЗАПРЕЩЕНЫ технические детали: Нельзя писать про SQL, Python, REST API, JSON, эндпоинты, названия таблиц. Если это есть -> REVISE.
+2. ЗАПРЕЩЕНА "вода": Фразы "сделать красиво", "быстро работать", "быть удобным" -> REVISE.
+3. НУЖНА бизнес-логика: "Пользователь нажимает кнопку...", "Система рассчитывает...", "Система отправляет уведомление..." -> это OK.
+4. Cтруктура уже проверена автоматически. Во входных данных могут быть только новые или измененные части артефакта (например, без названия и целей) - это НЕ повод для REVISE.
+5. Для КАЖДОГО требования из входных данных укажи отдельный вердикт в поле requirements, а вердикт по названию, описанию и целям - в поле header_verdict.
 
-    ВАЖНО: Эта нода НЕ инкрементирует счетчик итераций. Это делает нода 'increment' в графе.
-    """
+ПРИМЕРЫ ВАЛИДАЦИИ (FEW-SHOT):
 
-    draft = state.get("draft_artifact")
+Пример 1:
+Вход: "ФТ-1: При нажатии кнопки данные отправляются в формате JSON через POST-запрос на сервер."
+Вердикт: REVISE
+Критика: "Требование содержит технические детали реализации (JSON, POST-запрос). Перепишите как действие пользователя или системы: 'При нажатии кнопки система сохраняет введенные данные'."
 
-    if not draft:
-        return {
-            "critic_verdict": "REVISE",
-            "critic_feedback": "Артефакт пустой или не был сгенерирован.",
-        }
+Пример 2:
+Вход: "ФТ-2: Система должна быть интуитивно понятной для любого пользователя."
+Вердикт: REVISE
+Критика: "Требование слишком размытое ('интуитивно понятной'). Замените на конкретный сценарий использования или измеримый критерий."
 
-    llm = ChatOpenAI(
-        model="deepseek-reasoner",
-        base_url=URL,
-        api_key=DEEPSEEK_API,
-        temperature=0.0
-    )
+Пример 3:
+Вход: "ФТ-3: Пользователь загружает отчет в формате PDF, система извлекает из него итоговую сумму."
+Вердикт: OK
+Критика: "" (Указание формата PDF допустимо, так как это бизнес-требование к входным данным, а не внутренняя реализация).
+
+Пример 4:
+Вход: "ФТ-4: Система рассчитывает скидку на основе истории покупок и отправляет уведомление на email."
+Вердикт: OK
+Критика: ""
+
+Анализируй входные требования так же строго.
+
+{format_instructions}
+"""
 
-    parser = PydanticOutputParser(pydantic_object=CriticDecision)
+# Системный промпт неизменен между вызовами (кэш префикса у провайдера), артефакт - в конце
+CRITIC_MESSAGES = [
+    ("system", CRITIC_SYSTEM_PROMPT),
+    ("user", "Входные данные (JSON):\n{artifact_json}")
+]
 
-    system_prompt = """Ты - Старший Бизнес-аналитик. Твоя задача - валидировать Функциональные Требования (ФТ) проекта.
 
-    Твоя цель: Убедиться, что требования описывают ПОВЕДЕНИЕ системы (User Story), а не реализацию.
+HEADER_KEY = "header"
 
-    КРИТЕРИИ ОЦЕНКИ:
-    1. ЗАПРЕЩЕНЫ технические детали: Нельзя писать про SQL, Python, REST API, JSON, эндпоинты, названия таблиц. Если это есть -> REVISE.
-    2. ЗАПРЕЩЕНА "вода": Фразы "сделать красиво", "быстро работать", "быть удобным" -> REVISE.
-    3. НУЖНА бизнес-логика: "Пользователь нажимает кнопку...", "Система рассчитывает...", "Система отправляет уведомление..." -> это OK.
-    4. Cтруктура: Проверь, что заполнены все поля (Название, Описание, Цели, Требования).
 
-    ПРИМЕРЫ ВАЛИДАЦИИ (FEW-SHOT):
+def _fingerprint(value) -> str:
+    return hashlib.sha1(json.dumps(value, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
 
-    Пример 1:
-    Вход: "ФТ-1: При нажатии кнопки данные отправляются в формате JSON через POST-запрос на сервер."
-    Вердикт: REVISE
-    Критика: "Требование содержит технические детали реализации (JSON, POST-запрос). Перепишите как действие пользователя или системы: 'При нажатии кнопки система сохраняет введенные данные'."
 
-    Пример 2:
-    Вход: "ФТ-2: Система должна быть интуитивно понятной для любого пользователя."
-    Вердикт: REVISE
-    Критика: "Требование слишком размытое ('интуитивно понятной'). Замените на конкретный сценарий использования или измеримый критерий."
+def requirement_fingerprint(requirement: dict) -> str:
+    """ Отпечаток требования: вердикт зависит только от текста, а не от номера """
 
-    Пример 3:
-    Вход: "ФТ-3: Пользователь загружает отчет в формате PDF, система извлекает из него итоговую сумму."
-    Вердикт: OK
-    Критика: "" (Указание формата PDF допустимо, так как это бизнес-требование к входным данным, а не внутренняя реализация).
+    return "req:" + _fingerprint(" ".join(requirement.get("description", "").split()))
 
-    Пример 4:
-    Вход: "ФТ-4: Система рассчитывает скидку на основе истории покупок и отправляет уведомление на email."
-    Вердикт: OK
-    Критика: ""
 
-    Анализируй входные требования так же строго.
+def header_fingerprint(draft: dict) -> str:
+    """ Отпечаток "шапки" артефакта: название, описание, цели """
 
-    Входные данные (JSON):
-    {artifact_json}
+    return f"{HEADER_KEY}:" + _fingerprint([draft.get("title"), draft.get("description"), draft.get("goals")])
 
-    {format_instructions}
+
+def pending_payload(draft: dict, critic_cache: dict) -> dict | None:
+    """
+    Часть артефакта, которую критик еще не проверял.
+
+    Требования и шапка, чьи отпечатки уже есть в critic_cache, не отправляются;
+    None - проверять нечего, вердикт собирается из кэша.
     """
 
-    prompt = ChatPromptTemplate.from_messages([("system", system_prompt)])
-    chain = prompt | llm | parser
+    payload = {}
+    if header_fingerprint(draft) not in critic_cache:
+        payload.update({
+            "title": draft.get("title"),
+            "description": draft.get("description"),
+            "goals": draft.get("goals"),
+        })
+
+    requirements = [
+        r for r in draft.get("functional_requirements", [])
+        if requirement_fingerprint(r) not in critic_cache
+    ]
+    if requirements:
+        payload["functional_requirements"] = requirements
+
+    return payload or None
 
+
+def _artifact_json(draft) -> str:
     try:
-        artifact_str = json.dumps(draft, ensure_ascii=False, indent=2)
+        return json.dumps(draft, ensure_ascii=False, indent=2)
     except:
-        artifact_str = str(draft)
+        return str(draft)
 
-    try:
-        decision = chain.invoke({
-            "artifact_json": artifact_str,
-            "format_instructions": parser.get_format_instructions()
-        })
 
-        print(f"\n[CRITIC] Verdict: {decision.verdict}")
-        if decision.verdict == "REVISE":
-            print(f"[CRITIC] Feedback: {decision.critique}")
+def _header_verdict(decision: CriticDecision) -> str | None:
+    """
+    Вердикт по шапке артефакта. Если критик его не указал, годится общий вердикт,
+    но только когда ни одно требование не отклонено: иначе неясно, к чему относится REVISE.
+    """
+
+    if decision.header_verdict is not None:
+        return decision.header_verdict
+    if any(v.verdict == "REVISE" for v in decision.requirements):
+        return None
+    return decision.verdict
 
-        return {
-            "critic_verdict": decision.verdict,
-            "critic_feedback": decision.critique,
+
+def remember_verdicts(draft: dict, payload: dict, decision: CriticDecision, critic_cache: dict) -> dict:
+    """ Дополняет кэш вердиктами по только что проверенным частям артефакта """
+
+    critic_cache = dict(critic_cache)
+    by_id = {v.id: v for v in decision.requirements}
+
+    header_verdict = _header_verdict(decision)
+    if "title" in payload and header_verdict is not None:
+        critic_cache[header_fingerprint(draft)] = {
+            "id": HEADER_KEY,
+            "verdict": header_verdict,
+            "critique": decision.critique if header_verdict == "REVISE" else "",
+        }
+
+    for requirement in payload.get("functional_requirements", []):
+        item = by_id.get(requirement.get("id"))
+        if item is None:
+            # Критик не дал вердикт по требованию: запоминаем только явный общий OK
+            if decision.verdict != "OK":
+                continue
+            item = RequirementVerdict(id=requirement.get("id", ""), verdict="OK")
+        critic_cache[requirement_fingerprint(requirement)] = {
+            "id": requirement.get("id"),
+            "verdict": item.verdict,
+            "critique": item.critique or "",
         }
 
+    return critic_cache
+
+
+def merge_verdicts(draft: dict, critic_cache: dict, decision: CriticDecision | None = None) -> dict:
+    """
+    Итоговый вердикт по всему артефакту из кэша вердиктов.
+
+    Кэш в обновлении состояния урезается до отпечатков текущей версии артефакта.
+    """
+
+    keys = [header_fingerprint(draft)] + [requirement_fingerprint(r) for r in draft.get("functional_requirements", [])]
+    current = {k: critic_cache[k] for k in keys if k in critic_cache}
+
+    problems = [
+        (v["critique"] if v["id"] == HEADER_KEY else f"{v['id']}: {v['critique']}")
+        for v in current.values() if v["verdict"] == "REVISE"
+    ]
+    # Общий REVISE не теряется: он решает, если часть артефакта осталась без вердикта
+    # или ни одна из частей не отклонена
+    if decision is not None and decision.verdict == "REVISE" and (len(current) < len(keys) or not problems):
+        problems.append(decision.critique or "")
+
+    verdict = "REVISE" if problems else "OK"
+    feedback = "\n".join(p for p in problems if p)
+
+    print(f"\n[CRITIC] Verdict: {verdict}")
+    if verdict == "REVISE":
+        print(f"[CRITIC] Feedback: {feedback}")
+
+    return {
+        "critic_verdict": verdict,
+        "critic_feedback": feedback,
+        "critic_cache": current,
+    }
+
+
+def _error_update(e: Exception) -> dict:
+    print(f"Ошибка в critic_node: {e}")
+    return {
+        "critic_verdict": "REVISE",
+        "critic_feedback": f"Произошла техническая ошибка при валидации: {e}",
+    }
+
+
+def _transport_update(e: TransportError, critic_cache: dict) -> dict:
+    """ LLM недоступна: вердикта нет, ошибка отдельно от замечаний критика (llm_error) """
+
+    print(f"\n[CRITIC] LLM unavailable, draft not checked: {e}")
+    return {
+        "critic_verdict": None,
+        "critic_feedback": "",
+        "critic_cache": critic_cache,
+        "llm_error": str(e),
+    }
+
+
+EMPTY_DRAFT_UPDATE = {
+    "critic_verdict": "REVISE",
+    "critic_feedback": "Артефакт пустой или не был сгенерирован.",
+}
+
+
+def precheck(draft) -> dict | None:
+    """ Локальная проверка правил; при нарушениях - готовый REVISE без вызова LLM """
+
+    if not draft:
+        return dict(EMPTY_DRAFT_UPDATE)
+
+    violations = lint_artifact(draft)
+    if not violations:
+        return None
+
+    feedback = format_feedback(violations)
+    print(f"\n[PRECRITIC] Verdict: REVISE ({len(violations)} violations)")
+    print(f"[PRECRITIC] Feedback: {feedback}")
+
+    return {
+        "critic_verdict": "REVISE",
+        "critic_feedback": feedback,
+    }
+
+
+def split_payload(payload: dict, chunk_size: int | None) -> list:
+    """ Делит проверяемые требования на чанки; шапка артефакта уходит с первым чанком """
+
+    requirements = payload.get("functional_requirements", [])
+    if not chunk_size or len(requirements) <= chunk_size:
+        return [payload]
+
+    chunks = [
+        {"functional_requirements": requirements[i:i + chunk_size]}
+        for i in range(0, len(requirements), chunk_size)
+    ]
+    chunks[0].update({k: v for k, v in payload.items() if k != "functional_requirements"})
+    return chunks
+
+
+def combine_decisions(decisions: list) -> CriticDecision:
+    """ Сводит решения по чанкам в одно (REVISE, если хоть один чанк отклонен) """
+
+    if len(decisions) == 1:
+        return decisions[0]
+
+    rejected = [d for d in decisions if d.verdict == "REVISE"]
+    headers = [d.header_verdict for d in decisions if d.header_verdict is not None]
+    return CriticDecision(
+        verdict="REVISE" if rejected else "OK",
+        critique="\n".join(d.critique for d in rejected if d.critique),
+        header_verdict=("REVISE" if "REVISE" in headers else "OK") if headers else None,
+        requirements=[r for d in decisions for r in d.requirements],
+    )
+
+
+def collect_verdicts(draft: dict, chunks: list, results: list, critic_cache: dict) -> dict:
+    """ Обновление состояния по результатам проверки чанков (результат может быть исключением) """
+
+    decisions = []
+    for chunk, result in zip(chunks, results):
+        if isinstance(result, Exception):
+            note_parse_failure(result)
+            continue
+        critic_cache = remember_verdicts(draft, chunk, result, critic_cache)
+        decisions.append(result)
+
+    if errors := [r for r in results if isinstance(r, Exception)]:
+        # Вердикты успешных чанков сохраняются, повторно проверятся только упавшие
+        if transport := [e for e in errors if isinstance(e, TransportError)]:
+            return _transport_update(transport[0], critic_cache)
+        return {**_error_update(errors[0]), "critic_cache": critic_cache}
+
+    return merge_verdicts(draft, critic_cache, combine_decisions(decisions))
+
+
+def _critic_chain(tier: str):
+    return get_chain("critic", CRITIC_MESSAGES, CriticDecision, tier_model(tier), CRITIC_TEMPERATURE)
+
+
+def check_payload(payload: dict, tier: str = FAST) -> CriticDecision:
+    """ Один вызов LLM-критика по части артефакта на модели уровня tier (через resilient_call) """
+
+    def call():
+        with llm_slot():
+            return _critic_chain(tier).invoke({
+                "artifact_json": _artifact_json(payload)
+            })
+
+    return resilient_call("critic", tier_model(tier), call)
+
+
+async def acheck_payload(payload: dict, tier: str = FAST) -> CriticDecision:
+    """ Асинхронная версия check_payload """
+
+    async def call():
+        async with allm_slot():
+            return await _critic_chain(tier).ainvoke({
+                "artifact_json": _artifact_json(payload)
+            })
+
+    return await aresilient_call("critic", tier_model(tier), call)
+
+
+def needs_check(requirement: dict, critic_cache: dict) -> bool:
+    """ Требование стоит отдать LLM-критику: правила пройдены и вердикта в кэше еще нет """
+
+    return requirement_fingerprint(requirement) not in critic_cache and not lint_requirement(requirement)
+
+
+def _safe_call(func, *args):
+    try:
+        return func(*args)
     except Exception as e:
-        print(f"Ошибка в critic_node: {e}")
-        return {
-            "critic_verdict": "REVISE",
-            "critic_feedback": f"Произошла техническая ошибка при валидации: {e}",
-        }
\ No newline at end of file
+        return e
+
+
+def _check_draft(state: dict, chunk_size: int | None, max_concurrency: int, tier: str) -> dict:
+    if state.get("llm_error"):
+        # Аналитик не получил ответ LLM в этой итерации: проверять нечего
+        print("\n[CRITIC] Skipped: analyst could not reach LLM")
+        return {}
+
+    draft = state.get("draft_artifact")
+
+    if rejected := precheck(draft):
+        return rejected
+
+    critic_cache = state.get("critic_cache") or {}
+    payload = pending_payload(draft, critic_cache)
+    if payload is None:
+        print("\n[CRITIC] Nothing changed since last check, reusing verdicts")
+        return merge_verdicts(draft, critic_cache)
+
+    tier = critic_tier(payload, tier)
+    chunks = split_payload(payload, chunk_size)
+    if len(chunks) == 1:
+        results = [_safe_call(check_payload, chunks[0], tier)]
+    else:
+        print(f"\n[CRITIC] Checking {len(chunks)} chunks in parallel")
+        with ContextThreadPoolExecutor(max_workers=max_concurrency) as pool:
+            results = list(pool.map(lambda chunk: _safe_call(check_payload, chunk, tier), chunks))
+
+    return {
+        **collect_verdicts(draft, chunks, results, critic_cache),
+        "model_tiers": record_tier(state, "critic", tier),
+    }
+
+
+async def _acheck_draft(state: dict, chunk_size: int | None, max_concurrency: int, tier: str) -> dict:
+    if state.get("llm_error"):
+        # Аналитик не получил ответ LLM в этой итерации: проверять нечего
+        print("\n[CRITIC] Skipped: analyst could not reach LLM")
+        return {}
+
+    draft = state.get("draft_artifact")
+
+    if rejected := precheck(draft):
+        return rejected
+
+    critic_cache = state.get("critic_cache") or {}
+    payload = pending_payload(draft, critic_cache)
+    if payload is None:
+        print("\n[CRITIC] Nothing changed since last check, reusing verdicts")
+        return merge_verdicts(draft, critic_cache)
+
+    tier = critic_tier(payload, tier)
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def check(chunk: dict) -> CriticDecision:
+        async with semaphore:
+            return await acheck_payload(chunk, tier)
+
+    chunks = split_payload(payload, chunk_size)
+    if len(chunks) > 1:
+        print(f"\n[CRITIC] Checking {len(chunks)} chunks in parallel")
+    results = await asyncio.gather(*(check(chunk) for chunk in chunks), return_exceptions=True)
+
+    return {
+        **collect_verdicts(draft, chunks, results, critic_cache),
+        "model_tiers": record_tier(state, "critic", tier),
+    }
+
+
+def critic_node(state: dict, chunk_size: int | None = None, max_concurrency: int = DEFAULT_CRITIC_CONCURRENCY,
+                tier: str = "auto"):
+    """
+    Агент-критик.
+
+    Принимает:
+        - state['draft_artifact']: Черновик для проверки.
+        - state['critic_cache']: Вердикты по уже проверенным требованиям.
+
+    Возвращает:
+        - Обновленный state с ключами:
+         "critic_verdict": "OK" или "REVISE".
+         "critic_feedback": Замечания.
+         "critic_cache": Вердикты по требованиям текущей версии.
+         "model_tiers": Уровень модели, на которой шла проверка (см. routing.critic_tier).
+         "best_candidate": Лучший черновик сессии, если текущий не хуже (см. budget.remember_best).
+         "llm_error": Ошибка связи с LLM (вместо вердикта, см. resilience.TransportError).
+
+    В LLM уходят только новые и измененные требования (и шапка, если она менялась).
+    Если задан chunk_size, требования проверяются чанками параллельно
+    (не более max_concurrency одновременных запросов).
+
+    ВАЖНО: Эта нода НЕ инкрементирует счетчик итераций. Это делает нода 'increment' в графе.
+    """
+
+    update = _check_draft(state, chunk_size, max_concurrency, tier)
+    return {**update, **remember_best(state, update)}
+
+
+async def acritic_node(state: dict, chunk_size: int | None = None, max_concurrency: int = DEFAULT_CRITIC_CONCURRENCY,
+                       tier: str = "auto"):
+    """ Асинхронная версия critic_node (для app.ainvoke / app.astream) """
+
+    update = await _acheck_draft(state, chunk_size, max_concurrency, tier)
+    return {**update, **remember_best(state, update)}
@@ -0,0 +1,77 @@
+from typing import List, Literal, Optional
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
+
+from state import ProjectArtifact
+
+
+class RequirementEdit(BaseModel):
+    """Одна правка функционального требования"""
+
+    op: Literal["add", "modify", "remove"] = Field(
+        description="Операция: add (новое требование), modify (изменить описание), remove (удалить)"
+    )
+    id: str = Field(description="Идентификатор требования (ФТ-1, ФТ-2, ...)")
+    description: Optional[str] = Field(
+        description="Новое описание требования (обязательно для add и modify)", default=None
+    )
+
+
+class ArtifactPatch(BaseModel):
+    """Компактный набор правок артефакта вместо полной перегенерации"""
+
+    # Полный артефакт вместо патча не должен молча превратиться в "ноль правок"
+    model_config = ConfigDict(extra="forbid")
+
+    title: Optional[str] = Field(description="Новое название (только если его нужно изменить)", default=None)
+    description: Optional[str] = Field(description="Новое описание (только если его нужно изменить)", default=None)
+    goals: Optional[List[str]] = Field(description="Новый список целей (только если цели нужно изменить)", default=None)
+    edits: List[RequirementEdit] = Field(description="Правки функциональных требований", default_factory=list)
+
+
+class PatchError(ValueError):
+    """Патч не применим к текущей версии артефакта"""
+
+
+def apply_patch(artifact: dict, patch: ArtifactPatch) -> dict:
+    """
+    Применяет патч к артефакту (dict) и возвращает новую версию.
+
+    Порядок существующих требований сохраняется, новые добавляются в конец.
+    PatchError - если правка ссылается на несуществующее требование, дублирует id
+    или результат не проходит валидацию ProjectArtifact.
+    """
+
+    requirements = [dict(r) for r in artifact.get("functional_requirements", [])]
+    index = {r["id"]: r for r in requirements}
+
+    for edit in patch.edits:
+        if edit.op in ("add", "modify") and not (edit.description or "").strip():
+            raise PatchError(f"{edit.op} {edit.id}: не указано описание")
+
+        if edit.op == "add":
+            if edit.id in index:
+                raise PatchError(f"add {edit.id}: требование уже существует")
+            index[edit.id] = {"id": edit.id, "description": edit.description}
+            requirements.append(index[edit.id])
+
+        elif edit.op == "modify":
+            if edit.id not in index:
+                raise PatchError(f"modify {edit.id}: требование не найдено")
+            index[edit.id]["description"] = edit.description
+
+        elif edit.op == "remove":
+            if edit.id not in index:
+                raise PatchError(f"remove {edit.id}: требование не найдено")
+            requirements.remove(index.pop(edit.id))
+
+    result = {
+        "title": patch.title if patch.title is not None else artifact.get("title"),
+        "description": patch.description if patch.description is not None else artifact.get("description"),
+        "goals": patch.goals if patch.goals is not None else artifact.get("goals"),
+        "functional_requirements": requirements,
+    }
+
+    try:
+        return ProjectArtifact.model_validate(result).model_dump()
+    except ValidationError as e:
+        raise PatchError(f"результат патча невалиден: {e}") from e
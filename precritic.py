@@ -0,0 +1,130 @@
+import os
+import re
+import json
+from functools import lru_cache
+
+
+# Технические детали реализации: метка -> регулярное выражение
+BANNED_TERMS = {
+    "SQL": r"\b(?:SQL|PostgreSQL|Postgres|MySQL|SQLite|NoSQL|MongoDB)\b",
+    "Python": r"\b(?:Python|Pandas|Django|Flask|FastAPI)\b",
+    "REST API": r"\b(?:REST|RESTful|API|GraphQL)\b",
+    "JSON": r"\bJSON\b",
+    "эндпоинт": r"\b(?:эндпоинт\w*|endpoint\w*)",
+    "HTTP-запрос": r"\b(?:GET|POST|PUT|PATCH|DELETE)(?:-запрос\w*|\s+/\S*)",
+    "название таблицы": r"\bтаблиц\w*\s+(?:[A-Za-z][A-Za-z0-9]*_[A-Za-z0-9_]+|БД\b|баз\w*\s+данных)",
+}
+
+# "Вода": размытые формулировки без проверяемого критерия - только обороты из промпта
+# критика; отдельные слова ("в удобное время", "быстрый поиск") допустимы
+VAGUE_PHRASES = {
+    "быстро работать": r"\bбыстро\s+работ\w*|\bработ\w*\s+быстро\b",
+    "быть удобным": r"\bбыть\s+удобн\w*",
+    "сделать красиво": r"\bсдела\w*\s+красиво\b",
+    "интуитивно понятно": r"\bинтуитивно\s+понятн\w*",
+    "user-friendly": r"\buser[- ]friendly\b",
+}
+
+
+@lru_cache(maxsize=None)
+def load_rules(path: str | None = None) -> tuple:
+    """
+    Скомпилированные правила: (banned, vague) - списки пар (метка, pattern).
+
+    Словари можно переопределить JSON-файлом (путь в PRECRITIC_RULES):
+    {"banned_terms": {"метка": "regex", ...}, "vague_phrases": {...}}
+    """
+
+    banned, vague = dict(BANNED_TERMS), dict(VAGUE_PHRASES)
+
+    path = path or os.getenv("PRECRITIC_RULES")
+    if path:
+        with open(path, encoding="utf-8") as f:
+            custom = json.load(f)
+        banned.update(custom.get("banned_terms", {}))
+        vague.update(custom.get("vague_phrases", {}))
+
+    def compile_rules(rules: dict) -> list:
+        return [(label, re.compile(pattern, re.IGNORECASE)) for label, pattern in rules.items() if pattern]
+
+    return compile_rules(banned), compile_rules(vague)
+
+
+def _field(obj, name: str, default=None):
+    if isinstance(obj, dict):
+        return obj.get(name, default)
+    return getattr(obj, name, default)
+
+
+def _matches(rules: list, text: str) -> list:
+    return [label for label, pattern in rules if pattern.search(text)]
+
+
+def lint_requirement(requirement) -> list:
+    """ Нарушения в одном требовании (Requirement или dict) """
+
+    banned, vague = load_rules()
+
+    r_id = _field(requirement, "id") or "ФТ-?"
+    description = (_field(requirement, "description") or "").strip()
+
+    if not description:
+        return [f"{r_id}: пустое описание требования."]
+
+    violations = []
+    if found := _matches(banned, description):
+        violations.append(
+            f"{r_id}: требование содержит технические детали реализации ({', '.join(found)}). "
+            "Перепишите как действие пользователя или системы."
+        )
+    if found := _matches(vague, description):
+        violations.append(
+            f"{r_id}: размытая формулировка ({', '.join(found)}). "
+            "Замените на конкретный сценарий или измеримый критерий."
+        )
+    return violations
+
+
+def lint_structure(artifact) -> list:
+    """ Проверка заполненности полей: Название, Описание, Цели, Требования """
+
+    violations = []
+
+    if not (_field(artifact, "title") or "").strip():
+        violations.append("Не заполнено название проекта.")
+    if not (_field(artifact, "description") or "").strip():
+        violations.append("Не заполнено описание проекта.")
+
+    goals = [g for g in (_field(artifact, "goals") or []) if str(g).strip()]
+    if not goals:
+        violations.append("Не указаны цели проекта.")
+
+    requirements = _field(artifact, "functional_requirements") or []
+    if not requirements:
+        violations.append("Не указаны функциональные требования.")
+
+    seen = set()
+    for requirement in requirements:
+        r_id = (_field(requirement, "id") or "").strip()
+        if not r_id:
+            violations.append("У одного из требований нет идентификатора.")
+        elif r_id in seen:
+            violations.append(f"Идентификатор {r_id} повторяется.")
+        seen.add(r_id)
+
+    return violations
+
+
+def lint_artifact(artifact) -> list:
+    """ Все нарушения правил в артефакте (ProjectArtifact или dict); пустой список - правила пройдены """
+
+    violations = lint_structure(artifact)
+    for requirement in _field(artifact, "functional_requirements") or []:
+        violations.extend(lint_requirement(requirement))
+    return violations
+
+
+def format_feedback(violations: list) -> str:
+    """ Текст замечаний в формате critic_feedback """
+
+    return "Автоматическая проверка выявила нарушения:\n" + "\n".join(f"- {v}" for v in violations)
@@ -0,0 +1,176 @@
+import os
+import re
+import html
+import json
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+# Предел длины одного сообщения Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Сколько отрисовок (версия артефакта, формат) держать в памяти процесса
+DEFAULT_CACHE_SIZE = 256
+
+# Расширения файлов для отправки артефакта документом
+EXTENSIONS = {"markdown": "md", "json": "json"}
+
+TAG = re.compile(r"<[^>]+>")
+
+_lock = threading.Lock()
+
+# (версия артефакта, формат) -> текст
+_cache: OrderedDict = OrderedDict()
+
+
+def _as_dict(artifact) -> dict | None:
+    if hasattr(artifact, "model_dump"):
+        return artifact.model_dump()
+    return artifact
+
+
+def _requirements(artifact: dict) -> list:
+    """ Пары (id, описание) требований; поддерживает и старый ключ requirements """
+
+    reqs = artifact.get('functional_requirements') or artifact.get('requirements') or []
+    return [
+        (r.get('id'), r.get('description')) if isinstance(r, dict)
+        else (getattr(r, 'id', 'N/A'), getattr(r, 'description', ''))
+        for r in reqs
+    ]
+
+
+def _title(artifact: dict) -> str:
+    return artifact.get('title', artifact.get('project_name', 'Проект'))
+
+
+def render_markdown(artifact: dict) -> str:
+    """ Полный Markdown - для файла """
+
+    if not artifact:
+        return "Нет данных"
+
+    text = f"# {_title(artifact)}\n\n"
+    text += f"## Описание\n{artifact.get('description', '')}\n\n"
+    text += "## Цели\n" + "\n".join(f"- {g}" for g in artifact.get('goals', [])) + "\n\n"
+    text += "## Функциональные требования\n"
+    text += "".join(f"- **{r_id}**: {r_desc}\n" for r_id, r_desc in _requirements(artifact))
+    return text
+
+
+def render_telegram(artifact: dict) -> str:
+    """ Текст сообщения Telegram (parse_mode="HTML"): пользовательский текст экранирован """
+
+    if not artifact:
+        return "⚠️ Данные отсутствуют."
+
+    e = html.escape
+    text = f"📋 <b>{e(_title(artifact))}</b>\n\n"
+    text += f"ℹ️ <b>Описание:</b>\n{e(artifact.get('description') or 'Не указано')}\n\n"
+    text += "🎯 <b>Цели:</b>\n" + "".join(f"— {e(g)}\n" for g in artifact.get('goals', []))
+    text += "\n⚙️ <b>Требования:</b>\n"
+    text += "".join(f"• <b>{e(str(r_id))}</b>: {e(str(r_desc))}\n" for r_id, r_desc in _requirements(artifact))
+    return text
+
+
+def render_json(artifact: dict) -> str:
+    return json.dumps(artifact, ensure_ascii=False, indent=2)
+
+
+RENDERERS = {
+    "markdown": render_markdown,
+    "telegram": render_telegram,
+    "json": render_json,
+}
+
+
+def artifact_version(artifact: dict) -> str:
+    """
+    Отпечаток содержимого артефакта: одинаковые версии из разных чекпоинтов совпадают.
+
+    pickle в несколько раз быстрее json.dumps(sort_keys=True); другой порядок ключей
+    дает лишь промах кэша.
+    """
+
+    return hashlib.blake2b(pickle.dumps(artifact), digest_size=16).hexdigest()
+
+
+def render(artifact, fmt: str = "markdown") -> str:
+    """
+    Артефакт в формате fmt (markdown, telegram, json).
+
+    Результат запоминается по версии артефакта: повторная отправка той же версии
+    (предпросмотр, затем файл при утверждении) не перерисовывает ее. Размер кэша -
+    RENDER_CACHE_SIZE.
+    """
+
+    if fmt not in RENDERERS:
+        raise ValueError(f"Формат должен быть одним из {tuple(RENDERERS)}, получено {fmt!r}")
+
+    artifact = _as_dict(artifact)
+    key = (artifact_version(artifact), fmt)
+
+    with _lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    text = RENDERERS[fmt](artifact)
+
+    with _lock:
+        _cache[key] = text
+        while len(_cache) > int(os.getenv("RENDER_CACHE_SIZE", DEFAULT_CACHE_SIZE)):
+            _cache.popitem(last=False)
+    return text
+
+
+def document(artifact, fmt: str = "markdown") -> bytes:
+    """ Содержимое файла артефакта в памяти (для send_document без временных файлов) """
+
+    if fmt not in EXTENSIONS:
+        raise ValueError(f"Формат файла должен быть одним из {tuple(EXTENSIONS)}, получено {fmt!r}")
+    return render(artifact, fmt).encode("utf-8")
+
+
+def document_name(stem: str, fmt: str = "markdown") -> str:
+    return f"{stem}.{EXTENSIONS[fmt]}"
+
+
+def _pieces(text: str, limit: int, separators: tuple) -> list:
+    """ Куски текста не длиннее limit, разрезанные по самому крупному возможному разделителю """
+
+    if len(text) <= limit:
+        return [text]
+    if not separators:
+        return [text[i:i + limit] for i in range(0, len(text), limit)]
+
+    sep, rest = separators[0], separators[1:]
+    parts = text.split(sep)
+    pieces = []
+    for i, part in enumerate(parts):
+        pieces.extend(_pieces(part + sep if i < len(parts) - 1 else part, limit, rest))
+    return pieces
+
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> list:
+    """
+    Разбиение длинного текста на сообщения не длиннее limit вместо обрезки.
+
+    Режем по абзацам, затем по строкам и словам: разметка render_telegram не
+    выходит за пределы строки, поэтому теги в частях остаются парными.
+    """
+
+    chunks = [""]
+    for piece in _pieces(text, limit, ("\n\n", "\n", " ")):
+        if len(chunks[-1]) + len(piece) > limit:
+            chunks.append("")
+        chunks[-1] += piece
+    return [chunk.strip("\n") for chunk in chunks if chunk.strip()]
+
+
+def plain_text(text: str) -> str:
+    """ HTML-текст render_telegram без разметки (если Telegram его не принял) """
+
+    return html.unescape(TAG.sub("", text))
@@ -0,0 +1,313 @@
+import os
+import sys
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+
+import httpx
+from langchain_core.runnables.config import ContextThreadPoolExecutor
+
+
+# Общий срок вызова LLM со всеми повторами и дублями (секунды)
+DEFAULT_DEADLINE = 90.0
+
+# Срок потоковой генерации полного артефакта: длинный ответ пишется дольше обычного вызова
+DEFAULT_STREAM_DEADLINE = 300.0
+
+# Повторы после ошибки транспорта и границы экспоненциальной задержки с джиттером
+DEFAULT_RETRIES = 2
+DEFAULT_BACKOFF_BASE = 0.5
+DEFAULT_BACKOFF_MAX = 8.0
+
+# Дубль запроса отправляется, если ответа нет дольше этого квантиля недавних задержек
+DEFAULT_HEDGE_QUANTILE = 0.95
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+
+# Размыкатель: после стольких ошибок подряд вызовы модели отклоняются сразу на reset секунд
+DEFAULT_BREAKER_THRESHOLD = 5
+DEFAULT_BREAKER_RESET = 30.0
+
+# Ошибки связи с провайдером; ошибки разбора ответа и неверные запросы сюда не входят
+BASE_TRANSPORT_ERRORS = (httpx.TransportError, TimeoutError)
+
+
+def transport_errors() -> tuple:
+    """
+    Классы ошибок связи для except.
+
+    Ошибки SDK openai добавляются, только если он уже загружен: без него
+    (ChatOpenAI еще не создавалась) их не бывает, а импорт SDK дорогой.
+    """
+
+    openai = sys.modules.get("openai")
+    if openai is None:
+        return BASE_TRANSPORT_ERRORS
+    return (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError) + BASE_TRANSPORT_ERRORS
+
+
+class TransportError(Exception):
+    """ Провайдер LLM не ответил (таймаут, сеть, 5xx, размыкатель) - это не вердикт модели """
+
+
+class CircuitOpenError(TransportError):
+    pass
+
+
+class CircuitBreaker:
+    """ Размыкатель по модели: threshold ошибок подряд - вызовы отклоняются reset_timeout секунд """
+
+    def __init__(self, threshold: int, reset_timeout: float):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self.lock:
+            # По истечении reset_timeout пропускаем пробные вызовы (half-open)
+            return self.opened_at is None or time.monotonic() - self.opened_at >= self.reset_timeout
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self) -> bool:
+        """ Учет ошибки; True - размыкатель только что сработал """
+
+        with self.lock:
+            self.failures += 1
+            if self.failures < self.threshold:
+                return False
+            just_opened = self.opened_at is None or time.monotonic() - self.opened_at >= self.reset_timeout
+            self.opened_at = time.monotonic()
+            return just_opened
+
+
+class LatencyTracker:
+    """ Скользящее окно задержек успешных вызовов для выбора момента дубля """
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.samples = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def quantile(self, q: float) -> float | None:
+        with self.lock:
+            if len(self.samples) < HEDGE_MIN_SAMPLES:
+                return None
+            values = sorted(self.samples)
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+
+_lock = threading.Lock()
+
+# model -> CircuitBreaker
+_breakers: dict = {}
+
+# (name, model) -> LatencyTracker
+_latencies: dict = {}
+
+
+def _setting(name: str, default, cast=float):
+    return cast(os.getenv(name, default))
+
+
+def _breaker(model: str) -> CircuitBreaker:
+    with _lock:
+        breaker = _breakers.get(model)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                _setting("LLM_BREAKER_THRESHOLD", DEFAULT_BREAKER_THRESHOLD, int),
+                _setting("LLM_BREAKER_RESET", DEFAULT_BREAKER_RESET),
+            )
+            _breakers[model] = breaker
+        return breaker
+
+
+def _tracker(name: str, model: str) -> LatencyTracker:
+    with _lock:
+        return _latencies.setdefault((name, model), LatencyTracker())
+
+
+def hedge_delay(name: str, model: str) -> float | None:
+    """ Через сколько секунд без ответа отправлять дубль (None - не отправлять) """
+
+    if os.getenv("LLM_HEDGE", "1") == "0":
+        return None
+    return _tracker(name, model).quantile(_setting("LLM_HEDGE_QUANTILE", DEFAULT_HEDGE_QUANTILE))
+
+
+def backoff(attempt: int) -> float:
+    """ Задержка перед повтором: экспонента с полным джиттером """
+
+    base = _setting("LLM_BACKOFF_BASE", DEFAULT_BACKOFF_BASE)
+    cap = _setting("LLM_BACKOFF_MAX", DEFAULT_BACKOFF_MAX)
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def reset_resilience():
+    """ Сброс размыкателей и статистики задержек """
+
+    with _lock:
+        _breakers.clear()
+        _latencies.clear()
+
+
+def _timed(func, tracker: LatencyTracker):
+    started = time.monotonic()
+    result = func()
+    tracker.add(time.monotonic() - started)
+    return result
+
+
+def stream_deadline() -> float:
+    """ Срок потоковой генерации со всеми повторами (LLM_STREAM_DEADLINE) """
+
+    return _setting("LLM_STREAM_DEADLINE", DEFAULT_STREAM_DEADLINE)
+
+
+def _hedged(name: str, model: str, func, deadline: float, hedge: bool):
+    """ Вызов с дублем после hedge_delay; побеждает первый успешный ответ """
+
+    delay = hedge_delay(name, model) if hedge else None
+    tracker = _tracker(name, model)
+    pool = ContextThreadPoolExecutor(max_workers=2)
+    pending = {pool.submit(_timed, func, tracker)}
+    error = None
+
+    try:
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"{name}: нет ответа LLM за отведенное время")
+
+            timeout = min(delay, remaining) if delay is not None else remaining
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+
+            if delay is not None and not done:
+                print(f"\n[LLM] {name}: no answer after {delay:.2f}s, sending hedged request")
+                pending.add(pool.submit(_timed, func, tracker))
+            delay = None
+
+        raise error
+    finally:
+        # Проигравший запрос в потоке не прервать: его ответ отбрасывается
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def _atimed(afunc, tracker: LatencyTracker):
+    started = time.monotonic()
+    result = await afunc()
+    tracker.add(time.monotonic() - started)
+    return result
+
+
+async def _ahedged(name: str, model: str, afunc, deadline: float, hedge: bool):
+    """ Асинхронная версия _hedged: проигравший запрос отменяется """
+
+    delay = hedge_delay(name, model) if hedge else None
+    tracker = _tracker(name, model)
+    pending = {asyncio.create_task(_atimed(afunc, tracker))}
+    error = None
+
+    try:
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"{name}: нет ответа LLM за отведенное время")
+
+            timeout = min(delay, remaining) if delay is not None else remaining
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+
+            if delay is not None and not done:
+                print(f"\n[LLM] {name}: no answer after {delay:.2f}s, sending hedged request")
+                pending.add(asyncio.create_task(_atimed(afunc, tracker)))
+            delay = None
+
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+def _failed(name: str, model: str, error: Exception, attempt: int, retries: int, deadline: float) -> float:
+    """ Учет ошибки транспорта; задержка перед повтором или TransportError, если повторять нельзя """
+
+    if _breaker(model).record_failure():
+        print(f"\n[LLM] Circuit breaker opened for {model}")
+
+    delay = backoff(attempt)
+    if attempt >= retries or time.monotonic() + delay >= deadline:
+        raise TransportError(f"{name}: LLM недоступна ({type(error).__name__}: {error})") from error
+
+    print(f"\n[LLM] {name}: {type(error).__name__}, retry {attempt + 1}/{retries} in {delay:.1f}s")
+    return delay
+
+
+def _check_breaker(name: str, model: str):
+    if not _breaker(model).allow():
+        raise CircuitOpenError(f"{name}: LLM {model} временно недоступна (размыкатель открыт)")
+
+
+def resilient_call(name: str, model: str, func, hedge: bool = True, deadline: float | None = None):
+    """
+    Вызов LLM func() со сроком, повторами, дублем и размыкателем.
+
+    Повторяются только ошибки связи (transport_errors) с задержкой backoff;
+    ошибки разбора и прочие исключения func пробрасываются как есть.
+    Если ответа нет дольше p95 недавних вызовов (name, model), параллельно уходит
+    дубль и берется первый ответ. hedge=False - без дубля (потоковые вызовы
+    с побочными эффектами). Исчерпанные повторы, срок deadline секунд (по умолчанию
+    LLM_DEADLINE) и открытый размыкатель дают TransportError.
+    """
+
+    deadline = time.monotonic() + (deadline or _setting("LLM_DEADLINE", DEFAULT_DEADLINE))
+    retries = _setting("LLM_RETRIES", DEFAULT_RETRIES, int)
+
+    for attempt in range(retries + 1):
+        _check_breaker(name, model)
+        try:
+            result = _hedged(name, model, func, deadline, hedge)
+        except transport_errors() as e:
+            time.sleep(_failed(name, model, e, attempt, retries, deadline))
+        else:
+            _breaker(model).record_success()
+            return result
+
+
+async def aresilient_call(name: str, model: str, afunc, hedge: bool = True, deadline: float | None = None):
+    """ Асинхронная версия resilient_call (afunc - функция, возвращающая корутину) """
+
+    deadline = time.monotonic() + (deadline or _setting("LLM_DEADLINE", DEFAULT_DEADLINE))
+    retries = _setting("LLM_RETRIES", DEFAULT_RETRIES, int)
+
+    for attempt in range(retries + 1):
+        _check_breaker(name, model)
+        try:
+            result = await _ahedged(name, model, afunc, deadline, hedge)
+        except transport_errors() as e:
+            await asyncio.sleep(_failed(name, model, e, attempt, retries, deadline))
+        else:
+            _breaker(model).record_success()
+            return result
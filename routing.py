@@ -0,0 +1,77 @@
+import os
+
+
+FAST = "fast"
+REASONER = "reasoner"
+TIER_MODES = ("auto", FAST, REASONER)
+
+# Модель каждого уровня; переопределяется переменными MODEL_FAST / MODEL_REASONER
+DEFAULT_MODELS = {
+    FAST: "deepseek-chat",
+    REASONER: "deepseek-reasoner",
+}
+
+# Аналитик переходит на reasoner для больших спецификаций
+ANALYST_REASONER_MIN_REQUIREMENTS = 15
+ANALYST_REASONER_MIN_CHARS = 4000
+
+# Критик на быстрой модели проверяет не больше стольких требований за раз
+CRITIC_FAST_MAX_REQUIREMENTS = 10
+
+
+def tier_model(tier: str) -> str:
+    """ Имя модели для уровня fast / reasoner """
+
+    return os.getenv(f"MODEL_{tier.upper()}", DEFAULT_MODELS[tier])
+
+
+def check_tier_mode(mode: str) -> str:
+    if mode not in TIER_MODES:
+        raise ValueError(f"Уровень модели должен быть одним из {TIER_MODES}, получено {mode!r}")
+    return mode
+
+
+def analyst_tier(state: dict, mode: str = "auto") -> str:
+    """
+    Уровень модели аналитика.
+
+    auto: черновик и правки по замечаниям пользователя - на быстрой модели;
+    reasoner - после REVISE критика и для больших спецификаций.
+    """
+
+    if mode != "auto":
+        return mode
+
+    if state.get("critic_verdict") == "REVISE":
+        return REASONER
+
+    draft = state.get("draft_artifact") or {}
+    if len(draft.get("functional_requirements") or []) >= ANALYST_REASONER_MIN_REQUIREMENTS:
+        return REASONER
+    if len(state.get("project_description") or "") >= ANALYST_REASONER_MIN_CHARS:
+        return REASONER
+
+    return FAST
+
+
+def critic_tier(payload: dict, mode: str = "auto") -> str:
+    """
+    Уровень модели критика для проверяемой части артефакта.
+
+    auto: LLM-критик вызывается только после прохождения правил precritic, поэтому
+    небольшие части проверяет быстрая модель; большие - reasoner.
+    """
+
+    if mode != "auto":
+        return mode
+
+    if len(payload.get("functional_requirements") or []) > CRITIC_FAST_MAX_REQUIREMENTS:
+        return REASONER
+    return FAST
+
+
+def record_tier(state: dict, node: str, tier: str) -> dict:
+    """ Обновление model_tiers в состоянии: какой уровень модели выбран узлом """
+
+    print(f"\n[ROUTING] {node} -> {tier} ({tier_model(tier)})")
+    return {**(state.get("model_tiers") or {}), node: tier}
@@ -0,0 +1,148 @@
+import asyncio
+import threading
+from concurrent.futures import FIRST_COMPLETED, CancelledError, wait
+from langchain_core.runnables.config import ContextThreadPoolExecutor
+
+from nodes_analyst import analyst_node, aanalyst_node
+from nodes_critic import critic_node, acritic_node
+from budget import problem_count
+
+
+# Температуры кандидатов по порядку: первый - обычная температура аналитика
+DEFAULT_TEMPERATURES = (0.7, 0.3, 1.0, 0.5, 0.9, 0.1)
+
+# cancel - первый принятый критиком кандидат побеждает, остальные отменяются;
+# wait - дождаться всех кандидатов и выбрать лучший
+CANCEL_POLICIES = ("cancel", "wait")
+
+# Ключи обновления состояния, которые отдает узел аналитика
+ANALYST_KEYS = ("draft_artifact", "critic_cache", "model_tiers", "llm_error")
+
+
+def check_speculative_options(drafts: int, cancel_policy: str, temperatures: tuple = DEFAULT_TEMPERATURES):
+    if cancel_policy not in CANCEL_POLICIES:
+        raise ValueError(f"Политика отмены должна быть одной из {CANCEL_POLICIES}, получено {cancel_policy!r}")
+    if not 1 <= drafts <= len(temperatures):
+        # Одинаковые температуры дали бы одинаковые ответы (и попадания в кэш ответов LLM)
+        raise ValueError(f"Число кандидатов должно быть от 1 до {len(temperatures)}, получено {drafts}")
+
+
+def select_candidate(state: dict, finished: list) -> dict:
+    """
+    Обновление состояния по лучшему из завершенных кандидатов (номер, результат).
+
+    В critic_cache победителя уже лежат вердикты по нему, поэтому узел critic
+    собирает итоговый вердикт из кэша без повторного вызова LLM. Если не
+    завершился ни один кандидат, прежний черновик и critic_cache остаются.
+    """
+
+    if not finished:
+        print("\n[SPECULATIVE] No candidate finished, keeping the previous draft")
+        return {}
+
+    index, best = min(finished, key=lambda item: problem_count(item[1]))
+    print(f"\n[SPECULATIVE] Selected candidate {index + 1} of {len(finished)} finished "
+          f"(verdict {best.get('critic_verdict')})")
+
+    update = {k: best[k] for k in ANALYST_KEYS if k in best}
+    update.setdefault("critic_cache", state.get("critic_cache") or {})
+    return update
+
+
+def _accepted(finished: list) -> bool:
+    return any(problem_count(candidate) == 0 for _, candidate in finished)
+
+
+def _candidate(state: dict, temperature: float, stop: threading.Event,
+               analyst_options: dict, critic_options: dict) -> dict:
+    update = analyst_node(state, temperature=temperature, progress=False, **analyst_options)
+    if stop.is_set():
+        # Победитель уже выбран: проверка критиком не нужна
+        raise CancelledError()
+    return {**update, **critic_node({**state, **update}, **critic_options)}
+
+
+async def _acandidate(state: dict, temperature: float, analyst_options: dict, critic_options: dict) -> dict:
+    update = await aanalyst_node(state, temperature=temperature, progress=False, **analyst_options)
+    return {**update, **await acritic_node({**state, **update}, **critic_options)}
+
+
+def speculative_analyst_node(state: dict, drafts: int = 2, cancel_policy: str = "cancel",
+                             temperatures: tuple = DEFAULT_TEMPERATURES,
+                             analyst_options: dict | None = None, critic_options: dict | None = None):
+    """
+    Спекулятивный аналитик: drafts кандидатов параллельно, каждый сразу проверяется критиком.
+
+    Кандидаты различаются температурой (temperatures). При cancel_policy="cancel"
+    побеждает первый кандидат с вердиктом OK, остальные отменяются; при "wait" -
+    ждем всех. Если OK нет ни у кого, берется кандидат с наименьшим числом замечаний.
+
+    Возвращает те же ключи, что analyst_node; вердикты победителя - в critic_cache.
+    Запросы к LLM, уже выполняющиеся в потоках, прервать нельзя: их результаты отбрасываются.
+    """
+
+    analyst_options, critic_options = analyst_options or {}, critic_options or {}
+    print(f"\n[SPECULATIVE] Generating {drafts} candidate drafts")
+
+    stop = threading.Event()
+    pool = ContextThreadPoolExecutor(max_workers=drafts)
+    futures = {
+        pool.submit(_candidate, state, temperatures[i], stop, analyst_options, critic_options): i
+        for i in range(drafts)
+    }
+    finished, pending = [], set(futures)
+
+    try:
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    finished.append((futures[future], future.result()))
+                except CancelledError:
+                    pass
+                except Exception as e:
+                    print(f"\n[SPECULATIVE] Candidate {futures[future] + 1} failed: {e}")
+            if cancel_policy == "cancel" and _accepted(finished):
+                break
+    finally:
+        stop.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    if pending:
+        print(f"\n[SPECULATIVE] Cancelled {len(pending)} candidates")
+    return select_candidate(state, finished)
+
+
+async def aspeculative_analyst_node(state: dict, drafts: int = 2, cancel_policy: str = "cancel",
+                                    temperatures: tuple = DEFAULT_TEMPERATURES,
+                                    analyst_options: dict | None = None, critic_options: dict | None = None):
+    """ Асинхронная версия speculative_analyst_node: проигравшие кандидаты отменяются вместе с запросами """
+
+    analyst_options, critic_options = analyst_options or {}, critic_options or {}
+    print(f"\n[SPECULATIVE] Generating {drafts} candidate drafts")
+
+    tasks = {
+        asyncio.create_task(_acandidate(state, temperatures[i], analyst_options, critic_options)): i
+        for i in range(drafts)
+    }
+    finished, pending = [], set(tasks)
+
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if error := task.exception():
+                    print(f"\n[SPECULATIVE] Candidate {tasks[task] + 1} failed: {error}")
+                else:
+                    finished.append((tasks[task], task.result()))
+            if cancel_policy == "cancel" and _accepted(finished):
+                break
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    if pending:
+        print(f"\n[SPECULATIVE] Cancelled {len(pending)} candidates")
+    return select_candidate(state, finished)
@@ -0,0 +1,50 @@
+import time
+import threading
+from contextlib import contextmanager
+
+
+# Отсчет времени до готовности - с первого импорта этого модуля (импортируется первым)
+STARTED = time.perf_counter()
+
+_lock = threading.Lock()
+_config_loaded = False
+
+# (этап, секунды) в порядке завершения
+_phases: list = []
+
+
+def load_config():
+    """ Загрузка .env один раз на процесс; повторные вызовы ничего не делают """
+
+    global _config_loaded
+
+    with _lock:
+        if _config_loaded:
+            return
+        _config_loaded = True
+
+    with phase("load config"):
+        from dotenv import load_dotenv
+        load_dotenv()
+
+
+@contextmanager
+def phase(name: str):
+    """ Замер этапа запуска (импорт, компиляция графа) для startup_report """
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        with _lock:
+            _phases.append((name, time.perf_counter() - started))
+
+
+def startup_report(ready: str = "ready") -> str:
+    """ Разбивка времени запуска по этапам и время с начала запуска до готовности """
+
+    with _lock:
+        phases = list(_phases)
+    lines = [f"[STARTUP] {name}: {seconds:.3f}s" for name, seconds in phases]
+    lines.append(f"[STARTUP] {ready} in {time.perf_counter() - STARTED:.3f}s")
+    return "\n".join(lines)
@@ -31,8 +31,12 @@ class ProjectState(TypedDict):
     """
     Общее состояние для всех узлов графа.
 
-    - analyst_node обновляет: draft_artifact, revision_count
-    - critic_node обновляет: critic_feedback, critic_verdict
+    - warm_start обновляет: draft_artifact, critic_cache, warm_start (если найден похожий проект)
+    - analyst_node обновляет: draft_artifact, model_tiers, llm_error
+    - critic_node обновляет: critic_feedback, critic_verdict, critic_cache, model_tiers, best_candidate, llm_error
+    - increment обновляет: revision_count, budget_stop
+    - budget обновляет: budget_stop (и возвращает лучший черновик сессии)
+    - все узлы, кроме human, обновляют: elapsed_seconds, tokens_used
     - human_node обновляет: user_feedback, user_has_provided_feedback
     """
 
@@ -48,7 +52,32 @@ class ProjectState(TypedDict):
     # Вердикт критика
     critic_verdict: Literal["OK", "REVISE"] | None
 
-    # Счётчик попыток доработки (максимум три)
+    # Вердикты критика по уже проверенным частям артефакта (отпечаток -> вердикт)
+    critic_cache: dict
+
+    # Уровень модели (fast / reasoner), выбранный узлом в последний раз: {"analyst": ..., "critic": ...}
+    model_tiers: dict
+
+    # Ошибка связи с LLM в текущей итерации (не вердикт критика), см. resilience.py
+    llm_error: str | None
+
+    # Теплый старт: {"project_id", "similarity"} утвержденного проекта, с которого взят черновик
+    warm_start: dict | None
+
+    # Бюджет сессии (0 - без ограничения по времени / токенам), см. budget.py
+    max_revisions: int
+    time_budget: float
+    token_budget: int
+
+    # Расход сессии: секунды работы узлов (без ожидания человека) и токены LLM
+    elapsed_seconds: float
+    tokens_used: int
+
+    # Лучший черновик после последнего отзыва пользователя и причина остановки по бюджету
+    best_candidate: dict | None
+    budget_stop: str | None
+
+    # Счётчик попыток доработки (максимум max_revisions)
     revision_count: int
 
     # Замечания пользователя (свободный текст)
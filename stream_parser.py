@@ -0,0 +1,91 @@
+import json
+from pydantic import ValidationError
+
+from state import Requirement
+
+
+class RequirementStreamParser:
+    """
+    Инкрементальный разбор потокового JSON-ответа со схемой ProjectArtifact.
+
+    feed() принимает очередной кусок текста и возвращает требования из
+    functional_requirements, которые завершились в этом куске. Каждый символ
+    просматривается один раз, поэтому разбор всего ответа линеен по его длине.
+    """
+
+    KEY = '"functional_requirements"'
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.in_array = False
+        self.done = False
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.item_start = None
+
+    def feed(self, text: str) -> list:
+        self.buffer += text
+        if self.done:
+            return []
+
+        if not self.in_array and not self._find_array():
+            return []
+
+        found = []
+        buf = self.buffer
+        i = self.pos
+        while i < len(buf):
+            ch = buf[i]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch == "{":
+                if self.depth == 0:
+                    self.item_start = i
+                self.depth += 1
+            elif ch == "}":
+                self.depth -= 1
+                if self.depth == 0 and self.item_start is not None:
+                    if (item := self._parse_item(buf[self.item_start:i + 1])) is not None:
+                        found.append(item)
+                    self.item_start = None
+            elif ch == "]" and self.depth == 0:
+                self.done = True
+                i += 1
+                break
+            i += 1
+
+        self.pos = i
+        return found
+
+    def _find_array(self) -> bool:
+        """ Ищет начало массива требований; ключ может прийти разрезанным между кусками """
+
+        key_pos = self.buffer.find(self.KEY, max(0, self.pos - len(self.KEY)))
+        if key_pos < 0:
+            self.pos = len(self.buffer)
+            return False
+
+        bracket = self.buffer.find("[", key_pos + len(self.KEY))
+        if bracket < 0:
+            self.pos = key_pos
+            return False
+
+        self.in_array = True
+        self.pos = bracket + 1
+        return True
+
+    @staticmethod
+    def _parse_item(text: str) -> dict | None:
+        try:
+            return Requirement.model_validate(json.loads(text)).model_dump()
+        except (ValueError, ValidationError):
+            return None
@@ -0,0 +1,277 @@
+import re
+import json
+import types
+from typing import Any, List, Literal, Union, get_args, get_origin
+
+from pydantic import BaseModel, ValidationError
+from langchain_core.exceptions import OutputParserException
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.output_parsers import BaseOutputParser
+
+from llm_cache import forget_response
+
+
+# Режимы структурированного вывода: json - response_format провайдера, tools - вызов функции,
+# prompt - полная JSON-схема в промпте (как раньше)
+STRUCTURED_MODES = ("json", "tools", "prompt")
+
+FENCE = re.compile(r"```(?:json|JSON)?\s*(.*?)```", re.S)
+TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+REASK_SYSTEM = "Ты исправляешь JSON-ответы. Отвечай только JSON-объектом, без пояснений и markdown."
+
+# Сколько символов исходного ответа отдавать на повторный запрос
+REASK_TEXT_LIMIT = 8000
+
+
+def _unwrap_optional(annotation):
+    if get_origin(annotation) in (Union, types.UnionType):
+        args = [a for a in get_args(annotation) if a is not type(None)]
+        if len(args) == 1:
+            return args[0]
+    return annotation
+
+
+def _example(annotation, description: str | None):
+    annotation = _unwrap_optional(annotation)
+    origin = get_origin(annotation)
+
+    if origin is Literal:
+        return " | ".join(str(a) for a in get_args(annotation))
+    if origin in (list, List):
+        return [_example(get_args(annotation)[0], description)]
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return schema_skeleton(annotation)
+    return f"<{description or 'строка'}>"
+
+
+def schema_skeleton(schema) -> dict:
+    """ Пример объекта схемы: описания полей в угловых скобках вместо значений """
+
+    return {name: _example(field.annotation, field.description) for name, field in schema.model_fields.items()}
+
+
+def compact_instructions(schema) -> str:
+    """ Короткие инструкции по формату вместо полной JSON-схемы (для json / tools режимов) """
+
+    skeleton = json.dumps(schema_skeleton(schema), ensure_ascii=False, indent=2)
+    return f"Ответ - один JSON-объект такого вида (в угловых скобках - что подставить):\n{skeleton}"
+
+
+def message_text(message) -> str:
+    """ Текст ответа модели; при вызове функции - ее аргументы в JSON """
+
+    message = getattr(message, "message", message)
+    tool_calls = getattr(message, "tool_calls", None)
+    if tool_calls:
+        return json.dumps(tool_calls[0]["args"], ensure_ascii=False)
+    return getattr(message, "text", None) or ""
+
+
+def chunk_text(chunk) -> str:
+    """ Кусок потокового ответа: текст или фрагмент аргументов вызова функции """
+
+    if text := chunk.text:
+        return text
+    return "".join(tc.get("args") or "" for tc in getattr(chunk, "tool_call_chunks", None) or [])
+
+
+def extract_json(text: str) -> str | None:
+    """
+    Первый JSON-объект в тексте: без markdown-ограждений и текста до/после.
+
+    Оборванный объект дописывается закрывающими кавычками и скобками.
+    """
+
+    if fenced := FENCE.search(text):
+        text = fenced.group(1)
+
+    start = text.find("{")
+    if start < 0:
+        return None
+
+    stack = []
+    in_string = escape = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            if stack:
+                stack.pop()
+            if not stack:
+                return text[start:i + 1]
+
+    tail = '"' if in_string else ""
+    return text[start:].rstrip().rstrip(",") + tail + "".join(reversed(stack))
+
+
+def repair_json(text: str) -> dict | None:
+    """ Разбор почти валидного JSON (ограждения, текст вокруг, висячие запятые, обрыв) """
+
+    try:
+        data = json.loads(text)
+        if isinstance(data, dict):
+            return data
+    except ValueError:
+        pass
+
+    candidate = extract_json(text)
+    if candidate is None:
+        return None
+
+    for attempt in (candidate, TRAILING_COMMA.sub(r"\1", candidate)):
+        try:
+            data = json.loads(attempt)
+        except ValueError:
+            continue
+        if isinstance(data, dict):
+            return data
+    return None
+
+
+def fill_defaults(data: dict, schema) -> dict:
+    """ Пропущенные обязательные списки и строки заполняются пустыми значениями """
+
+    data = dict(data)
+    for name, field in schema.model_fields.items():
+        annotation = _unwrap_optional(field.annotation)
+        origin = get_origin(annotation)
+
+        if name not in data and field.is_required():
+            if origin in (list, List):
+                data[name] = []
+            elif annotation is str:
+                data[name] = ""
+
+        item = get_args(annotation)[0] if origin in (list, List) else None
+        if isinstance(item, type) and issubclass(item, BaseModel) and isinstance(data.get(name), list):
+            data[name] = [fill_defaults(v, item) if isinstance(v, dict) else v for v in data[name]]
+
+    return data
+
+
+class StructuredOutputParser(BaseOutputParser):
+    """
+    Разбор ответа LLM в pydantic-схему с локальным ремонтом.
+
+    Если ответ не разбирается даже после ремонта (repair_json, fill_defaults),
+    модель llm переспрашивается один раз: только про поля, не прошедшие валидацию,
+    или - если JSON не извлекается вовсе - о переводе ответа в JSON.
+    """
+
+    pydantic_object: Any
+    llm: Any = None
+
+    @property
+    def _type(self) -> str:
+        return "structured_output"
+
+    def _validate(self, data: dict) -> tuple:
+        """ (результат, данные, ошибки валидации) """
+
+        data = fill_defaults(data, self.pydantic_object)
+        try:
+            return self.pydantic_object.model_validate(data), data, None
+        except ValidationError as e:
+            return None, data, e
+
+    def _attempt(self, text: str) -> tuple:
+        data = repair_json(text)
+        if data is None:
+            return None, None, None
+        return self._validate(data)
+
+    def _can_reask(self, error: ValidationError | None) -> bool:
+        # Лишние поля (например, полный артефакт вместо патча) переспрашиванием не исправить
+        if error is not None and all(e["type"] == "extra_forbidden" for e in error.errors()):
+            return False
+        return self.llm is not None
+
+    def _reask_messages(self, text: str, data: dict | None, error: ValidationError | None) -> tuple:
+        """ (сообщения для повторного запроса, поля для подстановки или None - весь объект) """
+
+        skeleton = schema_skeleton(self.pydantic_object)
+
+        if data is None:
+            prompt = (
+                "Ответ ниже не удалось разобрать как JSON. Перепиши его в JSON-объект такого вида:\n"
+                f"{json.dumps(skeleton, ensure_ascii=False, indent=2)}\n\n"
+                f"Ответ:\n{text[:REASK_TEXT_LIMIT]}"
+            )
+            return [SystemMessage(REASK_SYSTEM), HumanMessage(prompt)], None
+
+        fields = sorted({str(e["loc"][0]) for e in error.errors() if e["loc"]}) or list(skeleton)
+        problems = "\n".join(f"- {'.'.join(map(str, e['loc']))}: {e['msg']}" for e in error.errors())
+        current = {k: data.get(k) for k in fields}
+        prompt = (
+            f"В JSON-ответе поля {', '.join(fields)} не прошли проверку:\n{problems}\n\n"
+            f"Текущие значения:\n{json.dumps(current, ensure_ascii=False, indent=2)}\n\n"
+            "Верни JSON-объект только с исправленными полями такого вида:\n"
+            f"{json.dumps({k: skeleton.get(k) for k in fields}, ensure_ascii=False, indent=2)}"
+        )
+        return [SystemMessage(REASK_SYSTEM), HumanMessage(prompt)], fields
+
+    def _fail(self, text: str, error):
+        raise OutputParserException(
+            f"Не удалось разобрать ответ как {self.pydantic_object.__name__}: {error or 'JSON не найден'}",
+            llm_output=text,
+        )
+
+    def _merge(self, text: str, data: dict | None, fields: list | None, messages: list, fixed_text: str):
+        """
+        Подстановка ответа на повторный запрос; вторая неудача - OutputParserException.
+
+        Негодный ответ на повторный запрос удаляется из кэша ответов.
+        """
+
+        fixed = repair_json(fixed_text)
+        if fixed is not None and fields is not None:
+            fixed = {**data, **{k: v for k, v in fixed.items() if k in fields}}
+
+        result, _, error = self._validate(fixed) if fixed is not None else (None, None, None)
+        if result is None:
+            forget_response(self.llm, messages)
+            self._fail(text, error)
+
+        print(f"\n[STRUCTURED] Repaired {self.pydantic_object.__name__} with a targeted re-ask"
+              f" ({', '.join(fields) if fields else 'whole object'})")
+        return result
+
+    def parse(self, text: str):
+        result, data, error = self._attempt(text)
+        if result is not None:
+            return result
+        if not self._can_reask(error):
+            self._fail(text, error)
+
+        messages, fields = self._reask_messages(text, data, error)
+        return self._merge(text, data, fields, messages, message_text(self.llm.invoke(messages)))
+
+    async def aparse(self, text: str):
+        result, data, error = self._attempt(text)
+        if result is not None:
+            return result
+        if not self._can_reask(error):
+            self._fail(text, error)
+
+        messages, fields = self._reask_messages(text, data, error)
+        return self._merge(text, data, fields, messages, message_text(await self.llm.ainvoke(messages)))
+
+    def parse_result(self, result: list, *, partial: bool = False):
+        return self.parse(message_text(result[0]))
+
+    async def aparse_result(self, result: list, *, partial: bool = False):
+        return await self.aparse(message_text(result[0]))
+
+    def get_format_instructions(self) -> str:
+        return compact_instructions(self.pydantic_object)
@@ -0,0 +1,250 @@
+import os
+import re
+import json
+import time
+import random
+import sqlite3
+import hashlib
+import threading
+
+
+DEFAULT_INDEX_PATH = "warm_start.sqlite"
+DEFAULT_MAX_ENTRIES = 10000
+
+# Минимальное сходство (Жаккар по шинглам) описаний для теплого старта
+DEFAULT_THRESHOLD = 0.5
+
+# Описания почти совпадают: новый утвержденный артефакт заменяет прежний
+DUPLICATE_THRESHOLD = 0.95
+
+# Шинглы по SHINGLE_SIZE символов; сигнатура MinHash из BANDS * ROWS хэшей.
+# LSH находит кандидатов со сходством примерно от (1 / BANDS) ** (1 / ROWS) ~ 0.31
+# (при сходстве 0.5 - с вероятностью ~0.99)
+SHINGLE_SIZE = 5
+BANDS = 32
+ROWS = 3
+NUM_HASHES = BANDS * ROWS
+
+_PRIME = (1 << 61) - 1
+_rng = random.Random(20240601)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_HASHES)]
+
+NON_WORD = re.compile(r"[^\w]+")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS projects (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    description TEXT NOT NULL,
+    artifact TEXT NOT NULL,
+    critic_cache TEXT NOT NULL,
+    signature TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS bands (
+    band INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    project_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS bands_lookup ON bands (band, hash);
+CREATE INDEX IF NOT EXISTS bands_project ON bands (project_id);
+"""
+
+
+def shingles(text: str) -> set:
+    """ Символьные шинглы нормализованного текста (регистр, пунктуация и пробелы не важны) """
+
+    text = " ".join(NON_WORD.sub(" ", text.lower()).split())
+    if len(text) <= SHINGLE_SIZE:
+        return {text} if text else set()
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def jaccard(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def minhash(items: set) -> list:
+    """ Сигнатура MinHash: минимум каждой из NUM_HASHES хэш-функций по шинглам """
+
+    if not items:
+        return [0] * NUM_HASHES
+    base = [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big") for s in items]
+    return [min((a * h + b) % _PRIME for h in base) for a, b in _PERMUTATIONS]
+
+
+def band_keys(signature: list) -> list:
+    """ Ключи LSH: по одному на полосу из ROWS подряд идущих хэшей """
+
+    return [
+        hashlib.blake2b(json.dumps(signature[i * ROWS:(i + 1) * ROWS]).encode(), digest_size=8).hexdigest()
+        for i in range(BANDS)
+    ]
+
+
+class ProjectIndex:
+    """
+    Локальный индекс утвержденных артефактов по сходству описаний проектов.
+
+    Кандидаты ищутся через LSH по сигнатурам MinHash (без полного перебора),
+    итоговое сходство - точный Жаккар по шинглам описаний. Вместе с артефактом
+    хранятся вердикты критика (critic_cache): неизмененные требования при
+    теплом старте повторно не проверяются. Размер ограничен max_entries.
+    """
+
+    def __init__(self, path: str = DEFAULT_INDEX_PATH, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        self.conn.executescript(SCHEMA)
+
+    def _candidates(self, keys: list) -> list:
+        placeholders = " OR ".join("(band = ? AND hash = ?)" for _ in keys)
+        params = [v for band, key in enumerate(keys) for v in (band, key)]
+        return self.conn.execute(
+            f"SELECT DISTINCT p.id, p.description, p.artifact, p.critic_cache FROM bands b "
+            f"JOIN projects p ON p.id = b.project_id WHERE {placeholders}",
+            params,
+        ).fetchall()
+
+    def search(self, description: str) -> tuple | None:
+        """ Самый похожий проект: (id, сходство, артефакт, critic_cache) или None """
+
+        items = shingles(description)
+        keys = band_keys(minhash(items))
+
+        with self.lock:
+            rows = self._candidates(keys)
+
+        best = None
+        for project_id, text, artifact, critic_cache in rows:
+            similarity = jaccard(items, shingles(text))
+            if best is None or similarity > best[1]:
+                best = (project_id, similarity, artifact, critic_cache)
+
+        if best is None:
+            return None
+        project_id, similarity, artifact, critic_cache = best
+        return project_id, similarity, json.loads(artifact), json.loads(critic_cache)
+
+    def lookup(self, description: str, threshold: float = DEFAULT_THRESHOLD) -> tuple | None:
+        """ Проект для теплого старта, если сходство не ниже threshold """
+
+        found = self.search(description)
+        if found is None or found[1] < threshold:
+            return None
+        return found
+
+    def add(self, description: str, artifact: dict, critic_cache: dict | None = None) -> int:
+        """ Добавление утвержденного артефакта; почти такой же проект заменяется """
+
+        items = shingles(description)
+        signature = minhash(items)
+        keys = band_keys(signature)
+        # В индексе только принятые критиком части: остальное при теплом старте проверится заново
+        accepted = {k: v for k, v in (critic_cache or {}).items() if v.get("verdict") == "OK"}
+
+        with self.lock:
+            duplicates = [row[0] for row in self._candidates(keys) if jaccard(items, shingles(row[1])) >= DUPLICATE_THRESHOLD]
+            if duplicates:
+                self._delete(duplicates)
+
+            project_id = self.conn.execute(
+                "INSERT INTO projects (description, artifact, critic_cache, signature, created_at) VALUES (?, ?, ?, ?, ?)",
+                (description, json.dumps(artifact, ensure_ascii=False), json.dumps(accepted, ensure_ascii=False),
+                 json.dumps(signature), time.time()),
+            ).lastrowid
+            self.conn.executemany(
+                "INSERT INTO bands (band, hash, project_id) VALUES (?, ?, ?)",
+                [(band, key, project_id) for band, key in enumerate(keys)],
+            )
+            self._evict()
+
+        return project_id
+
+    def _delete(self, project_ids: list):
+        placeholders = ",".join("?" * len(project_ids))
+        self.conn.execute(f"DELETE FROM bands WHERE project_id IN ({placeholders})", project_ids)
+        self.conn.execute(f"DELETE FROM projects WHERE id IN ({placeholders})", project_ids)
+
+    def _evict(self):
+        count = self.conn.execute("SELECT COUNT(*) FROM projects").fetchone()[0]
+        if count > self.max_entries:
+            old = [row[0] for row in self.conn.execute(
+                "SELECT id FROM projects ORDER BY created_at LIMIT ?", (count - self.max_entries,)
+            )]
+            self._delete(old)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+_index: ProjectIndex | None = None
+_index_lock = threading.Lock()
+
+
+def get_project_index() -> ProjectIndex | None:
+    """ Общий индекс процесса; None, если теплый старт выключен (WARM_START=0) """
+
+    global _index
+
+    if os.getenv("WARM_START", "1") == "0":
+        return None
+
+    with _index_lock:
+        if _index is None:
+            _index = ProjectIndex(
+                path=os.getenv("WARM_START_PATH", DEFAULT_INDEX_PATH),
+                max_entries=int(os.getenv("WARM_START_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+            )
+        return _index
+
+
+def remember_approved(state: dict):
+    """ Утвержденный человеком артефакт сессии - в индекс теплого старта """
+
+    index = get_project_index()
+    artifact = state.get("draft_artifact")
+    if index is None or not artifact or not state.get("project_description"):
+        return
+
+    try:
+        project_id = index.add(state["project_description"], artifact, state.get("critic_cache"))
+        print(f"[WARM START] Approved project indexed as #{project_id}")
+    except sqlite3.Error as e:
+        print(f"[WARM START] Indexing failed: {e}")
+
+
+def warm_start_node(state: dict) -> dict:
+    """
+    Теплый старт: если новое описание проекта почти совпадает с уже утвержденным,
+    его артефакт становится исходным черновиком, а вердикты - critic_cache.
+
+    Срабатывает только до первого черновика сессии.
+    """
+
+    index = get_project_index()
+    if index is None or state.get("draft_artifact"):
+        return {}
+
+    threshold = float(os.getenv("WARM_START_THRESHOLD", DEFAULT_THRESHOLD))
+    try:
+        found = index.lookup(state.get("project_description") or "", threshold)
+    except sqlite3.Error as e:
+        print(f"[WARM START] Lookup failed: {e}")
+        return {}
+    if found is None:
+        return {}
+
+    project_id, similarity, artifact, critic_cache = found
+    print(f"\n[WARM START] Seeding draft from approved project #{project_id} (similarity {similarity:.2f})")
+    return {
+        "draft_artifact": artifact,
+        "critic_cache": critic_cache,
+        "warm_start": {"project_id": project_id, "similarity": round(similarity, 3)},
+    }
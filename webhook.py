@@ -0,0 +1,184 @@
+import os
+import queue
+import asyncio
+import argparse
+import multiprocessing
+from aiohttp import ClientSession, web
+
+import startup
+
+
+startup.load_config()
+
+DEFAULT_WORKERS = 2
+DEFAULT_QUEUE_SIZE = 100
+DEFAULT_HOST = "0.0.0.0"
+DEFAULT_PORT = 8080
+DEFAULT_PATH = "/telegram"
+DEFAULT_API_URL = "https://api.telegram.org"
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# Поля Update, в которых лежит сообщение с чатом
+MESSAGE_FIELDS = ("message", "edited_message", "channel_post", "edited_channel_post")
+CHAT_FIELDS = ("my_chat_member", "chat_member", "chat_join_request")
+
+
+def update_chat_id(update: dict) -> int | None:
+    """ chat_id из Update Telegram (None, если обновление не относится к чату) """
+
+    for field in MESSAGE_FIELDS + CHAT_FIELDS:
+        if chat := (update.get(field) or {}).get("chat"):
+            return chat.get("id")
+
+    if callback := update.get("callback_query"):
+        chat = (callback.get("message") or {}).get("chat") or callback.get("from") or {}
+        return chat.get("id")
+
+    return None
+
+
+def shard(chat_id: int | None, workers: int) -> int:
+    """ Номер рабочего процесса для чата: все обновления чата попадают в один процесс """
+
+    return chat_id % workers if chat_id is not None else 0
+
+
+def worker_main(index: int, updates):
+    # Бот и граф создаются в самом рабочем процессе; чекпоинтер - общий SQLite-файл
+    import bot
+    asyncio.run(consume_updates(bot, index, updates))
+
+
+async def consume_updates(bot_module, index: int, updates):
+    """ Цикл рабочего процесса: обновления из очереди - в обработчики бота; None - остановка """
+
+    from telebot.types import Update
+
+    print(f"[WEBHOOK] Worker {index} started (pid {os.getpid()})")
+    print(bot_module.startup.startup_report(f"worker {index} ready"))
+    asyncio.create_task(bot_module.warm_up())
+    asyncio.create_task(bot_module.evict_idle_sessions())
+    loop = asyncio.get_running_loop()
+
+    while (raw := await loop.run_in_executor(None, updates.get)) is not None:
+        try:
+            await bot_module.bot.process_new_updates([Update.de_json(raw)])
+        except Exception as e:
+            print(f"[WEBHOOK] Worker {index}: update {raw.get('update_id')} failed: {e}")
+
+    # Доделываем начатые и поставленные в очередь прогоны чатов
+    await bot_module.chat_queue.join()
+    print(f"[WEBHOOK] Worker {index} stopped")
+
+
+class WebhookServer:
+    """
+    HTTP-сервер для webhook Telegram с пулом рабочих процессов.
+
+    Обновления раскладываются по workers процессам по chat_id (shard): прогоны
+    одного чата остаются в одном процессе и сериализуются его ChatQueue. Очередь
+    каждого процесса ограничена queue_size; при переполнении Telegram получает 503
+    и повторяет доставку позже. Сессии живут в общем SQLite-чекпоинтере, поэтому
+    после перезапуска с другим числом процессов чат продолжит любой из них.
+    """
+
+    def __init__(self, workers: int = DEFAULT_WORKERS, queue_size: int = DEFAULT_QUEUE_SIZE,
+                 path: str = DEFAULT_PATH, secret: str | None = None):
+        context = multiprocessing.get_context("spawn")
+        self.path = path
+        self.secret = secret
+        self.queues = [context.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.processes = [
+            context.Process(target=worker_main, args=(i, q), name=f"bot-worker-{i}")
+            for i, q in enumerate(self.queues)
+        ]
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if self.secret and request.headers.get(SECRET_HEADER) != self.secret:
+            return web.Response(status=403)
+
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+
+        index = shard(update_chat_id(update), len(self.queues))
+        try:
+            self.queues[index].put_nowait(update)
+        except queue.Full:
+            print(f"[WEBHOOK] Worker {index} queue is full, update {update.get('update_id')} deferred")
+            return web.Response(status=503)
+        return web.Response(text="ok")
+
+    async def health(self, request: web.Request) -> web.Response:
+        alive = [p.is_alive() for p in self.processes]
+        return web.json_response({"workers": len(alive), "alive": sum(alive)}, status=200 if all(alive) else 503)
+
+    async def start_workers(self, _app=None):
+        for process in self.processes:
+            process.start()
+
+    async def stop_workers(self, _app=None):
+        for q in self.queues:
+            q.put(None)
+        loop = asyncio.get_running_loop()
+        for process in self.processes:
+            await loop.run_in_executor(None, process.join)
+
+    def application(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get("/healthz", self.health)
+        app.on_startup.append(self.start_workers)
+        app.on_cleanup.append(self.stop_workers)
+        return app
+
+
+async def set_webhook(url: str, secret: str | None = None, api_url: str | None = None):
+    """ Регистрация webhook в Bot API (TG_API_URL - для локального или тестового сервера) """
+
+    api_url = (api_url or os.getenv("TG_API_URL") or DEFAULT_API_URL).rstrip("/")
+    payload = {"url": url}
+    if secret:
+        payload["secret_token"] = secret
+
+    async with ClientSession() as session:
+        async with session.post(f"{api_url}/bot{os.getenv('TG_BOT_TOKEN')}/setWebhook", json=payload) as resp:
+            result = await resp.json()
+    if not result.get("ok"):
+        raise RuntimeError(f"setWebhook failed: {result}")
+    print(f"[WEBHOOK] Webhook registered: {url}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бот в режиме webhook с пулом рабочих процессов")
+    parser.add_argument("--host", default=os.getenv("WEBHOOK_HOST", DEFAULT_HOST))
+    parser.add_argument("--port", type=int, default=int(os.getenv("WEBHOOK_PORT", DEFAULT_PORT)))
+    parser.add_argument("--path", default=os.getenv("WEBHOOK_PATH", DEFAULT_PATH), help="Путь приема обновлений")
+    parser.add_argument("-w", "--workers", type=int, default=int(os.getenv("WEBHOOK_WORKERS", DEFAULT_WORKERS)),
+                        help="Число рабочих процессов")
+    parser.add_argument("--queue-size", type=int, default=int(os.getenv("WEBHOOK_QUEUE_SIZE", DEFAULT_QUEUE_SIZE)),
+                        help="Обновлений в очереди одного процесса")
+    parser.add_argument("--url", default=os.getenv("WEBHOOK_URL"),
+                        help="Публичный адрес webhook для setWebhook (без него webhook не регистрируется)")
+    args = parser.parse_args()
+
+    if not os.getenv("TG_BOT_TOKEN"):
+        print("Не задан TG_BOT_TOKEN в .env или коде")
+        exit()
+    if os.getenv("CHECKPOINTER", "sqlite").lower() != "sqlite":
+        print("[WEBHOOK] CHECKPOINTER is not sqlite: sessions are not shared between workers")
+
+    secret = os.getenv("WEBHOOK_SECRET") or None
+    server = WebhookServer(args.workers, args.queue_size, args.path, secret)
+    app = server.application()
+    if args.url:
+        app.on_startup.append(lambda _app: set_webhook(args.url, secret))
+
+    print(f"[WEBHOOK] Listening on {args.host}:{args.port}{args.path} with {args.workers} workers")
+    web.run_app(app, host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()